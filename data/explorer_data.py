@@ -15,6 +15,10 @@ class LeafGridSearchConfig:
     _argument_group_name = "Leaf Grid Search Parameters"
     lower_size_bound: float = field(default=2.5, metadata={"help": "lower size bound in meters, used to prune nodes with small size"})
     score_threshold: float = field(default=0.3, metadata={"help": "lower score threshold"})
+    grid_divider: int = field(default=5, metadata={"help": "the coarse lattice of each leaf has grid_divider-2 points per axis"})
+    grid_max_depth: int = field(default=0, metadata={"help": "maximum number of subdivisions around the promising grid cells (0: coarse lattice only)"})
+    grid_margin: float = field(default=0.05, metadata={"help": "grid cells whose best score is within this margin of the best score of the leaf are subdivided"})
+    grid_render_budget: int = field(default=0, metadata={"help": "maximum number of renders per leaf in the grid search including the reference renders of the best samples, the coarse lattice is coarsened to fit (0: unlimited)"})
 
 
 @dataclass
@@ -26,6 +30,7 @@ class HOOConfig:
     # Metagrapher hyperparameters
     num_updates: int = field(default=300, metadata={"help": "maximum number of nodes to be explored"})
     num_local_dir: int = field(default=21, metadata={"help": "number of camera directions to be sampled each nodes"})
+    num_local_pos: int = field(default=0, metadata={"help": "number of camera positions perturbed by 1m around the center of each nodes"})
 
     # Hierarchical Optimistic Optimization (HOO) hyperparameters
     c: Optional[float] = field(default=0.2, metadata={"help": "HOO hyperparameter c(exploration term), must be greater than 0."})
@@ -43,3 +48,121 @@ class RenderAPIConfig:
     _argument_group_name = "Render API Parameters"
     api_host: Optional[str] = field(default=None, metadata={"help": "host for render server"})
     api_port: int = field(default=8080, metadata={"help": "port for render server"})
+    record_archive: Optional[str] = field(default=None, metadata={"help": "record the responses of the render server into this directory, replay them with render_server.replay_render_server"})
+
+
+@dataclass
+class DepthPrePassConfig:
+    _argument_group_name = "Depth Pre-pass Parameters"
+    depth_pre_pass: bool = field(default=False, metadata={"help": "render tiny depth maps first and skip directions facing nearby walls"})
+    depth_threshold: float = field(default=1.0, metadata={"help": "directions whose median depth in meters is below this value are not rendered"})
+    depth_texture_size: int = field(default=8, metadata={"help": "resolution of the depth maps used by the pre-pass"})
+    depth_pruned_score: float = field(default=0.0, metadata={"help": "score given to the directions dropped by the pre-pass"})
+
+
+@dataclass
+class OccupancyGridConfig:
+    _argument_group_name = "Occupancy Grid Parameters"
+    occupancy_grid: bool = field(default=False, metadata={"help": "reject HOO cell centers inside colliders without rendering"})
+    occupancy_voxel_size: float = field(default=0.5, metadata={"help": "voxel size of the occupancy grid in meters"})
+    occupancy_cache_dir: str = field(default="./output/occupancy_cache", metadata={"help": "directory to cache the occupancy grid of each world"})
+    occupancy_keep_largest_region: bool = field(default=True, metadata={"help": "treat free voxels outside the largest connected region as unreachable"})
+    occupancy_world: str = field(default="", metadata={"help": "name of the world, the key of its cached occupancy grid (empty: the name of the batch world or the host and the port of the render server)"})
+    occupancy_refresh: bool = field(default=False, metadata={"help": "fetch the occupancy grid from the render server again and overwrite the cached one, e.g. after the world was edited"})
+    invalid_position_strategy: str = field(default="move", metadata={"help": "how to handle cell centers inside colliders (move: move to the nearest free voxel in the cell, score: score without rendering)"})
+    invalid_score: float = field(default=0.0, metadata={"help": "score given to the cells without any free voxel"})
+
+
+@dataclass
+class MultiFidelityConfig:
+    _argument_group_name = "Multi-fidelity Rendering Parameters"
+    resolution_schedule: str = field(default="", metadata={"help": "render resolution per HOO depth as depth:size pairs, e.g. 0:56,6:112,12:224 (empty: always full resolution)"})
+    full_texture_size: int = field(default=224, metadata={"help": "full render resolution"})
+    multi_fidelity_top_k: int = field(default=10, metadata={"help": "number of low resolution photospots re-scored at full resolution for the report"})
+
+
+@dataclass
+class DirectionSearchConfig:
+    _argument_group_name = "Direction Search Parameters"
+    direction_search: str = field(default="uniform", metadata={"help": "how to choose the camera directions of each node (uniform: fibonacci sphere, successive_halving: refine around the best directions over several rounds)"})
+    sh_num_rounds: int = field(default=3, metadata={"help": "number of rounds of the successive halving direction search"})
+    sh_keep_ratio: float = field(default=0.25, metadata={"help": "fraction of the best directions refined in the next round of the successive halving direction search"})
+
+
+@dataclass
+class PoseRefinementConfig:
+    _argument_group_name = "Pose Refinement Parameters"
+    refine_generations: int = field(default=10, metadata={"help": "number of CMA-ES generations of the pose refinement in each leaf"})
+    refine_population_size: int = field(default=8, metadata={"help": "number of candidates per generation of each CMA-ES"})
+    refine_num_starts: int = field(default=3, metadata={"help": "number of the best stored photospots of the leaf used as starting points"})
+    refine_sigma: float = field(default=0.15, metadata={"help": "initial step size relative to the leaf size and the angle ranges"})
+    refine_optimize_fov: bool = field(default=False, metadata={"help": "optimize the field of view as well"})
+    refine_fov_min: float = field(default=40.0, metadata={"help": "minimum field of view in degrees"})
+    refine_fov_max: float = field(default=80.0, metadata={"help": "maximum field of view in degrees"})
+
+
+@dataclass
+class SurrogateConfig:
+    _argument_group_name = "Surrogate Score Model Parameters"
+    surrogate: bool = field(default=False, metadata={"help": "give nodes which cannot beat the best node value their predicted value instead of rendering them"})
+    surrogate_k: int = field(default=8, metadata={"help": "number of neighbours of the kNN surrogate"})
+    surrogate_direction_weight: float = field(default=1.0, metadata={"help": "meters per unit difference of the camera directions in the kNN distance"})
+    surrogate_length_scale: float = field(default=2.0, metadata={"help": "distance in meters at which the surrogate uncertainty reaches surrogate_prior_std"})
+    surrogate_prior_std: float = field(default=0.2, metadata={"help": "score standard deviation far from any sample"})
+    surrogate_beta: float = field(default=2.0, metadata={"help": "upper confidence bound is mean + beta * std"})
+    surrogate_margin: float = field(default=0.05, metadata={"help": "nodes whose upper confidence bound is below the best node value by this margin are imputed"})
+    surrogate_min_samples: int = field(default=200, metadata={"help": "number of rendered images before the surrogate is used"})
+    surrogate_verify_fraction: float = field(default=0.1, metadata={"help": "fraction of the imputable nodes rendered anyway to measure the surrogate error"})
+
+
+@dataclass
+class SampleReuseConfig:
+    _argument_group_name = "Sample Reuse Parameters"
+    sample_reuse: str = field(default="off", metadata={"help": "reuse the samples already inside a new cell (off, shrink: do not render the directions covered by a sample, skip: value cells holding enough samples without rendering)"})
+    reuse_region_scale: float = field(default=1.0, metadata={"help": "only the samples inside the cell scaled by this ratio around its center are reused"})
+    reuse_max_angle: float = field(default=10.0, metadata={"help": "maximum angle in degrees between a proposed direction and a reused sample (shrink)"})
+    reuse_min_samples: int = field(default=21, metadata={"help": "number of samples inside a cell needed to skip it (skip)"})
+
+
+@dataclass
+class EmbeddingCacheConfig:
+    _argument_group_name = "Embedding Cache Parameters"
+    embedding_cache: bool = field(default=False, metadata={"help": "store the scoring net embedding of every scored image with its camera pose in {log_root}/explore_{session id}_embeddings"})
+    embedding_dtype: str = field(default="float16", metadata={"help": "dtype of the stored embeddings (float16 or float32)"})
+
+
+@dataclass
+class NodeLogConfig:
+    _argument_group_name = "Node Log Parameters"
+    node_log_writer: str = field(default="buffered", metadata={"help": "how the nodes are written to the log (buffered: batched on a background thread, sync: one write per node on the exploration thread)"})
+    node_log_flush_interval: float = field(default=1.0, metadata={"help": "interval in seconds between the flushes of the buffered log"})
+    node_log_batch_size: int = field(default=256, metadata={"help": "maximum number of nodes written at once by the buffered log"})
+    node_log_fsync: str = field(default="close", metadata={"help": "when the buffered log is fsynced (never, flush, close)"})
+    node_log_compress: bool = field(default=False, metadata={"help": "compress the buffered log with gzip (.jsonl.gz)"})
+    node_log_max_queue_size: int = field(default=0, metadata={"help": "maximum number of queued nodes before the exploration waits for the writer (0: unbounded)"})
+
+
+@dataclass
+class NodeUploadConfig:
+    _argument_group_name = "Node Upload Parameters"
+    node_upload_chunk_size: int = field(default=256, metadata={"help": "number of display nodes sent to the render server per request when a log is loaded"})
+    node_upload_compress: bool = field(default=False, metadata={"help": "compress the node upload requests with gzip (the render server must accept Content-Encoding: gzip)"})
+    node_upload_lod_top_k: int = field(default=0, metadata={"help": "number of best scored nodes, with their ancestors, uploaded before the rest of the tree (0: disabled)"})
+    node_upload_lod_max_depth: int = field(default=-1, metadata={"help": "maximum depth of the nodes uploaded before the rest of the tree (-1: disabled)"})
+
+
+@dataclass
+class TraceConfig:
+    _argument_group_name = "Trace Parameters"
+    trace: bool = field(default=False, metadata={"help": "record every TimeMeasure scope as a Chrome trace event and write {log_root}/explore_{session}_trace.json (open it in Perfetto)"})
+    trace_buffer_size: int = field(default=1000000, metadata={"help": "maximum number of trace events kept, the oldest events are dropped first"})
+
+
+@dataclass
+class ProfileConfig:
+    _argument_group_name = "Profile Parameters"
+    profile: str = field(default="", metadata={"help": "comma separated profilers to run on the exploration (cprofile, torch, tracemalloc), the artifacts are written to {log_root}/explore_{session}_*"})
+    profile_start: int = field(default=0, metadata={"help": "first iteration profiled by cprofile and torch"})
+    profile_iterations: int = field(default=50, metadata={"help": "number of iterations profiled by cprofile and torch"})
+    profile_memory_interval: int = field(default=100, metadata={"help": "iterations between the tracemalloc snapshots"})
+    profile_memory_top: int = field(default=30, metadata={"help": "number of allocation sites written per tracemalloc snapshot"})
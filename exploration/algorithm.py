@@ -3,7 +3,9 @@ import itertools
 import numpy as np
 
 from render_server.render_api_data import BoundingBox
-from .hoo import HOO
+from .hoo import HOO, Node
+from .occupancy_grid import OccupancyGrid
+from .sample_reuse import SampleReuse
 
 
 def generate_list_dir(n):
@@ -26,7 +28,7 @@ def generate_list_dir(n):
     return list_dir
 
 
-from typing import List, Iterable, Tuple, Generator, Optional
+from typing import List, Iterable, Tuple, Generator, Optional, Iterator
 
 
 def update_diff(dir_counter, num_local_dir, list_directions, num_local_pos, list_pos_diff, pos_counter, node_position,
@@ -61,8 +63,12 @@ def update_diff(dir_counter, num_local_dir, list_directions, num_local_pos, list
 
 
 class HOOExplorer():
-    def __init__(self, c, v1, rho, policyName, num_pos_diff, num_dir, value_storategy="mean") -> None:
-        self.rollout = Rollout(num_pos_diff=num_pos_diff, num_dir=num_dir)
+    def __init__(self, c, v1, rho, policyName, num_pos_diff, num_dir, value_storategy="mean",
+                 invalid_position_strategy="move", invalid_score=0.0, max_rejections=1000,
+                 rollout: Optional['Rollout'] = None, sample_reuse: Optional[SampleReuse] = None) -> None:
+        self.rollout = rollout if rollout is not None else Rollout(num_pos_diff=num_pos_diff, num_dir=num_dir)
+        # spatial store of the scored samples, seeds the first visit of new cells
+        self.sample_reuse = sample_reuse
         self.model: Optional[HOO] = None
         self.node_pos = None
         self.c = c
@@ -74,12 +80,59 @@ class HOOExplorer():
         self.value_storategy = value_storategy
         self.depth = None  # depth of current node
 
-    def setup_model(self, bbox: BoundingBox):
+        # cell centers inside solid geometry are either moved to the nearest free voxel ("move")
+        # or scored with invalid_score without rendering ("score")
+        assert invalid_position_strategy in ["move", "score"]
+        self.occupancy_grid: Optional[OccupancyGrid] = None
+        self.invalid_position_strategy = invalid_position_strategy
+        self.invalid_score = invalid_score
+        self.max_rejections = max_rejections
+        self.num_rejected = 0
+        self.num_moved = 0
+        self._rejected_nodes: List[Node] = []
+
+    def setup_model(self, bbox: BoundingBox, occupancy_grid: Optional[OccupancyGrid] = None):
         self.model = HOO(minX=bbox.min.x, maxX=bbox.max.x,
                          minY=bbox.min.y, maxY=bbox.max.y,
                          minZ=bbox.min.z, maxZ=bbox.max.z,
                          c=self.c, v1=self.v1, rho=self.rho, policyName=self.policyName)
+        self.occupancy_grid = occupancy_grid
+        self._sample_position()
+
+    def _sample_position(self):
         self.node_pos, self.depth = self.model.sample_position()
+        if self.occupancy_grid is None:
+            return
+
+        for _ in range(self.max_rejections):
+            if self.occupancy_grid.is_free(self.node_pos):
+                return
+            node = self.model.root.shortcut
+            if self.invalid_position_strategy == "move":
+                pos = self.occupancy_grid.nearest_free(self.node_pos,
+                                                       (node.minX, node.minY, node.minZ),
+                                                       (node.maxX, node.maxY, node.maxZ))
+                if pos is not None:
+                    self.node_pos = tuple(pos)
+                    self.num_moved += 1
+                    return
+            # no valid position inside the cell, score it without rendering
+            self.num_rejected += 1
+            self._rejected_nodes.append(node)
+            self.model.backpropagation(self.invalid_score)
+            self.node_pos, self.depth = self.model.sample_position()
+
+    def pop_rejected_nodes(self) -> List[Node]:
+        """
+        Returns:
+            nodes scored with invalid_score since the last call, in the order of evaluation
+        """
+        nodes = self._rejected_nodes
+        self._rejected_nodes = []
+        return nodes
+
+    def print_occupancy_stats(self):
+        print(f'[OCCUPANCY] rejected {self.num_rejected} cells, moved {self.num_moved} cell centers', flush=True)
 
     def get_value(self, scores: List[float]):
         if self.value_storategy == "max":
@@ -87,29 +140,32 @@ class HOOExplorer():
         elif self.value_storategy in ["mean", "avg", "average"]:
             return np.mean(scores)
 
-    def get_camera_parameters(self, node_pos=None) -> Generator[Tuple[np.ndarray, np.ndarray], None, None]:
+    def get_camera_parameters(self, node_pos=None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
         """
         get camera parameters for rendering
+        An adaptive rollout proposes its camera parameters in several rounds,
+        call observe() with the scores of each round until rollout_finished is True.
         Args:
             node_pos: the center of the node
         Returns:
             tuples of (position, direction)
         """
         node_pos = node_pos if node_pos is not None else self.node_pos
-        self.rollout.reset()
+        return iter(self.rollout.propose(node_pos, pos_diff_scale=1))
 
-        def itr():
-            while not self.rollout.finished:
-                yield self.rollout.step(node_pos, pos_diff_scale=1)
+    def observe(self, scores: List[float]):
+        self.rollout.observe(scores)
 
-        return itr()
+    @property
+    def rollout_finished(self) -> bool:
+        return self.rollout.finished
 
     def batch_step(self, scores: List[float]):
         self._step_node(scores)
 
     def _step_node(self, scores: List[float]):
         self.model.backpropagation(self.get_value(scores))
-        self.node_pos, self.depth = self.model.sample_position()
+        self._sample_position()
         self.rollout.reset()
 
 
@@ -142,3 +198,131 @@ class Rollout():
     def reset(self):
         self.counter = 0
         self.finished = False
+
+    def propose(self, node_pos, pos_diff_scale) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Returns:
+            all (position, direction) of the rollout in a single round
+        """
+        self.reset()
+        ret = []
+        while not self.finished:
+            ret.append(self.step(node_pos, pos_diff_scale))
+        return ret
+
+    def observe(self, scores: List[float]):
+        pass
+
+    def clone(self) -> 'Rollout':
+        return Rollout(num_pos_diff=self.num_pos_diff, num_dir=self.num_dir)
+
+
+def generate_local_dir(center: np.ndarray, n: int, max_angle: float) -> List[np.ndarray]:
+    """
+    center を中心とする半頂角 max_angle の球冠上に、n個の方向をフィボナッチ螺旋状に配置する
+    Spread n directions on the spherical cap of half angle max_angle [rad] around center in a fibonacci spiral.
+    """
+    center = np.asarray(center, dtype=np.float64)
+    center = center / np.linalg.norm(center)
+    helper = np.array([1.0, 0.0, 0.0]) if abs(center[0]) < 0.9 else np.array([0.0, 0.0, 1.0])
+    u = np.cross(center, helper)
+    u /= np.linalg.norm(u)
+    v = np.cross(center, u)
+
+    golden_angle = np.pi * (3 - np.sqrt(5))
+    list_dir = []
+    for i in range(n):
+        cos_theta = 1 - (1 - np.cos(max_angle)) * (i + 0.5) / n
+        sin_theta = np.sqrt(max(0.0, 1 - cos_theta ** 2))
+        phi = golden_angle * i
+        list_dir.append(cos_theta * center + sin_theta * (np.cos(phi) * u + np.sin(phi) * v))
+    return list_dir
+
+
+class SuccessiveHalvingRollout():
+    """
+    Rolloutの代わりに使用できる適応的な方向探索
+    粗いフィボナッチ球面の方向をレンダリングした後、スコアの良い方向のみを残し、
+    その周辺をより細かい局所的な方向の集合で数ラウンドにわたって探索する
+    レンダリング数は1ノードあたり num_dir で固定
+    Adaptive direction search which can be used instead of Rollout.
+    It renders a coarse fibonacci direction set, keeps the best fraction,
+    and refines around them with finer local direction sets over a few rounds.
+    The number of renders per node is fixed to num_dir.
+    """
+
+    def __init__(self, num_dir=21, num_rounds=3, keep_ratio=0.25, initial_ratio=0.5) -> None:
+        assert num_dir >= 1
+        assert num_rounds >= 1
+        assert 0 < keep_ratio <= 1
+        assert 0 < initial_ratio <= 1
+        self.num_dir = num_dir
+        self.num_pos_diff = 0
+        self.num_rounds = num_rounds
+        self.keep_ratio = keep_ratio
+        self.initial_ratio = initial_ratio
+        self.num = num_dir
+        self.round_sizes = self._split_budget()
+        # angular spacing of the coarse direction set, the local search radius shrinks from it every round
+        self.initial_angle = np.sqrt(4 * np.pi / self.round_sizes[0])
+        self.list_directions = generate_list_dir(self.round_sizes[0])
+        self.finished = False
+        self.round = 0
+        self.directions: List[np.ndarray] = []
+        self.scores: List[float] = []
+        self._proposal: Optional[List[Tuple[np.ndarray, np.ndarray]]] = None
+
+    def _split_budget(self) -> List[int]:
+        if self.num_rounds == 1:
+            return [self.num_dir]
+        initial = max(1, int(np.ceil(self.num_dir * self.initial_ratio)))
+        rest = self.num_dir - initial
+        sizes = [rest // (self.num_rounds - 1)] * (self.num_rounds - 1)
+        sizes[-1] += rest - sum(sizes)
+        return [initial] + [size for size in sizes if size > 0]
+
+    def reset(self):
+        self.finished = False
+        self.round = 0
+        self.directions = []
+        self.scores = []
+        self._proposal = None
+
+    def _next_directions(self) -> List[np.ndarray]:
+        if self.round == 0:
+            return list(self.list_directions)
+
+        num = self.round_sizes[self.round]
+        num_keep = max(1, int(np.ceil(self.round_sizes[0] * self.keep_ratio ** self.round)))
+        num_keep = min(num_keep, num)
+        best = np.argsort(-np.asarray(self.scores), kind="stable")[:num_keep]
+        angle = self.initial_angle * 0.5 ** self.round
+        directions = []
+        for i, idx in enumerate(best):
+            # distribute the round budget over the kept directions, better directions first
+            n = num // num_keep + (1 if i < num % num_keep else 0)
+            directions.extend(generate_local_dir(self.directions[idx], n, angle))
+        return directions
+
+    def propose(self, node_pos, pos_diff_scale) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Returns:
+            (position, direction) of the current round
+        """
+        assert not self.finished
+        if self._proposal is None:
+            position = np.asarray(node_pos, dtype=np.float64)
+            self._proposal = [(position, d) for d in self._next_directions()]
+        return self._proposal
+
+    def observe(self, scores: List[float]):
+        assert self._proposal is not None and len(scores) == len(self._proposal)
+        self.directions.extend(d for _, d in self._proposal)
+        self.scores.extend(float(s) for s in scores)
+        self._proposal = None
+        self.round += 1
+        self.finished = self.round >= len(self.round_sizes)
+
+    def clone(self) -> 'SuccessiveHalvingRollout':
+        return SuccessiveHalvingRollout(num_dir=self.num_dir, num_rounds=self.num_rounds,
+                                        keep_ratio=self.keep_ratio, initial_ratio=self.initial_ratio)
@@ -0,0 +1,110 @@
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+
+
+class ScoreField:
+    """
+    位置と方向の解析的なスコア関数 各ローブは位置のガウス関数と方向の von Mises-Fisher 型の関数の積で、スコアはローブの最大値
+    最大値はローブの高さの最大値と分かっているため、レンダリングなしで探索の単純リグレットを求められる
+    An analytic score over camera positions and directions. Each lobe is a Gaussian of the position times
+    a von Mises-Fisher like function of the direction, and the score is the maximum over the lobes.
+    The optimum is the height of the highest lobe, so that the simple regret of an exploration is known without rendering.
+    """
+
+    def __init__(self, centers: np.ndarray, sigmas: np.ndarray, directions: np.ndarray, kappas: np.ndarray, heights: np.ndarray):
+        """
+        Args:
+            centers: (k, 3) ローブの中心 centers of the lobes
+            sigmas: (k,) 位置の標準偏差 [m] standard deviations of the positions in meters
+            directions: (k, 3) 最良の方向 best directions
+            kappas: (k,) 方向の鋭さ sharpness of the directions
+            heights: (k,) ローブの高さ (0-1) heights of the lobes
+        """
+        self.centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+        self.sigmas = np.asarray(sigmas, dtype=np.float64)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        self.directions = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+        self.kappas = np.asarray(kappas, dtype=np.float64)
+        self.heights = np.asarray(heights, dtype=np.float64)
+
+    @property
+    def optimum(self) -> float:
+        return float(self.heights.max())
+
+    def optimum_over(self, directions: np.ndarray) -> float:
+        """
+        カメラの方向が与えられた方向に限られる場合の最大値 ロールアウトの方向の集合で到達できる最良のスコア
+        The optimum when the camera directions are restricted to the given ones,
+        which is the best score reachable with the direction set of a rollout.
+        Args:
+            directions: (m, 3)
+        """
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        directions = directions / (np.linalg.norm(directions, axis=1, keepdims=True) + 1e-12)
+        # (m, k) the best position of every lobe is its center
+        cos = directions @ self.directions.T
+        return float(np.max(self.heights * np.exp(self.kappas * (cos - 1))))
+
+    def __call__(self, positions: np.ndarray, directions: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            positions: (n, 3)
+            directions: (n, 3)
+        Returns:
+            (n,) scores
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        directions = directions / (np.linalg.norm(directions, axis=1, keepdims=True) + 1e-12)
+        # (n, k)
+        d2 = np.sum((positions[:, None] - self.centers[None]) ** 2, axis=2)
+        cos = directions @ self.directions.T
+        lobes = self.heights * np.exp(-d2 / (2 * self.sigmas ** 2)) * np.exp(self.kappas * (cos - 1))
+        return lobes.max(axis=1)
+
+
+def _random_directions(rng: np.random.Generator, num: int) -> np.ndarray:
+    directions = rng.normal(size=(num, 3))
+    return directions / np.linalg.norm(directions, axis=1, keepdims=True)
+
+
+def multimodal_gaussian_field(rng: np.random.Generator, bbox_min: np.ndarray, bbox_max: np.ndarray, num_lobes: int = 5) -> ScoreField:
+    """
+    大きさと高さの異なる複数の滑らかなローブ Several smooth lobes of different sizes and heights.
+    """
+    bbox_min, bbox_max = np.asarray(bbox_min, dtype=np.float64), np.asarray(bbox_max, dtype=np.float64)
+    scale = np.linalg.norm(bbox_max - bbox_min)
+    return ScoreField(centers=rng.uniform(bbox_min, bbox_max, size=(num_lobes, 3)),
+                      sigmas=rng.uniform(0.05, 0.2, size=num_lobes) * scale,
+                      directions=_random_directions(rng, num_lobes),
+                      kappas=rng.uniform(1.0, 4.0, size=num_lobes),
+                      heights=rng.uniform(0.4, 1.0, size=num_lobes))
+
+
+def needle_field(rng: np.random.Generator, bbox_min: np.ndarray, bbox_max: np.ndarray, num_decoys: int = 4,
+                 needle_ratio: float = 0.01) -> ScoreField:
+    """
+    広く低いおとりのローブと、位置の狭い1つの最適解 (針) 粗い分割で最適解を見落としやすい
+    Broad and lower decoy lobes, and a single optimum narrow in position (the needle), which a coarse split easily misses.
+    Args:
+        needle_ratio: 針の位置の標準偏差とバウンディングボックスの対角線の比 standard deviation of the needle relative to the bounding box diagonal
+    """
+    bbox_min, bbox_max = np.asarray(bbox_min, dtype=np.float64), np.asarray(bbox_max, dtype=np.float64)
+    scale = np.linalg.norm(bbox_max - bbox_min)
+    return ScoreField(centers=rng.uniform(bbox_min, bbox_max, size=(num_decoys + 1, 3)),
+                      sigmas=np.concatenate([[needle_ratio * scale], rng.uniform(0.1, 0.3, size=num_decoys) * scale]),
+                      directions=_random_directions(rng, num_decoys + 1),
+                      kappas=np.concatenate([[4.0], rng.uniform(1.0, 3.0, size=num_decoys)]),
+                      heights=np.concatenate([[1.0], rng.uniform(0.5, 0.8, size=num_decoys)]))
+
+
+FIELDS: Dict[str, Callable[[np.random.Generator, np.ndarray, np.ndarray], ScoreField]] = {
+    "gaussian": multimodal_gaussian_field,
+    "needle": needle_field,
+}
+
+
+def create_field(name: str, seed: int, bbox_min: Tuple[float, float, float], bbox_max: Tuple[float, float, float]) -> ScoreField:
+    assert name in FIELDS, f"unknown field: {name}, expected one of {list(FIELDS)}"
+    return FIELDS[name](np.random.default_rng(seed), np.asarray(bbox_min), np.asarray(bbox_max))
@@ -0,0 +1,86 @@
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+class CMAES:
+    """
+    単位超立方体 [0, 1]^d 上の最大化を行う ask/tell 形式の CMA-ES
+    候補は範囲内にクリップされ、periodic な次元は周期的に折り返される
+    Ask/tell CMA-ES maximizing an objective on the unit hypercube [0, 1]^d.
+    Candidates are clipped into the cube, periodic dimensions wrap around instead.
+    """
+
+    def __init__(self,
+                 mean: Sequence[float],
+                 sigma: float = 0.15,
+                 population_size: Optional[int] = None,
+                 periodic: Optional[Sequence[bool]] = None,
+                 rng: Optional[np.random.Generator] = None):
+        self.mean = np.clip(np.asarray(mean, dtype=np.float64), 0, 1)
+        self.dim = len(self.mean)
+        self.sigma = sigma
+        self.population_size = population_size if population_size is not None else 4 + int(3 * np.log(self.dim))
+        self.periodic = np.asarray(periodic if periodic is not None else [False] * self.dim, dtype=bool)
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+        # default strategy parameters, see Hansen, "The CMA Evolution Strategy: A Tutorial"
+        n = self.dim
+        self.mu = self.population_size // 2
+        weights = np.log(self.mu + 0.5) - np.log(np.arange(1, self.mu + 1))
+        self.weights = weights / weights.sum()
+        self.mu_eff = 1 / np.sum(self.weights ** 2)
+        self.c_sigma = (self.mu_eff + 2) / (n + self.mu_eff + 5)
+        self.d_sigma = 1 + 2 * max(0.0, np.sqrt((self.mu_eff - 1) / (n + 1)) - 1) + self.c_sigma
+        self.c_c = (4 + self.mu_eff / n) / (n + 4 + 2 * self.mu_eff / n)
+        self.c_1 = 2 / ((n + 1.3) ** 2 + self.mu_eff)
+        self.c_mu = min(1 - self.c_1, 2 * (self.mu_eff - 2 + 1 / self.mu_eff) / ((n + 2) ** 2 + self.mu_eff))
+        self.chi_n = np.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2))
+
+        self.p_sigma = np.zeros(n)
+        self.p_c = np.zeros(n)
+        self.C = np.eye(n)
+        self.generation = 0
+        self.best_x: Optional[np.ndarray] = None
+        self.best_value = -np.inf
+
+    def _bound(self, x: np.ndarray) -> np.ndarray:
+        return np.where(self.periodic, np.mod(x, 1.0), np.clip(x, 0, 1))
+
+    def ask(self) -> np.ndarray:
+        """
+        Returns:
+            (population_size, dim) candidates inside the unit hypercube
+        """
+        z = self.rng.standard_normal((self.population_size, self.dim))
+        y = z @ np.linalg.cholesky(self.C).T
+        return self._bound(self.mean + self.sigma * y)
+
+    def tell(self, candidates: np.ndarray, values: Sequence[float]):
+        values = np.asarray(values, dtype=np.float64)
+        order = np.argsort(-values, kind="stable")
+        if values[order[0]] > self.best_value:
+            self.best_value = float(values[order[0]])
+            self.best_x = candidates[order[0]].copy()
+
+        # steps are taken from the bounded candidates, the shortest way around for periodic dimensions
+        steps = candidates[order[:self.mu]] - self.mean
+        steps = np.where(self.periodic, (steps + 0.5) % 1.0 - 0.5, steps)
+        y = steps / self.sigma
+        y_w = self.weights @ y
+        self.mean = self._bound(self.mean + self.sigma * y_w)
+
+        eigenvalues, eigenvectors = np.linalg.eigh(self.C)
+        inv_sqrt_c = eigenvectors @ np.diag(1 / np.sqrt(np.maximum(eigenvalues, 1e-20))) @ eigenvectors.T
+        self.p_sigma = (1 - self.c_sigma) * self.p_sigma + np.sqrt(self.c_sigma * (2 - self.c_sigma) * self.mu_eff) * inv_sqrt_c @ y_w
+        self.generation += 1
+        norm_p_sigma = np.linalg.norm(self.p_sigma)
+        h_sigma = norm_p_sigma / np.sqrt(1 - (1 - self.c_sigma) ** (2 * self.generation)) < (1.4 + 2 / (self.dim + 1)) * self.chi_n
+        self.p_c = (1 - self.c_c) * self.p_c + h_sigma * np.sqrt(self.c_c * (2 - self.c_c) * self.mu_eff) * y_w
+
+        rank_mu = (self.weights[:, None] * y).T @ y
+        self.C = ((1 - self.c_1 - self.c_mu) * self.C
+                  + self.c_1 * (np.outer(self.p_c, self.p_c) + (not h_sigma) * self.c_c * (2 - self.c_c) * self.C)
+                  + self.c_mu * rank_mu)
+        self.C = (self.C + self.C.T) / 2
+        self.sigma = min(self.sigma * np.exp((self.c_sigma / self.d_sigma) * (norm_p_sigma / self.chi_n - 1)), 1.0)
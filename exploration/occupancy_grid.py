@@ -0,0 +1,117 @@
+from collections import deque
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+class OccupancyGrid:
+    """
+    探索空間のボクセル占有グリッド
+    free[x, y, z] が True のボクセルにはカメラを置くことができる
+    Voxel occupancy grid of the explorable volume.
+    A camera can be placed inside the voxels where free[x, y, z] is True.
+    """
+
+    def __init__(self, free: np.ndarray, origin: Sequence[float], voxel_size: float):
+        assert free.ndim == 3
+        self.free = free.astype(bool)
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.voxel_size = float(voxel_size)
+
+    @property
+    def shape(self):
+        return self.free.shape
+
+    @property
+    def free_ratio(self) -> float:
+        return float(np.count_nonzero(self.free)) / self.free.size
+
+    def voxel_index(self, points: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            points: (n, 3) or (3,)
+        Returns:
+            voxel indices, may be out of the grid
+        """
+        return np.floor((np.asarray(points, dtype=np.float64) - self.origin) / self.voxel_size).astype(np.int64)
+
+    def voxel_center(self, indices: np.ndarray) -> np.ndarray:
+        return self.origin + (np.asarray(indices, dtype=np.float64) + 0.5) * self.voxel_size
+
+    def is_free(self, point: Sequence[float]) -> bool:
+        """
+        Returns:
+            False if the point is outside the grid or inside solid geometry
+        """
+        index = self.voxel_index(point)
+        if np.any(index < 0) or np.any(index >= self.shape):
+            return False
+        return bool(self.free[tuple(index)])
+
+    def nearest_free(self, point: Sequence[float], bounds_min: Sequence[float], bounds_max: Sequence[float]) -> Optional[np.ndarray]:
+        """
+        指定されたバウンディングボックス内で、pointに最も近い空きボクセルの中心を返す
+        Find the center of the free voxel nearest to point, among the voxels whose centers lie inside the given bounds.
+        Returns:
+            None if there is no free voxel inside the bounds
+        """
+        lo = np.clip(self.voxel_index(bounds_min), 0, self.shape)
+        hi = np.clip(self.voxel_index(bounds_max) + 1, 0, self.shape)
+        if np.any(hi <= lo):
+            return None
+        block = self.free[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+        indices = np.argwhere(block) + lo
+        if len(indices) == 0:
+            return None
+        centers = self.voxel_center(indices)
+        inside = np.all((centers >= np.asarray(bounds_min)) & (centers <= np.asarray(bounds_max)), axis=1)
+        centers = centers[inside]
+        if len(centers) == 0:
+            return None
+        distances = np.sum((centers - np.asarray(point, dtype=np.float64)) ** 2, axis=1)
+        return centers[np.argmin(distances)]
+
+    def largest_free_region(self) -> 'OccupancyGrid':
+        """
+        6近傍で連結な空きボクセルのうち最大の領域のみを残したグリッドを返す
+        壁の外側など、カメラが到達できない空間を取り除くために使用する
+        Keep only the largest 6-connected free region,
+        which removes the pockets the camera cannot reach, such as the space behind the walls.
+        """
+        nx, ny, nz = self.shape
+        flat_free = self.free.ravel()
+        labels = np.zeros(flat_free.shape, dtype=np.int32)
+        strides = (ny * nz, nz, 1)
+        best_label, best_size = 0, 0
+        label = 0
+        for seed in np.flatnonzero(flat_free):
+            if labels[seed] != 0:
+                continue
+            label += 1
+            labels[seed] = label
+            size = 0
+            queue = deque([seed])
+            while queue:
+                i = queue.popleft()
+                size += 1
+                x, rem = divmod(i, strides[0])
+                y, z = divmod(rem, strides[1])
+                for coord, dim, stride in ((x, nx, strides[0]), (y, ny, strides[1]), (z, nz, strides[2])):
+                    if coord > 0 and flat_free[i - stride] and labels[i - stride] == 0:
+                        labels[i - stride] = label
+                        queue.append(i - stride)
+                    if coord < dim - 1 and flat_free[i + stride] and labels[i + stride] == 0:
+                        labels[i + stride] = label
+                        queue.append(i + stride)
+            if size > best_size:
+                best_label, best_size = label, size
+        free = (labels == best_label).reshape(self.shape) if best_label > 0 else self.free.copy()
+        return OccupancyGrid(free, self.origin, self.voxel_size)
+
+    def save(self, path: str):
+        np.savez_compressed(path, free=self.free, origin=self.origin, voxel_size=np.float64(self.voxel_size))
+
+    @classmethod
+    def load(cls, path: str) -> 'OccupancyGrid':
+        with np.load(path) as data:
+            return OccupancyGrid(data["free"], data["origin"], float(data["voxel_size"]))
@@ -0,0 +1,73 @@
+import numpy as np
+
+from .spatial_index import SampleIndex
+
+
+def non_max_suppression(index: SampleIndex, top_n: int, min_distance: float, min_angle: float, chunk_size: int = 4096) -> np.ndarray:
+    """
+    位置と方向の近いサンプルのうちスコアが最も高いものだけを残し、上位 top_n 個の撮影スポットを選ぶ
+    あるサンプルは、より高いスコアの採用済みスポットとの距離が min_distance 以下かつ角度差が min_angle 以下のとき抑制される
+    Greedy pose-space non-max suppression returning the top_n distinct photospots.
+    A sample is suppressed by a kept photospot with a higher score
+    when it lies within min_distance [m] and its direction is within min_angle [deg].
+    Args:
+        min_angle: 180以上の場合は位置のみで抑制する suppress by position only when 180 or more
+    Returns:
+        indices of the photospots, best first
+    """
+    n = len(index)
+    order = np.argsort(-index.scores, kind="stable")
+    suppressed = np.zeros(n, dtype=bool)
+    cos_min_angle = np.cos(np.deg2rad(min(min_angle, 180.0)))
+    directions = index.directions.astype(np.float64)
+    directions /= np.maximum(np.linalg.norm(directions, axis=1, keepdims=True), 1e-12)
+
+    kept = []
+    position = 0
+    while len(kept) < top_n and position < n:
+        # jump to the next sample which is not suppressed, a chunk at a time
+        candidates = order[position:position + chunk_size]
+        free = np.flatnonzero(~suppressed[candidates])
+        if len(free) == 0:
+            position += len(candidates)
+            continue
+        position += int(free[0]) + 1
+        best = candidates[free[0]]
+        kept.append(best)
+
+        neighbours = index.within_radius(index.positions[best], min_distance)
+        if min_angle < 180:
+            neighbours = neighbours[directions[neighbours] @ directions[best] >= cos_min_angle]
+        suppressed[neighbours] = True
+    return np.array(kept, dtype=np.int64)
+
+
+def remove_near_duplicates(embeddings: np.ndarray, scores: np.ndarray, max_similarity: float, chunk_size: int = 1024) -> np.ndarray:
+    """
+    埋め込みのコサイン類似度が max_similarity 以上のサンプルのうち、スコアが最も高いものだけを残す
+    候補をスコア順にチャンクに分け、採用済みのサンプルとの類似度は行列積でまとめて求める
+    Greedy removal of near-duplicates by the cosine similarity of their embeddings:
+    a sample is removed when a kept sample with a higher score is at least max_similarity similar to it.
+    The candidates are processed in chunks in score order, and their similarities to the kept samples
+    are computed with one matrix product per chunk.
+    Returns:
+        indices of the kept samples, best first
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    kept = np.zeros(0, dtype=np.int64)
+    for start in range(0, len(order), chunk_size):
+        chunk = order[start:start + chunk_size]
+        candidates = embeddings[chunk]
+        # duplicates of the samples kept from the previous chunks
+        alive = np.ones(len(chunk), dtype=bool)
+        if len(kept) > 0:
+            alive = (candidates @ embeddings[kept].T).max(axis=1) < max_similarity
+        # duplicates inside the chunk, resolved in score order
+        similar = candidates @ candidates.T >= max_similarity
+        for i in range(len(chunk)):
+            if alive[i]:
+                alive[i + 1:] &= ~similar[i, i + 1:]
+        kept = np.concatenate([kept, chunk[alive]])
+    return kept
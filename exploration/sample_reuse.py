@@ -0,0 +1,148 @@
+from typing import Optional, List, Tuple
+
+import numpy as np
+
+from .hoo import Node
+
+
+class SampleStore:
+    """
+    スコア付けされた全てのカメラサンプル (位置, 方向, スコア) を保持する
+    Holds every scored camera sample (position, direction, score) of the exploration.
+    """
+
+    def __init__(self):
+        self._positions = np.zeros((0, 3))
+        self._directions = np.zeros((0, 3))
+        self._scores = np.zeros(0)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def positions(self) -> np.ndarray:
+        return self._positions[:self._size]
+
+    @property
+    def directions(self) -> np.ndarray:
+        return self._directions[:self._size]
+
+    @property
+    def scores(self) -> np.ndarray:
+        return self._scores[:self._size]
+
+    def add(self, positions: np.ndarray, directions: np.ndarray, scores: np.ndarray):
+        n = len(scores)
+        if self._size + n > len(self._scores):
+            # amortized growth of the buffers
+            capacity = max(2 * len(self._scores), self._size + n, 256)
+            self._positions = np.resize(self._positions, (capacity, 3))
+            self._directions = np.resize(self._directions, (capacity, 3))
+            self._scores = np.resize(self._scores, capacity)
+        directions = np.asarray(directions, dtype=np.float64)
+        self._positions[self._size:self._size + n] = positions
+        self._directions[self._size:self._size + n] = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+        self._scores[self._size:self._size + n] = scores
+        self._size += n
+
+    def inside(self, center: np.ndarray, half_size: np.ndarray) -> np.ndarray:
+        """
+        Returns:
+            indices of the samples strictly inside the box
+        """
+        return np.flatnonzero(np.all(np.abs(self.positions - center) < half_size, axis=1))
+
+
+class SampleReuse:
+    """
+    新しいセルを初めて評価する際に、セル内に既に存在するサンプルを再利用する
+    Reuse the samples already inside a cell when it is evaluated for the first time.
+
+    mode:
+        "shrink": 提案された方向のうち、セル内に近い方向のサンプルがあるものはレンダリングせずにそのスコアを使う
+                  proposed directions with a close enough sample inside the cell take its score instead of being rendered
+        "skip": セル内に min_samples 以上のサンプルがあれば、レンダリングせずにそれらのスコアからセルの値を求める
+                cells holding at least min_samples samples are valued from them without rendering
+
+    The samples must lie strictly inside the cell. The center of the parent lies on the split plane,
+    so it is shared by both children and is never reused, which keeps the children rendering their own centers.
+    """
+
+    def __init__(self, mode: str = "shrink", region_scale: float = 1.0, max_angle: float = 10.0, min_samples: int = 21):
+        """
+        Args:
+            mode: "shrink" or "skip"
+            region_scale: セルの中心からこの比率で縮小した領域内のサンプルのみを使う
+                only the samples inside the cell scaled by this ratio around its center are reused
+            max_angle: shrink で再利用する方向の最大の角度差[deg] maximum angle [deg] between a proposed direction and a reused sample
+            min_samples: skip に必要なサンプル数 number of samples needed to skip a cell
+        """
+        assert mode in ["shrink", "skip"]
+        self.mode = mode
+        self.region_scale = region_scale
+        self.cos_max_angle = np.cos(np.deg2rad(max_angle))
+        self.min_samples = min_samples
+        self.store = SampleStore()
+        self.num_proposed = 0
+        self.num_reused = 0
+        self.num_skipped_nodes = 0
+        self.num_rendered = 0
+
+    def _region(self, node: Node) -> Tuple[np.ndarray, np.ndarray]:
+        center = np.array(node.center)
+        half_size = np.array([node.maxX - node.minX, node.maxY - node.minY, node.maxZ - node.minZ]) / 2 * self.region_scale
+        return center, half_size
+
+    def skip_scores(self, node: Node, num_dir: int) -> Optional[np.ndarray]:
+        """
+        Returns:
+            scores of the samples inside the cell if the cell can be skipped, otherwise None
+        """
+        if self.mode != "skip":
+            return None
+        indices = self.store.inside(*self._region(node))
+        if len(indices) < self.min_samples:
+            return None
+        self.num_skipped_nodes += 1
+        self.num_proposed += num_dir
+        self.num_reused += num_dir
+        return self.store.scores[indices]
+
+    def match(self, node: Node, proposal: List[Tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+        """
+        Returns:
+            index of the reused sample for each proposed camera parameter, -1 for the ones to be rendered
+        """
+        self.num_proposed += len(proposal)
+        matched = np.full(len(proposal), -1, dtype=np.int64)
+        if self.mode != "shrink" or len(proposal) == 0:
+            return matched
+        indices = self.store.inside(*self._region(node))
+        if len(indices) == 0:
+            return matched
+        directions = np.array([d for _, d in proposal], dtype=np.float64)
+        directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+        cos = directions @ self.store.directions[indices].T
+        best = np.argmax(cos, axis=1)
+        reusable = cos[np.arange(len(proposal)), best] >= self.cos_max_angle
+        matched[reusable] = indices[best[reusable]]
+        self.num_reused += int(np.count_nonzero(reusable))
+        return matched
+
+    def add(self, positions: np.ndarray, directions: np.ndarray, scores: np.ndarray):
+        """
+        レンダリングされたサンプルを追加する
+        Add the rendered samples.
+        """
+        self.num_rendered += len(scores)
+        self.store.add(positions, directions, scores)
+
+    def stats(self) -> dict:
+        return {"proposed": self.num_proposed, "reused": self.num_reused, "hit_rate": self.num_reused / max(self.num_proposed, 1),
+                "skipped_nodes": self.num_skipped_nodes, "rendered": self.num_rendered}
+
+    def print_stats(self):
+        print(f'[SAMPLE REUSE] {self.mode}: reused {self.num_reused}/{self.num_proposed} camera parameters '
+              f'({self.num_reused / max(self.num_proposed, 1):.1%}), skipped {self.num_skipped_nodes} cells, '
+              f'rendered {self.num_rendered} images', flush=True)
@@ -0,0 +1,129 @@
+import json
+import os
+from typing import Tuple, Optional
+
+import numpy as np
+
+
+class ScoreVolume:
+    """
+    ワールドを位置の格子とフィボナッチ方向の集合でレンダリングしてスコア付けした結果 np.memmap で読み込む
+    位置は三線形補間、方向は最も近い方向で評価するため、レンダラーなしで HOO のパラメータの探索に使える
+    The scores of a world rendered on a position lattice times a fibonacci direction set, read with np.memmap.
+    It is evaluated with the trilinear interpolation of the positions and the nearest stored direction,
+    so that HOO parameters can be swept without a renderer.
+
+    Files in the volume directory:
+        meta.json: {"dims": [nx, ny, nz], "bbox_min", "bbox_max", "directions": (k, 3), "completed": number of scored lattice points}
+        scores.bin: (nx, ny, nz, k) float32 scores, NaN for the lattice points not scored yet
+    The lattice points span the bounding box including its faces, in the C order of (x, y, z).
+    """
+
+    def __init__(self, root: str, mode: str = "r"):
+        """
+        Args:
+            mode: r (読み込みのみ read only), r+ (スコアの書き込み writing scores)
+        """
+        self.root = root
+        self.mode = mode
+        with open(os.path.join(root, "meta.json")) as f:
+            meta = json.load(f)
+        self.dims = tuple(meta["dims"])
+        self.bbox_min = np.asarray(meta["bbox_min"], dtype=np.float64)
+        self.bbox_max = np.asarray(meta["bbox_max"], dtype=np.float64)
+        self.directions = np.asarray(meta["directions"], dtype=np.float64).reshape(-1, 3)
+        self.num_completed = meta["completed"]
+        self.scores = np.memmap(os.path.join(root, "scores.bin"), dtype=np.float32, mode=mode,
+                                shape=self.dims + (len(self.directions),))
+
+    @classmethod
+    def create(cls, root: str, bbox_min, bbox_max, dims: Tuple[int, int, int], directions: np.ndarray) -> 'ScoreVolume':
+        os.makedirs(root, exist_ok=True)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        scores = np.memmap(os.path.join(root, "scores.bin"), dtype=np.float32, mode="w+", shape=tuple(dims) + (len(directions),))
+        scores[:] = np.nan
+        scores.flush()
+        del scores
+        cls._write_meta(root, {"dims": list(dims), "bbox_min": list(map(float, bbox_min)), "bbox_max": list(map(float, bbox_max)),
+                               "directions": directions.tolist(), "completed": 0})
+        return ScoreVolume(root, mode="r+")
+
+    @staticmethod
+    def _write_meta(root: str, meta: dict):
+        path = os.path.join(root, "meta.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+
+    @property
+    def num_points(self) -> int:
+        return int(np.prod(self.dims))
+
+    def lattice_positions(self) -> np.ndarray:
+        """
+        Returns:
+            (nx * ny * nz, 3) positions of the lattice points in the storage order
+        """
+        axes = [np.linspace(self.bbox_min[i], self.bbox_max[i], self.dims[i]) for i in range(3)]
+        return np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)
+
+    def write(self, start: int, scores: np.ndarray):
+        """
+        格子点 start から順にスコアを書き込み、書き込み済みの数を更新する 中断しても続きから再開できる
+        Write the scores of the lattice points from start on and update the number of completed points,
+        so that an interrupted build can be resumed.
+        Args:
+            scores: (m, k)
+        """
+        flat = self.scores.reshape(self.num_points, len(self.directions))
+        flat[start:start + len(scores)] = scores
+        self.scores.flush()
+        self.num_completed = max(self.num_completed, start + len(scores))
+        self._write_meta(self.root, {"dims": list(self.dims), "bbox_min": self.bbox_min.tolist(), "bbox_max": self.bbox_max.tolist(),
+                                     "directions": self.directions.tolist(), "completed": self.num_completed})
+
+    def nearest_directions(self, directions: np.ndarray) -> np.ndarray:
+        """
+        Returns:
+            (n,) index of the nearest stored direction
+        """
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        return np.argmax(directions @ self.directions.T, axis=1)
+
+    @property
+    def optimum(self) -> float:
+        return float(np.nanmax(self.scores))
+
+    def optimum_over(self, directions: Optional[np.ndarray] = None) -> float:
+        """
+        与えられた方向に最も近い保存済みの方向での最大値 三線形補間の最大値は格子点にある
+        The optimum over the stored directions nearest to the given ones. The maximum of a trilinear interpolation is on a lattice point.
+        """
+        if directions is None:
+            return self.optimum
+        indices = np.unique(self.nearest_directions(directions))
+        return float(np.nanmax(self.scores[..., indices]))
+
+    def __call__(self, positions: np.ndarray, directions: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            positions: (n, 3) バウンディングボックスの外側はその面に投影する positions outside the bounding box are clamped to it
+            directions: (n, 3)
+        Returns:
+            (n,) scores
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        dims = np.asarray(self.dims)
+        extent = np.where(self.bbox_max > self.bbox_min, self.bbox_max - self.bbox_min, 1.0)
+        g = np.clip((positions - self.bbox_min) / extent * (dims - 1), 0, dims - 1)
+        i0 = np.minimum(np.floor(g).astype(np.int64), np.maximum(dims - 2, 0))
+        t = g - i0
+        i1 = np.minimum(i0 + 1, dims - 1)
+        d = self.nearest_directions(directions)
+        scores = np.zeros(len(positions))
+        for corner in range(8):
+            bits = [(corner >> axis) & 1 for axis in range(3)]
+            index = [np.where(bits[axis], i1[:, axis], i0[:, axis]) for axis in range(3)]
+            weight = np.prod([t[:, axis] if bits[axis] else 1 - t[:, axis] for axis in range(3)], axis=0)
+            scores += weight * self.scores[index[0], index[1], index[2], d]
+        return scores
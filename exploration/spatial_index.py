@@ -0,0 +1,230 @@
+from typing import Optional, Tuple, List
+
+import numpy as np
+
+
+class KDTree:
+    """
+    NumPy配列上の静的なKD木
+    各ノードは並べ替えられた点の連続した範囲を持つため、範囲全体が条件を満たす場合はスライスでまとめて返せる
+    Static KD-tree over a NumPy array of points.
+    Each node owns a contiguous range of the reordered points, so fully covered nodes are returned as slices.
+    """
+
+    def __init__(self, points: np.ndarray, leaf_size: int = 64):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        n = len(points)
+        self.leaf_size = leaf_size
+        order = np.arange(n)
+        starts, ends, lefts, rights, box_min, box_max = [], [], [], [], [], []
+
+        def new_node(start, end, lo, hi):
+            starts.append(start)
+            ends.append(end)
+            lefts.append(-1)
+            rights.append(-1)
+            box_min.append(lo)
+            box_max.append(hi)
+            return len(starts) - 1
+
+        # the boxes of the children are the box of the parent cut at the split value,
+        # looser than the tight bounds of the points but free to compute
+        root_min = points.min(axis=0) if n > 0 else np.full(3, np.inf)
+        root_max = points.max(axis=0) if n > 0 else np.full(3, -np.inf)
+        stack = [new_node(0, n, root_min, root_max)]
+        while stack:
+            node = stack.pop()
+            start, end = starts[node], ends[node]
+            if end - start <= leaf_size:
+                continue
+            lo, hi = box_min[node], box_max[node]
+            dim = int(np.argmax(hi - lo))
+            mid = (start + end) // 2
+            block = order[start:end]
+            block = block[np.argpartition(points[block, dim], mid - start)]
+            order[start:end] = block
+            split = points[block[mid - start], dim]
+            left_hi, right_lo = hi.copy(), lo.copy()
+            left_hi[dim] = split
+            right_lo[dim] = split
+            lefts[node] = new_node(start, mid, lo, left_hi)
+            rights[node] = new_node(mid, end, right_lo, hi)
+            stack.extend([lefts[node], rights[node]])
+
+        self.order = order
+        self.sorted_points = points[order]
+        self.starts = np.array(starts, dtype=np.int64)
+        self.ends = np.array(ends, dtype=np.int64)
+        self.lefts = np.array(lefts, dtype=np.int64)
+        self.rights = np.array(rights, dtype=np.int64)
+        self.box_min = np.array(box_min).reshape(-1, 3)
+        self.box_max = np.array(box_max).reshape(-1, 3)
+
+    def _query(self, outside, covered, inside_mask) -> np.ndarray:
+        if len(self.order) == 0:
+            return np.zeros(0, dtype=np.int64)
+        chunks: List[np.ndarray] = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            lo, hi = self.box_min[node], self.box_max[node]
+            if outside(lo, hi):
+                continue
+            start, end = self.starts[node], self.ends[node]
+            if covered(lo, hi):
+                chunks.append(self.order[start:end])
+            elif self.lefts[node] < 0:
+                chunks.append(self.order[start:end][inside_mask(self.sorted_points[start:end])])
+            else:
+                stack.extend([self.lefts[node], self.rights[node]])
+        return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int64)
+
+    def within_bounds(self, bounds_min: np.ndarray, bounds_max: np.ndarray) -> np.ndarray:
+        """
+        Returns:
+            indices of the points inside the closed box
+        """
+        bmin = np.asarray(bounds_min, dtype=np.float64)
+        bmax = np.asarray(bounds_max, dtype=np.float64)
+        return self._query(lambda lo, hi: np.any(hi < bmin) or np.any(lo > bmax),
+                           lambda lo, hi: np.all(lo >= bmin) and np.all(hi <= bmax),
+                           lambda p: np.all((p >= bmin) & (p <= bmax), axis=1))
+
+    def within_radius(self, center: np.ndarray, radius: float) -> np.ndarray:
+        """
+        Returns:
+            indices of the points within radius of center
+        """
+        c = np.asarray(center, dtype=np.float64)
+        r2 = radius ** 2
+        return self._query(lambda lo, hi: np.sum((np.maximum(lo - c, 0) + np.maximum(c - hi, 0)) ** 2) > r2,
+                           lambda lo, hi: np.sum(np.maximum(np.abs(lo - c), np.abs(hi - c)) ** 2) <= r2,
+                           lambda p: np.sum((p - c) ** 2, axis=1) <= r2)
+
+
+class SampleIndex:
+    """
+    スコア付けされたカメラサンプル (位置, 方向, スコア) の空間インデックス
+    上位k件、半径内、バウンディングボックス内、領域ごとの最良、部分木の検索を提供する
+    クエリは全てサンプルのインデックスの配列を返す
+    Spatial index over scored camera samples (position, direction, score).
+    Answers top-k, radius, within-bounds, best-per-region and subtree queries,
+    all of which return arrays of sample indices.
+    """
+
+    def __init__(self,
+                 positions: np.ndarray,
+                 directions: np.ndarray,
+                 scores: np.ndarray,
+                 branch_ids: Optional[np.ndarray] = None,
+                 depths: Optional[np.ndarray] = None,
+                 leaf_size: int = 64):
+        """
+        Args:
+            positions: (n, 3)
+            directions: (n, 3)
+            scores: (n,)
+            branch_ids: (n,) HOOノードのbranch id branch id of the HOO node of each sample
+            depths: (n,) HOOノードの深さ depth of the HOO node of each sample
+        """
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        self.directions = np.asarray(directions, dtype=np.float32).reshape(-1, 3)
+        self.scores = np.asarray(scores, dtype=np.float32)
+        n = len(self.scores)
+        self.branch_ids = np.asarray(branch_ids, dtype=np.int64) if branch_ids is not None else np.ones(n, dtype=np.int64)
+        self.depths = np.asarray(depths, dtype=np.int64) if depths is not None else np.zeros(n, dtype=np.int64)
+        self.tree = KDTree(self.positions, leaf_size)
+        self._score_rank: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    @property
+    def score_rank(self) -> np.ndarray:
+        """
+        Returns:
+            (n,) rank of each sample in the descending order of the scores, computed once
+        """
+        if self._score_rank is None:
+            rank = np.empty(len(self), dtype=np.int64)
+            rank[np.argsort(-self.scores, kind="stable")] = np.arange(len(self))
+            self._score_rank = rank
+        return self._score_rank
+
+    @classmethod
+    def from_sample_store(cls, store) -> 'SampleIndex':
+        """
+        探索中の SampleStore からインデックスを作る
+        Build the index live from the SampleStore of an explorer.
+        """
+        return SampleIndex(store.positions.copy(), store.directions.copy(), store.scores.copy())
+
+    def top_k(self, k: int, indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Args:
+            indices: 候補のサンプル (省略時は全サンプル) candidate samples, all samples if omitted
+        Returns:
+            indices of the k best samples, best first
+        """
+        indices = np.arange(len(self)) if indices is None else np.asarray(indices)
+        if k <= 0 or len(indices) == 0:
+            return np.zeros(0, dtype=np.int64)
+        scores = self.scores[indices]
+        if k < len(indices):
+            part = np.argpartition(-scores, k - 1)[:k]
+        else:
+            part = np.arange(len(indices))
+        return indices[part[np.argsort(-scores[part], kind="stable")]]
+
+    def within_bounds(self, bounds_min: np.ndarray, bounds_max: np.ndarray) -> np.ndarray:
+        return self.tree.within_bounds(bounds_min, bounds_max)
+
+    def within_radius(self, center: np.ndarray, radius: float) -> np.ndarray:
+        return self.tree.within_radius(center, radius)
+
+    def facing(self, indices: np.ndarray, direction: np.ndarray, max_angle: float) -> np.ndarray:
+        """
+        Returns:
+            the indices whose direction is within max_angle [deg] of direction
+        """
+        direction = np.asarray(direction, dtype=np.float64)
+        direction = direction / np.linalg.norm(direction)
+        directions = self.directions[indices].astype(np.float64)
+        cos = directions @ direction / np.maximum(np.linalg.norm(directions, axis=1), 1e-12)
+        return indices[cos >= np.cos(np.deg2rad(max_angle))]
+
+    def best_per_region(self, bounds_min: np.ndarray, bounds_max: np.ndarray, cell_size: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        バウンディングボックスを cell_size の立方体に分割し、各領域の最良のサンプルを返す
+        Split the box into cubes of cell_size and find the best sample of each non-empty cube.
+        Returns:
+            (m, 3) integer coordinates of the regions and (m,) indices of their best samples, best first
+        """
+        bmin = np.asarray(bounds_min, dtype=np.float64)
+        indices = self.within_bounds(bmin, bounds_max)
+        if len(indices) == 0:
+            return np.zeros((0, 3), dtype=np.int64), indices
+        cells = np.floor((self.positions[indices] - bmin) / cell_size).astype(np.int64)
+        dims = cells.max(axis=0) + 1
+        keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+        # sort by region, then by descending score, and keep the first sample of each region
+        if int(keys.max()) < np.iinfo(np.int64).max // max(len(self), 1):
+            order = np.argsort(keys * len(self) + self.score_rank[indices])
+        else:
+            order = np.lexsort((self.score_rank[indices], keys))
+        keys, indices = keys[order], indices[order]
+        first = np.ones(len(indices), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        indices = indices[first]
+        cells = np.floor((self.positions[indices] - bmin) / cell_size).astype(np.int64)
+        best = np.argsort(-self.scores[indices], kind="stable")
+        return cells[best], indices[best]
+
+    def subtree(self, branch_id: int, depth: int) -> np.ndarray:
+        """
+        Returns:
+            indices of the samples of the HOO node and its descendants
+        """
+        shift = self.depths - depth
+        candidates = np.flatnonzero(shift >= 0)
+        return candidates[(self.branch_ids[candidates] >> shift[candidates]) == int(branch_id)]
@@ -0,0 +1,84 @@
+from typing import Tuple
+
+import numpy as np
+
+
+class KNNScoreSurrogate:
+    """
+    (位置, 方向) からスコアを予測する逐次更新可能なk近傍回帰
+    予測の不確かさは、近傍のスコアのばらつきと近傍までの距離から見積もる
+    Incremental k-nearest-neighbour regressor from (position, direction) to score.
+    The uncertainty combines the spread of the neighbour scores and the distance to the neighbours,
+    so that predictions far from any sample fall back to prior_std.
+    """
+
+    def __init__(self, k: int = 8, direction_weight: float = 1.0, length_scale: float = 2.0, prior_std: float = 0.2):
+        """
+        Args:
+            k: 近傍の数 number of neighbours
+            direction_weight: 方向の差 (単位ベクトルの差のノルム) を距離[m]に換算する係数
+                scale converting the difference of the unit direction vectors into meters
+            length_scale: この距離[m]より遠い近傍しかない場合、不確かさは prior_std になる
+                the uncertainty reaches prior_std when the neighbours are this far [m]
+            prior_std: サンプルから遠い点のスコアの標準偏差 standard deviation of the score far from any sample
+        """
+        assert k >= 1
+        self.k = k
+        self.direction_weight = direction_weight
+        self.length_scale = length_scale
+        self.prior_std = prior_std
+        self._features = np.zeros((0, 6))
+        self._scores = np.zeros(0)
+        self._num_samples = 0
+
+    @property
+    def num_samples(self) -> int:
+        return self._num_samples
+
+    def _to_features(self, positions: np.ndarray, directions: np.ndarray) -> np.ndarray:
+        directions = np.asarray(directions, dtype=np.float64)
+        directions = directions / np.linalg.norm(directions, axis=-1, keepdims=True)
+        return np.concatenate([np.asarray(positions, dtype=np.float64), self.direction_weight * directions], axis=-1)
+
+    def add(self, positions: np.ndarray, directions: np.ndarray, scores: np.ndarray):
+        """
+        Args:
+            positions: (n, 3)
+            directions: (n, 3)
+            scores: (n,)
+        """
+        features = self._to_features(positions, directions)
+        n = len(features)
+        if self._num_samples + n > len(self._features):
+            # amortized growth of the sample buffers
+            capacity = max(2 * len(self._features), self._num_samples + n, 256)
+            self._features = np.resize(self._features, (capacity, 6))
+            self._scores = np.resize(self._scores, capacity)
+        self._features[self._num_samples:self._num_samples + n] = features
+        self._scores[self._num_samples:self._num_samples + n] = scores
+        self._num_samples += n
+
+    def predict(self, positions: np.ndarray, directions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            (mean, std) of the predicted scores, both (n,)
+        """
+        queries = self._to_features(positions, directions)
+        if self._num_samples == 0:
+            return np.zeros(len(queries)), np.full(len(queries), self.prior_std)
+
+        features = self._features[:self._num_samples]
+        scores = self._scores[:self._num_samples]
+        k = min(self.k, self._num_samples)
+        distances = np.linalg.norm(queries[:, None, :] - features[None, :, :], axis=-1)
+        neighbours = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        neighbour_distances = np.take_along_axis(distances, neighbours, axis=1)
+        neighbour_scores = scores[neighbours]
+
+        weights = 1 / (neighbour_distances + 1e-3)
+        weights /= weights.sum(axis=1, keepdims=True)
+        mean = np.sum(weights * neighbour_scores, axis=1)
+        spread = np.sqrt(np.sum(weights * (neighbour_scores - mean[:, None]) ** 2, axis=1))
+        remoteness = np.minimum(neighbour_distances.max(axis=1) / self.length_scale, 1.0)
+        std = np.sqrt(spread ** 2 + (self.prior_std * remoteness) ** 2)
+        return mean, std
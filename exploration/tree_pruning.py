@@ -0,0 +1,149 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+
+def rows_of(branch_ids: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """
+    同じbranch idのノードが複数ある場合は NodeViewModel.create_tree と同様に最後のものを返す
+    The last node of a branch id is returned when it occurs more than once, as in NodeViewModel.create_tree.
+    Returns:
+        row of the node of each queried branch id, -1 if it is missing
+    """
+    branch_ids = np.asarray(branch_ids, dtype=np.int64)
+    order = np.argsort(branch_ids, kind="stable")
+    sorted_ids = branch_ids[order]
+    queries = np.asarray(queries, dtype=np.int64)
+    if len(sorted_ids) == 0:
+        return np.full(len(queries), -1, dtype=np.int64)
+    i = np.maximum(np.searchsorted(sorted_ids, queries, side="right") - 1, 0)
+    return np.where(sorted_ids[i] == queries, order[i], -1)
+
+
+def parent_rows(branch_ids: np.ndarray) -> np.ndarray:
+    """
+    NodeViewModel.create_tree と同様に、親はそのノードより前にある最後の親のbranch idのノードとする
+    The parent of a node is the last node of the parent branch id before it, as in NodeViewModel.create_tree.
+    Returns:
+        (n,) row of the parent of each node, -1 for the root and for the nodes whose parent is missing
+    """
+    branch_ids = np.asarray(branch_ids, dtype=np.int64)
+    n = len(branch_ids)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    rows = np.arange(n, dtype=np.int64)
+    unique_ids, rank = np.unique(branch_ids, return_inverse=True)
+    # sorted by branch id, then by row
+    keys = np.sort(rank * n + rows)
+    parent_ids = branch_ids >> 1
+    parent_rank = np.minimum(np.searchsorted(unique_ids, parent_ids), len(unique_ids) - 1)
+    found = (unique_ids[parent_rank] == parent_ids) & (branch_ids > 1)
+    k = np.searchsorted(keys, parent_rank * n + rows) - 1
+    found &= (k >= 0) & (keys[np.maximum(k, 0)] // n == parent_rank)
+    return np.where(found, keys[np.maximum(k, 0)] % n, -1)
+
+
+def linked_rows(branch_ids: np.ndarray, parent: np.ndarray) -> np.ndarray:
+    """
+    同じ親の下に同じbranch idのノードが後から現れた場合、前のノードは置き換えられて木から外れる
+    A node is replaced in the tree by a later node of the same branch id under the same parent.
+    Returns:
+        (n,) whether each node is linked to its parent, or is the root of the tree
+    """
+    branch_ids = np.asarray(branch_ids, dtype=np.int64)
+    order = np.lexsort((np.arange(len(branch_ids)), branch_ids, parent))
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = (branch_ids[order[1:]] != branch_ids[order[:-1]]) | (parent[order[1:]] != parent[order[:-1]])
+    linked = np.zeros(len(order), dtype=bool)
+    linked[order[last]] = True
+    return linked
+
+
+@dataclass
+class PrunedTree:
+    """
+    Result of prune_tree. Rows refer to the nodes given to prune_tree.
+    """
+    # the node keeps no children and takes over the photo scorings of its subtree
+    cut: np.ndarray
+    # the node is below a cut node, not connected to the root, or superseded by a later node of the same branch id
+    hidden: np.ndarray
+    # sample indices grouped by the node they belong to after the cut, in their original order
+    sample_order: np.ndarray
+    # (n + 1,) the samples of row r are sample_order[sample_offset[r]:sample_offset[r + 1]]
+    sample_offset: np.ndarray
+    # best score and number of the samples of each node after the cut, -inf and 0 without samples
+    best_score: np.ndarray
+    num_samples: np.ndarray
+
+    def samples(self, row: int) -> np.ndarray:
+        return self.sample_order[self.sample_offset[row]:self.sample_offset[row + 1]]
+
+
+def prune_tree(branch_ids: np.ndarray,
+               depths: np.ndarray,
+               sizes: np.ndarray,
+               lower_size_bound: float,
+               sample_rows: Optional[np.ndarray] = None,
+               sample_scores: Optional[np.ndarray] = None) -> PrunedTree:
+    """
+    木を上から辿り、子のいずれかのサイズが lower_size_bound を下回るノードで切り、その部分木の PhotoScoring をまとめる
+    再帰を用いず、深さごとにベクトル化した1回の走査で切断、スコアの集約、サンプルの統合を行う
+    Cut the tree, walked from the root, at the nodes with a child smaller than lower_size_bound in any dimension,
+    and merge the samples of the subtrees below the cuts into the cut nodes.
+    The cut, the score aggregation and the sample merge are done without recursion
+    in a single pass over the depths, vectorized over the nodes of each depth.
+    Args:
+        branch_ids: (n,) branch id of each node, the parent of b is b >> 1
+        depths: (n,) depth of each node
+        sizes: (n, 3) size of the bounding box of each node
+        sample_rows: (m,) row of the node of each sample
+        sample_scores: (m,) score of each sample
+    """
+    branch_ids = np.asarray(branch_ids, dtype=np.int64)
+    n = len(branch_ids)
+    depths = np.asarray(depths, dtype=np.int64)
+    parent = parent_rows(branch_ids)
+    latest = linked_rows(branch_ids, parent)
+    sample_rows = np.zeros(0, dtype=np.int64) if sample_rows is None else np.asarray(sample_rows, dtype=np.int64)
+    sample_scores = np.zeros(len(sample_rows)) if sample_scores is None else np.asarray(sample_scores, dtype=np.float64)
+
+    # a node is cut when any of its children is smaller than the bound
+    small = np.any(np.asarray(sizes) < lower_size_bound, axis=1)
+    has_small_child = np.zeros(n, dtype=bool)
+    has_small_child[parent[small & (parent >= 0) & latest]] = True
+
+    # top-down over the depths: reachable from the root without crossing a cut, and the cut above each hidden node
+    reachable = np.zeros(n, dtype=bool)
+    cut_root = np.full(n, -1, dtype=np.int64)
+    order = np.argsort(depths, kind="stable")
+    level_starts = np.searchsorted(depths[order], np.arange(depths.max() + 2)) if n > 0 else np.zeros(1, dtype=np.int64)
+    for d in range(len(level_starts) - 1):
+        rows = order[level_starts[d]:level_starts[d + 1]]
+        if len(rows) == 0:
+            continue
+        p = parent[rows]
+        has_parent = p >= 0
+        if d == 0:
+            reachable[rows] = latest[rows] & (branch_ids[rows] == 1) & (parent[rows] < 0)
+        else:
+            reachable[rows] = latest[rows] & has_parent & reachable[np.maximum(p, 0)] & ~has_small_child[np.maximum(p, 0)]
+            # below a cut, the cut is inherited from the parent, or the parent is the cut
+            inherited = np.where(has_parent, cut_root[np.maximum(p, 0)], -1)
+            parent_cut = has_parent & reachable[np.maximum(p, 0)] & has_small_child[np.maximum(p, 0)]
+            cut_root[rows] = np.where(parent_cut, p, inherited)
+    cut = reachable & has_small_child
+    hidden = ~reachable
+
+    # every sample goes to the cut above its node, or stays with its node
+    owner = np.where(cut_root[sample_rows] >= 0, cut_root[sample_rows], sample_rows) if len(sample_rows) > 0 else sample_rows
+    sample_order = np.argsort(owner, kind="stable")
+    num_samples = np.bincount(owner, minlength=n).astype(np.int64)
+    sample_offset = np.concatenate([[0], np.cumsum(num_samples)]).astype(np.int64)
+    best_score = np.full(n, -np.inf)
+    non_empty = num_samples > 0
+    if np.any(non_empty):
+        best_score[non_empty] = np.maximum.reduceat(sample_scores[sample_order], sample_offset[:-1][non_empty])
+    return PrunedTree(cut=cut, hidden=hidden, sample_order=sample_order, sample_offset=sample_offset,
+                      best_score=best_score, num_samples=num_samples)
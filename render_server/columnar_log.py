@@ -0,0 +1,306 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Iterable, Optional, Tuple
+
+import numpy as np
+
+from exploration.algorithm import generate_list_dir
+from render_server.logger import open_node_log
+from render_server.render_api_data import NodeViewModel, PhotoScoring, CameraParameter, Vector3f
+
+MAGIC = b"PANOLOG1"
+_ALIGNMENT = 64
+
+
+def direction_table(size: int) -> np.ndarray:
+    """
+    Returns:
+        (size, 3) the fibonacci directions of generate_list_dir, the directions of the log are stored as indices into it
+    """
+    return np.array(generate_list_dir(size), dtype=np.float64).reshape(-1, 3)
+
+
+def encode_nodes(nodes: Iterable[dict], table: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    json から読み込んだノードを列ごとの配列に変換する
+    テーブルに無い方向は extra_direction に保存し、direction_index はテーブルの長さ以降の値でそれを指す
+    Convert the nodes decoded from json into column arrays.
+    The directions which are not in the table are kept in extra_direction,
+    and their direction_index points past the end of the table into it.
+    """
+    branch_ids, depths, bounds_min, bounds_max, scores, bs, num_samples = [], [], [], [], [], [], []
+    positions, directions, sample_scores, fovs = [], [], [], []
+    for node in nodes:
+        branch_id = int(node["branchId"])
+        assert branch_id < 2 ** 63, f"branch id of {node['id']} does not fit into int64"
+        branch_ids.append(branch_id)
+        depths.append(node["depth"])
+        bounds_min.append((node["min"]["x"], node["min"]["y"], node["min"]["z"]))
+        bounds_max.append((node["max"]["x"], node["max"]["y"], node["max"]["z"]))
+        scores.append(node["score"])
+        bs.append(np.nan if node.get("b") is None else node["b"])
+        photo_scorings = node["photoScorings"] or []
+        num_samples.append(len(photo_scorings))
+        for ps in photo_scorings:
+            cp = ps["cameraParameter"]
+            p, d = cp["position"], cp.get("direction")
+            positions.append((p["x"], p["y"], p["z"]))
+            directions.append((d["x"], d["y"], d["z"]) if d is not None else (0.0, 0.0, 0.0))
+            sample_scores.append(ps["score"])
+            fovs.append(cp.get("fieldOfView", 60.0))
+
+    directions = np.array(directions, dtype=np.float64).reshape(-1, 3)
+    direction_index = np.full(len(directions), -1, dtype=np.int32)
+    extra = np.zeros(len(directions), dtype=bool)
+    if len(directions) > 0:
+        # the directions of the log are copied from the table, so that they match it exactly
+        nearest = np.argmax(directions @ table.T, axis=1) if len(table) > 0 else np.zeros(len(directions), dtype=np.int64)
+        exact = np.all(np.abs(directions - table[nearest]) < 1e-9, axis=1) if len(table) > 0 else np.zeros(len(directions), dtype=bool)
+        direction_index[exact] = nearest[exact]
+        extra = ~exact & np.any(directions != 0, axis=1)
+        direction_index[extra] = len(table) + np.arange(np.count_nonzero(extra))
+    return {
+        "branch_id": np.array(branch_ids, dtype=np.int64),
+        "depth": np.array(depths, dtype=np.int32),
+        "bounds_min": np.array(bounds_min, dtype=np.float32).reshape(-1, 3),
+        "bounds_max": np.array(bounds_max, dtype=np.float32).reshape(-1, 3),
+        "score": np.array(scores, dtype=np.float64),
+        "b": np.array(bs, dtype=np.float64),
+        "num_samples": np.array(num_samples, dtype=np.int64),
+        "position": np.array(positions, dtype=np.float32).reshape(-1, 3),
+        "direction_index": direction_index,
+        "sample_score": np.array(sample_scores, dtype=np.float32),
+        "fov": np.array(fovs, dtype=np.float32),
+        "extra_direction": directions[extra].astype(np.float32),
+    }
+
+
+def merge_encoded(chunks: List[Dict[str, np.ndarray]], table_size: int) -> Dict[str, np.ndarray]:
+    """
+    encode_nodes の結果をログの順に結合し、サンプルのオフセットとノードIDの索引を作る
+    Concatenate the outputs of encode_nodes in the order of the log, and build the sample offsets and the node id index.
+    """
+    columns = {name: np.concatenate([c[name] for c in chunks]) for name in chunks[0] if name != "direction_index"}
+    # the extra directions of each chunk are shifted by the extras of the preceding chunks
+    extra_offsets = np.cumsum([0] + [len(c["extra_direction"]) for c in chunks[:-1]])
+    columns["direction_index"] = np.concatenate([np.where(c["direction_index"] >= table_size, c["direction_index"] + offset, c["direction_index"])
+                                                 for c, offset in zip(chunks, extra_offsets)]).astype(np.int32)
+    columns["sample_offset"] = np.concatenate([[0], np.cumsum(columns.pop("num_samples"))]).astype(np.int64)
+    order = np.argsort(columns["branch_id"], kind="stable")
+    columns["index_branch_id"] = columns["branch_id"][order]
+    columns["index_row"] = order.astype(np.int64)
+    return columns
+
+
+def write_columnar_log(path: str, columns: Dict[str, np.ndarray], table_size: int):
+    """
+    File layout: MAGIC, the length of the json header (8 bytes, little endian), the json header,
+    and the arrays aligned to 64 bytes. The header maps the name of each array to its dtype, shape and offset.
+    """
+    arrays = {name: np.ascontiguousarray(a) for name, a in columns.items()}
+    header = {"version": 1, "direction_table_size": table_size, "arrays": {}}
+
+    def header_bytes():
+        return json.dumps(header).encode()
+
+    # the offsets depend on the length of the header, which is fixed by reserving room for the largest offsets
+    for name, a in arrays.items():
+        header["arrays"][name] = {"dtype": a.dtype.str, "shape": list(a.shape), "offset": 10 ** 15}
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes())) // _ALIGNMENT) * _ALIGNMENT
+    offset = data_start
+    for name, a in arrays.items():
+        header["arrays"][name]["offset"] = offset
+        offset = -(-(offset + a.nbytes) // _ALIGNMENT) * _ALIGNMENT
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        encoded = header_bytes()
+        f.write(MAGIC)
+        f.write(len(encoded).to_bytes(8, "little"))
+        f.write(encoded)
+        for name, a in arrays.items():
+            f.seek(header["arrays"][name]["offset"])
+            f.write(a.tobytes())
+        f.truncate(offset)
+    os.replace(tmp_path, path)
+
+
+def _encode_byte_range(log_file_path: str, start: int, end: int, table_size: int) -> Dict[str, np.ndarray]:
+    """
+    start <= 行頭 < end の行をエンコードする
+    Encode the lines which begin in [start, end).
+    """
+    nodes = []
+    with open(log_file_path, "rb") as f:
+        if start > 0:
+            # skip the rest of the line which begins before start
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                nodes.append(json.loads(line))
+    return encode_nodes(nodes, direction_table(table_size))
+
+
+def convert_to_columnar(log_file_path: str, output_path: str, table_size: int = 21, num_workers: int = 0, chunk_size: int = 64 << 20):
+    """
+    JSONLの探索ログを列指向のログに変換する 非圧縮のログはバイト範囲ごとに並列にエンコードする
+    Convert a JSONL exploration log into a columnar log.
+    Uncompressed logs are split into byte ranges of about chunk_size bytes, which are encoded in parallel.
+    Args:
+        table_size: 方向のテーブルの大きさ (探索時の num_local_dir) size of the direction table, num_local_dir of the exploration
+        num_workers: 0の場合はCPUの数 number of processes, the number of CPUs if 0
+    """
+    if str(log_file_path).endswith(".gz"):
+        table = direction_table(table_size)
+        with open_node_log(log_file_path) as f:
+            chunks = [encode_nodes((json.loads(line) for line in f if line.strip()), table)]
+    else:
+        size = os.path.getsize(log_file_path)
+        bounds = list(range(0, size, chunk_size)) + [size]
+        num_workers = num_workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=min(num_workers, max(len(bounds) - 1, 1))) as executor:
+            chunks = list(executor.map(_encode_byte_range, [log_file_path] * (len(bounds) - 1), bounds[:-1], bounds[1:], [table_size] * (len(bounds) - 1)))
+        if len(chunks) == 0:
+            chunks = [encode_nodes([], direction_table(table_size))]
+    write_columnar_log(output_path, merge_encoded(chunks, table_size), table_size)
+
+
+def is_columnar_log(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class ColumnarLog:
+    """
+    列指向の探索ログ (.plog) をメモリマップで読み込む
+    ノードとサンプルの列はNumPy配列で、方向は generate_list_dir のテーブルへのインデックスで保存されている
+    NodeViewModel は必要になったときにのみ作る
+    Memory-maps a columnar exploration log (.plog).
+    The node and sample columns are NumPy arrays, and the directions are stored as indices
+    into the table of generate_list_dir. NodeViewModels are built only when asked for.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            assert f.read(len(MAGIC)) == MAGIC, f"{path} is not a columnar log"
+            header_size = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(header_size))
+        self.table_size = header["direction_table_size"]
+        self.arrays: Dict[str, np.ndarray] = {}
+        for name, spec in header["arrays"].items():
+            shape = tuple(spec["shape"])
+            if int(np.prod(shape)) == 0:
+                self.arrays[name] = np.zeros(shape, dtype=np.dtype(spec["dtype"]))
+            else:
+                # plain ndarray views of the map, indexing the memmap subclass is much slower
+                self.arrays[name] = np.memmap(path, dtype=np.dtype(spec["dtype"]), mode="r", offset=spec["offset"], shape=shape).view(np.ndarray)
+        self._directions: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.arrays["branch_id"])
+
+    @property
+    def num_samples(self) -> int:
+        return len(self.arrays["sample_score"])
+
+    @property
+    def directions(self) -> np.ndarray:
+        """
+        Returns:
+            (m, 3) float64 direction of each sample, decoded once
+        """
+        if self._directions is None:
+            table = np.concatenate([direction_table(self.table_size), self.arrays["extra_direction"].astype(np.float64), np.zeros((1, 3))])
+            index = np.asarray(self.arrays["direction_index"]).astype(np.int64)
+            self._directions = table[np.where(index < 0, len(table) - 1, index)]
+        return self._directions
+
+    def node_id(self, row: int) -> str:
+        return f"{int(self.arrays['depth'][row]):04}-{int(self.arrays['branch_id'][row]):08}"
+
+    def row(self, node_id: str) -> int:
+        """
+        Returns:
+            last row of the node, as in the log the node is re-written when it is updated, -1 if it is not in the log
+        """
+        depth, branch_id = (int(e) for e in node_id.split("-"))
+        keys = self.arrays["index_branch_id"]
+        # the index is sorted stably, the last entry of the branch id is its latest row
+        i = int(np.searchsorted(keys, branch_id, side="right")) - 1
+        if i < 0 or keys[i] != branch_id:
+            return -1
+        row = int(self.arrays["index_row"][i])
+        return row if self.arrays["depth"][row] == depth else -1
+
+    def sample_range(self, row: int) -> Tuple[int, int]:
+        offsets = self.arrays["sample_offset"]
+        return int(offsets[row]), int(offsets[row + 1])
+
+    def sample_nodes(self) -> np.ndarray:
+        """
+        Returns:
+            (m,) row of the node of each sample
+        """
+        return np.repeat(np.arange(len(self)), np.diff(self.arrays["sample_offset"]))
+
+    def sample_index_arrays(self) -> Tuple[np.ndarray, ...]:
+        """
+        Returns:
+            (positions, directions, scores, branch_ids, depths) of the samples
+        """
+        rows = self.sample_nodes()
+        return (np.asarray(self.arrays["position"], dtype=np.float64), self.directions, np.asarray(self.arrays["sample_score"], dtype=np.float64),
+                np.asarray(self.arrays["branch_id"])[rows], np.asarray(self.arrays["depth"]).astype(np.int64)[rows])
+
+    def photo_scorings(self, row: int) -> List[PhotoScoring]:
+        start, end = self.sample_range(row)
+        positions = self.arrays["position"][start:end].astype(np.float64).tolist()
+        directions = self.directions[start:end].tolist()
+        scores = self.arrays["sample_score"][start:end].astype(np.float64).tolist()
+        fovs = self.arrays["fov"][start:end].astype(np.float64).tolist()
+        index = self.arrays["direction_index"][start:end]
+        return [PhotoScoring.model_construct(
+            cameraParameter=CameraParameter.model_construct(position=Vector3f.model_construct(x=p[0], y=p[1], z=p[2]),
+                                                            direction=Vector3f.model_construct(x=d[0], y=d[1], z=d[2]) if i >= 0 else None,
+                                                            quaternion=None, fieldOfView=fov, aspect=0.0),
+            score=score)
+            for p, d, score, fov, i in zip(positions, directions, scores, fovs, index)]
+
+    def node_view_model(self, row: int, with_photo_scorings: bool = True) -> NodeViewModel:
+        """
+        検証を行わずに NodeViewModel を作る
+        Build the NodeViewModel of a row without pydantic validation.
+        """
+        return next(iter(self.node_view_models(with_photo_scorings, row, row + 1)))
+
+    def node_view_models(self, with_photo_scorings: bool = True, start: int = 0, end: Optional[int] = None) -> Iterable[NodeViewModel]:
+        """
+        Args:
+            with_photo_scorings: Falseの場合 photoScorings は空で、必要なときに photo_scorings で取得する
+                photoScorings are left empty if False, to be fetched with photo_scorings when needed
+        """
+        end = len(self) if end is None else end
+        a = self.arrays
+        columns = zip(range(start, end), a["depth"][start:end].tolist(), a["branch_id"][start:end].tolist(),
+                      a["bounds_min"][start:end].astype(np.float64).tolist(), a["bounds_max"][start:end].astype(np.float64).tolist(),
+                      a["score"][start:end].tolist(), a["b"][start:end].tolist())
+        for row, depth, branch_id, bmin, bmax, score, b in columns:
+            yield NodeViewModel.model_construct(
+                id=f"{depth:04}-{branch_id:08}",
+                branchId=branch_id,
+                parentId=f"{depth - 1:04}-{branch_id >> 1:08}" if depth > 0 else None,
+                depth=depth,
+                min=Vector3f.model_construct(x=bmin[0], y=bmin[1], z=bmin[2]),
+                max=Vector3f.model_construct(x=bmax[0], y=bmax[1], z=bmax[2]),
+                score=score,
+                b=None if b != b else b,
+                photoScorings=self.photo_scorings(row) if with_photo_scorings else [],
+                leafGridNodes=None,
+                child_left=None,
+                child_right=None)
@@ -0,0 +1,100 @@
+from typing import List, Callable, Tuple, Optional
+
+import numpy as np
+
+from render_server.render_api_client import RenderAPIClient
+from render_server.render_api_data import CameraParameter, RenderDepthRequest
+from util.time_measure import TimeMeasure
+
+RenderAndScore = Callable[[List[CameraParameter]], Tuple[List[np.ndarray], np.ndarray]]
+
+
+class DepthPrePass:
+    """
+    フルサイズのカラー画像をレンダリングする前に、低解像度の深度マップを一括で取得し、
+    近くの壁に向いたカメラ方向をレンダリング対象から取り除く
+    取り除かれた方向には固定の低いスコアが与えられる
+    Cheap pre-pass which fetches tiny depth maps for all candidate directions in one call,
+    and drops the directions facing nearby walls before the full resolution color renders.
+    The dropped directions get a fixed low score.
+    """
+
+    def __init__(self,
+                 api_client: RenderAPIClient,
+                 depth_threshold: float = 1.0,
+                 texture_size: int = 8,
+                 pruned_score: float = 0.0):
+        """
+        Args:
+            api_client:
+            depth_threshold: 深度マップの中央値がこの値[m]未満の方向を取り除く
+                directions whose median depth [m] is below this value are dropped
+            texture_size: 深度マップの解像度 resolution of the depth maps
+            pruned_score: 取り除かれた方向に与えるスコア score given to the dropped directions
+        """
+        self.api_client = api_client
+        self.depth_threshold = depth_threshold
+        self.texture_size = texture_size
+        self.pruned_score = pruned_score
+        self.num_requested = 0
+        self.num_pruned = 0
+
+    def filter(self, camera_parameters: List[CameraParameter]) -> np.ndarray:
+        """
+        Args:
+            camera_parameters:
+        Returns:
+            レンダリングすべきカメラパラメータを示すboolのマスク
+            boolean mask of the camera parameters to be rendered
+        """
+        if len(camera_parameters) == 0:
+            return np.zeros(0, dtype=bool)
+        with TimeMeasure.default().measure("depth pre-pass"):
+            request = RenderDepthRequest(cameraParameters=camera_parameters, textureSize=self.texture_size)
+            depths = np.stack(self.api_client.request_render_depth(request))
+        median_depths = np.median(depths.reshape(len(camera_parameters), -1), axis=1)
+        mask = median_depths >= self.depth_threshold
+        self.num_requested += len(mask)
+        self.num_pruned += int(np.count_nonzero(~mask))
+        return mask
+
+    def evaluate(self, camera_parameters: List[CameraParameter], render_and_score: RenderAndScore) -> Tuple[List[Optional[np.ndarray]], np.ndarray]:
+        """
+        深度マップで取り除かれなかったカメラパラメータのみを render_and_score に渡し、結果を元の順序に戻す
+        Pass only the camera parameters which survive the depth test to render_and_score, and restore the original order.
+        Args:
+            camera_parameters:
+            render_and_score: カメラパラメータを受け取り、画像とスコアを返す関数
+                function which renders and scores the given camera parameters
+        Returns:
+            images: 取り除かれた方向はNone None for the dropped directions
+            scores: 取り除かれた方向は pruned_score pruned_score for the dropped directions
+        """
+        mask = self.filter(camera_parameters)
+        images: List[Optional[np.ndarray]] = [None] * len(camera_parameters)
+        scores = np.full(len(camera_parameters), self.pruned_score, dtype=np.float32)
+        kept_indices = np.flatnonzero(mask)
+        if len(kept_indices) == 0:
+            return images, scores
+
+        kept_images, kept_scores = render_and_score([camera_parameters[i] for i in kept_indices])
+        scores[kept_indices] = kept_scores
+        for i, image in zip(kept_indices, kept_images):
+            images[i] = image
+        return images, scores
+
+    @property
+    def pruned_ratio(self) -> float:
+        if self.num_requested == 0:
+            return 0.0
+        return self.num_pruned / self.num_requested
+
+    def reset_stats(self):
+        self.num_requested = 0
+        self.num_pruned = 0
+
+    def stats(self) -> dict:
+        return {"requested": self.num_requested, "pruned": self.num_pruned, "pruned_ratio": self.pruned_ratio}
+
+    def print_stats(self):
+        print(f'[DEPTH PRE-PASS] pruned {self.num_pruned}/{self.num_requested} renders ({self.pruned_ratio:.1%})', flush=True)
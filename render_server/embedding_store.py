@@ -0,0 +1,135 @@
+import json
+import os
+from typing import List, Optional, Dict
+
+import numpy as np
+
+from render_server.render_api_data import CameraParameter
+
+# position (3), direction (3), field of view
+POSE_SIZE = 7
+
+
+def pose_array(camera_parameters: List[CameraParameter]) -> np.ndarray:
+    """
+    Returns:
+        (n, 7) float32 poses, the direction is zero for the camera parameters given by a quaternion
+    """
+    poses = np.zeros((len(camera_parameters), POSE_SIZE), dtype=np.float32)
+    for i, cp in enumerate(camera_parameters):
+        poses[i, :3] = cp.position.elements
+        if cp.direction is not None:
+            poses[i, 3:6] = cp.direction.elements
+        poses[i, 6] = cp.fieldOfView
+    return poses
+
+
+class EmbeddingStore:
+    """
+    スコア付けされた画像ごとの ScoringNet の埋め込み (分類ヘッドの入力) をカメラの姿勢とともにディスクに追記する
+    ファイルは np.memmap で読み込むため、全体をメモリに載せずにヘッドのみの再スコアリングや重複除去に使える
+    Appends the ScoringNet embedding (the input of the classifier head) of every scored image to disk,
+    keyed by the camera position and direction.
+    The files are read back with np.memmap, so that rescoring with the head only and deduplication
+    do not have to load the whole store into memory.
+
+    Files in the store directory:
+        meta.json: {"dim": embedding size, "dtype": dtype of the embeddings}
+        embeddings.bin: (n, dim) embeddings
+        poses.bin: (n, 7) float32 position, direction and field of view
+        scores.bin: (n,) float32 scores at the time of scoring
+    """
+
+    def __init__(self, root: str, dtype: str = "float16", key_precision: float = 1e-3):
+        """
+        Args:
+            root: 保存先のディレクトリ 既存のストアには追記する directory of the store, an existing store is appended to
+            dtype: 埋め込みの保存形式 dtype of the stored embeddings
+            key_precision: 位置と方向を照合する際の丸めの単位 rounding unit of the positions and directions when they are looked up
+        """
+        self.root = root
+        self.key_precision = key_precision
+        self.dim: Optional[int] = None
+        self.dtype = np.dtype(dtype)
+        os.makedirs(root, exist_ok=True)
+        if os.path.exists(self._path("meta.json")):
+            with open(self._path("meta.json")) as f:
+                meta = json.load(f)
+            self.dim = meta["dim"]
+            self.dtype = np.dtype(meta["dtype"])
+        self._files = None
+        self._keys: Optional[Dict[bytes, int]] = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def __len__(self) -> int:
+        path = self._path("scores.bin")
+        if self._files is not None:
+            self._files["scores"].flush()
+        return os.path.getsize(path) // 4 if os.path.exists(path) else 0
+
+    def add(self, camera_parameters: List[CameraParameter], embeddings: np.ndarray, scores: np.ndarray):
+        embeddings = np.asarray(embeddings).reshape(len(camera_parameters), -1)
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+            with open(self._path("meta.json"), "w") as f:
+                json.dump({"dim": self.dim, "dtype": self.dtype.name}, f)
+        assert embeddings.shape[1] == self.dim, f"embedding size {embeddings.shape[1]} does not match the store ({self.dim})"
+        if self._files is None:
+            self._files = {name: open(self._path(f"{name}.bin"), "ab") for name in ["embeddings", "poses", "scores"]}
+        start = len(self)
+        poses = pose_array(camera_parameters)
+        self._files["embeddings"].write(embeddings.astype(self.dtype).tobytes())
+        self._files["poses"].write(poses.tobytes())
+        self._files["scores"].write(np.asarray(scores, dtype=np.float32).tobytes())
+        if self._keys is not None:
+            for i, key in enumerate(self._pose_keys(poses[:, :6])):
+                self._keys[key] = start + i
+
+    def flush(self):
+        if self._files is not None:
+            for f in self._files.values():
+                f.flush()
+
+    def close(self):
+        if self._files is not None:
+            for f in self._files.values():
+                f.close()
+            self._files = None
+
+    def _memmap(self, name: str, dtype: np.dtype, width: int) -> np.ndarray:
+        self.flush()
+        n = len(self)
+        if n == 0:
+            return np.zeros((0, width), dtype=dtype)
+        return np.memmap(self._path(f"{name}.bin"), dtype=dtype, mode="r", shape=(n, width))
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        return self._memmap("embeddings", self.dtype, self.dim or 0)
+
+    @property
+    def poses(self) -> np.ndarray:
+        return self._memmap("poses", np.dtype(np.float32), POSE_SIZE)
+
+    @property
+    def scores(self) -> np.ndarray:
+        return self._memmap("scores", np.dtype(np.float32), 1).reshape(-1)
+
+    def _pose_keys(self, positions_directions: np.ndarray) -> List[bytes]:
+        rounded = np.round(np.asarray(positions_directions, dtype=np.float64) / self.key_precision).astype(np.int64)
+        return [row.tobytes() for row in rounded]
+
+    def lookup(self, positions: np.ndarray, directions: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            positions: (n, 3)
+            directions: (n, 3)
+        Returns:
+            (n,) row of the latest embedding of each camera, -1 if the camera is not stored
+        """
+        if self._keys is None:
+            self._keys = {key: i for i, key in enumerate(self._pose_keys(self.poses[:, :6]))}
+        query = np.concatenate([np.asarray(positions).reshape(-1, 3), np.asarray(directions).reshape(-1, 3)], axis=1)
+        return np.array([self._keys.get(key, -1) for key in self._pose_keys(query)], dtype=np.int64)
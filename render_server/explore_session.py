@@ -0,0 +1,226 @@
+import random
+import re
+import time
+from urllib.parse import urlparse
+from typing import Optional, Callable
+
+import numpy as np
+
+from data.explorer_data import HOOConfig, RenderAPIConfig, LeafGridSearchConfig, DepthPrePassConfig, OccupancyGridConfig, \
+    MultiFidelityConfig, DirectionSearchConfig, SurrogateConfig, SampleReuseConfig, EmbeddingCacheConfig, NodeLogConfig, \
+    NodeUploadConfig, TraceConfig, ProfileConfig
+from render_server import factory
+from render_server.leaf_grid_searcher import LeafGridSearcher
+from render_server.live_metrics import HTTP_SESSIONS
+from render_server.logger import NullLogger
+from render_server.multi_fidelity import ResolutionSchedule
+from render_server.perf_summary import config_dict, build_perf_summary, write_perf_summary, server_info, counter_total
+from render_server.scoring_net_params import add_scoring_net_params
+from render_server.world_explorer_runner import WorldExplorerRunner
+from util.hf_argparser import HfArgumentParser
+from util.time_measure import TimeMeasure
+
+# the config dataclasses of an exploration, in the order ExploreSession takes them
+EXPLORE_CONFIG_TYPES = (HOOConfig, RenderAPIConfig, LeafGridSearchConfig, DepthPrePassConfig, OccupancyGridConfig,
+                        MultiFidelityConfig, DirectionSearchConfig, SurrogateConfig, SampleReuseConfig, EmbeddingCacheConfig,
+                        NodeLogConfig, NodeUploadConfig, TraceConfig, ProfileConfig)
+
+
+def create_explore_parser(*extra_types) -> HfArgumentParser:
+    """
+    探索の設定と Scoring Net のパラメータを読み込むパーサー extra_types は探索の設定より前に返される
+    The parser of the exploration configs and the scoring net parameters. The extra_types are returned before the exploration configs.
+    """
+    parser = HfArgumentParser(tuple(extra_types) + EXPLORE_CONFIG_TYPES)
+    add_scoring_net_params(parser)
+    return parser
+
+
+def endpoint_world_id(endpoint_url: str) -> str:
+    """
+    ワールドの名前がない場合にワールドを表すレンダリングサーバーのホストとポート
+    The host and the port of the render server, which stand for the world when it has no name.
+    """
+    url = urlparse(endpoint_url)
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", f"{url.hostname}_{url.port}")
+
+
+class ExploreSession:
+    """
+    1つのワールドの探索に必要なもの (Scoring Net、HOO、レンダリングサーバーのクライアント、ロガー、キャッシュ) を設定から作り、探索を実行する
+    TUI (panotree_explorer) とヘッドレスのバッチ探索 (tools.batch_explore) で共有する
+    Everything an exploration of a world needs (the scoring net, HOO, the render server client, the loggers and the caches)
+    created from the configs, and the exploration itself.
+    Shared by the TUI (panotree_explorer) and the headless batch exploration (tools.batch_explore).
+    """
+
+    def __init__(self,
+                 hoo_conf: HOOConfig,
+                 api_client_conf: RenderAPIConfig,
+                 grid_conf: LeafGridSearchConfig,
+                 depth_conf: DepthPrePassConfig,
+                 occupancy_conf: OccupancyGridConfig,
+                 multi_fidelity_conf: MultiFidelityConfig,
+                 direction_conf: DirectionSearchConfig,
+                 surrogate_conf: SurrogateConfig,
+                 reuse_conf: SampleReuseConfig,
+                 embedding_conf: EmbeddingCacheConfig,
+                 log_conf: NodeLogConfig,
+                 upload_conf: NodeUploadConfig,
+                 trace_conf: TraceConfig,
+                 profile_conf: ProfileConfig,
+                 args,
+                 session_id: Optional[str] = None,
+                 world_id: Optional[str] = None):
+        """
+        Args:
+            world_id: ワールドの名前 占有グリッドのキャッシュのキーになる occupancy_world が優先される (None: レンダリングサーバーのホストとポート)
+                name of the world, the key of its cached occupancy grid, occupancy_world takes precedence
+                (None: the host and the port of the render server)
+        """
+        self.hoo_conf = hoo_conf
+        self.api_client_conf = api_client_conf
+        self.grid_conf = grid_conf
+        self.upload_conf = upload_conf
+        self.run_config = config_dict(hoo_conf, api_client_conf, grid_conf, depth_conf, occupancy_conf, multi_fidelity_conf, direction_conf,
+                                      surrogate_conf, reuse_conf, embedding_conf, log_conf, upload_conf, trace_conf, profile_conf, args=args)
+
+        random.seed(hoo_conf.seed)
+        np.random.seed(hoo_conf.seed)
+
+        log_root = hoo_conf.log_root
+        self.session_id = session_id if session_id is not None else f"{time.time()}"
+        self.node_logger = factory.create_node_logger(log_conf, log_root, self.session_id, "explore")
+        self.tracer = factory.create_trace_recorder(trace_conf, log_root)
+        TimeMeasure.default().tracer = self.tracer
+        self.trace_path = f"{log_root}/explore_{self.session_id}_trace.json"
+        self.perf_path = f"{log_root}/explore_{self.session_id}_perf.json" if log_root else None
+        self.profiler = factory.create_run_profiler(profile_conf, log_root, self.session_id)
+        embedding_root = f"{log_root}/explore_{self.session_id}_embeddings" if log_root else None
+        self.embedding_store = factory.create_embedding_store(embedding_conf, embedding_root)
+        self.scoring_net = factory.create_scoring_net(args, self.embedding_store)
+        self.explorer = factory.create_hoo_explorer(hoo_conf, occupancy_conf, direction_conf, reuse_conf)
+        self.api_client = factory.create_render_api_client(api_client_conf)
+        if occupancy_conf.occupancy_world:
+            world_id = occupancy_conf.occupancy_world
+        self.world_id = world_id if world_id is not None else endpoint_world_id(self.api_client.endpoint_url)
+        self.depth_pre_pass = factory.create_depth_pre_pass(depth_conf, self.api_client)
+        self.occupancy_grid_cache = factory.create_occupancy_grid_cache(occupancy_conf, self.api_client, self.world_id)
+        audit_path = f"{log_root}/explore_{self.session_id}_surrogate.jsonl" if log_root else None
+        self.surrogate_gate = factory.create_surrogate_gate(surrogate_conf, audit_path)
+        self.runner = WorldExplorerRunner(
+            scoring_net=self.scoring_net,
+            explorer=self.explorer,
+            api_client=self.api_client,
+            node_logger=self.node_logger,
+            logger=NullLogger(),
+            depth_pre_pass=self.depth_pre_pass,
+            occupancy_grid_cache=self.occupancy_grid_cache,
+            resolution_schedule=ResolutionSchedule.parse(multi_fidelity_conf.resolution_schedule, multi_fidelity_conf.full_texture_size),
+            multi_fidelity_top_k=multi_fidelity_conf.multi_fidelity_top_k,
+            surrogate_gate=self.surrogate_gate
+        )
+        self.leaf_grid_searcher = LeafGridSearcher(self.scoring_net, factory.create_rollout(hoo_conf, direction_conf, num_pos_diff=0), self.api_client,
+                                                   grid_conf.grid_divider,
+                                                   depth_pre_pass=self.depth_pre_pass,
+                                                   max_depth=grid_conf.grid_max_depth,
+                                                   margin=grid_conf.grid_margin,
+                                                   render_budget=grid_conf.grid_render_budget)
+
+    @property
+    def node_log_path(self) -> Optional[str]:
+        """
+        探索ログのパス log_root がない場合は None  path of the exploration log, None without a log_root
+        """
+        return getattr(self.node_logger, "log_file_path", None)
+
+    def cache_stats(self) -> dict:
+        caches = {}
+        if self.depth_pre_pass is not None:
+            caches["depth_pre_pass"] = self.depth_pre_pass.stats()
+        if self.occupancy_grid_cache is not None:
+            caches["occupancy_grid"] = self.occupancy_grid_cache.stats()
+        if self.surrogate_gate is not None:
+            caches["surrogate"] = self.surrogate_gate.stats()
+        if self.explorer.sample_reuse is not None:
+            caches["sample_reuse"] = self.explorer.sample_reuse.stats()
+        if self.embedding_store is not None:
+            caches["embedding_cache"] = {"embeddings": len(self.embedding_store)}
+        return caches
+
+    def write_trace(self):
+        if self.tracer is None:
+            return
+        self.tracer.write(self.trace_path)
+        print(f'[TRACE] {len(self.tracer)} events ({self.tracer.num_dropped} dropped) in {self.trace_path}', flush=True)
+
+    def explore(self, on_step: Optional[Callable[[int], None]] = None) -> dict:
+        """
+        ノードをリセットして num_updates 回探索し、統計を表示して性能の要約を書き出す
+        Reset the nodes, explore num_updates times, print the statistics and write the performance summary.
+        The trace is written by close.
+        Args:
+            on_step: 各ステップの評価の後に呼ばれる called after the evaluation of each step
+        Returns:
+            the performance summary of the exploration
+        """
+        runner = self.runner
+        num_updates = self.hoo_conf.num_updates
+        runner.reset_nodes()
+        bbox = runner.calculate_bounding_box()
+
+        tm = TimeMeasure.default()
+        # the performance summary covers this exploration only
+        tm.reset_all_avg()
+        start = time.perf_counter()
+        num_nodes, num_images = runner.num_evaluated_nodes, runner.num_rendered_images
+
+        for i in range(num_updates):
+            if self.profiler is not None:
+                self.profiler.step(i)
+            with tm.measure("evaluate_leaf"):
+                runner.evaluate_leaf(bbox)
+                if on_step is not None:
+                    on_step(i)
+        wall_seconds = time.perf_counter() - start
+
+        self.node_logger.flush()
+        if self.profiler is not None:
+            self.profiler.finish(num_updates)
+        tm.print_avg()
+        if self.depth_pre_pass is not None:
+            self.depth_pre_pass.print_stats()
+        if self.occupancy_grid_cache is not None:
+            self.explorer.print_occupancy_stats()
+        if self.surrogate_gate is not None:
+            self.surrogate_gate.print_stats()
+        if self.explorer.sample_reuse is not None:
+            self.explorer.sample_reuse.print_stats()
+        runner.print_sample_efficiency()
+        if self.embedding_store is not None:
+            self.embedding_store.flush()
+            print(f'[EMBEDDING CACHE] {len(self.embedding_store)} embeddings in {self.embedding_store.root}', flush=True)
+        summary = build_perf_summary("explore", self.session_id, self.run_config, wall_seconds,
+                                     counts={"nodes": runner.num_evaluated_nodes - num_nodes,
+                                             "images": runner.num_rendered_images - num_images,
+                                             "http_bytes": counter_total(tm, HTTP_SESSIONS, "bytes")},
+                                     caches=self.cache_stats(),
+                                     server=server_info(self.api_client))
+        if self.perf_path is not None:
+            write_perf_summary(self.perf_path, summary)
+        runner.report_multi_fidelity()
+        return summary
+
+    def close(self):
+        """
+        探索ログを閉じ、トレースを書き出す
+        Close the exploration log and write the trace.
+        """
+        self.node_logger.close()
+        self.write_trace()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
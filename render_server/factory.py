@@ -1,18 +1,32 @@
 import logging
 from contextlib import suppress
 from functools import partial
+from typing import Optional, Union
 
 import torch
 from torchvision import transforms as transforms
 
-from data.explorer_data import HOOConfig, RenderAPIConfig
-from exploration.algorithm import HOOExplorer
-from render_server.logger import NodeLogger, NullLogger
+from data.explorer_data import HOOConfig, RenderAPIConfig, DepthPrePassConfig, OccupancyGridConfig, DirectionSearchConfig, \
+    PoseRefinementConfig, SurrogateConfig, SampleReuseConfig, EmbeddingCacheConfig, NodeLogConfig, \
+    NodeUploadConfig, TraceConfig, ProfileConfig
+from exploration.algorithm import HOOExplorer, Rollout, SuccessiveHalvingRollout
+from exploration.sample_reuse import SampleReuse
+from exploration.surrogate import KNNScoreSurrogate
+from render_server.depth_pre_pass import DepthPrePass
+from render_server.embedding_store import EmbeddingStore
+from render_server.logger import NodeLogger, NullLogger, NullNodeLogger, FileNodeLogger, BufferedFileNodeLogger
+from render_server.node_uploader import NodeUploader
+from render_server.occupancy_grid_cache import OccupancyGridCache
+from render_server.pose_optimizer import LocalPoseOptimizer
 from render_server.render_api_client import RenderAPIClient
 from render_server.render_api_client_params import parse_api_client_params
+from render_server.render_archive import RenderArchiveWriter
+from render_server.run_profiler import RunProfiler
 from render_server.scoring_net import ScoringNet
+from render_server.surrogate_gate import SurrogateGate
 from render_server.world_explorer_runner import WorldExplorerRunner
 from render_server.wsl_utils import is_running_in_wsl, get_windows_host_ip
+from util.trace import TraceRecorder
 from timm import create_model
 from timm.models import load_checkpoint
 
@@ -36,7 +50,7 @@ has_compile = hasattr(torch, 'compile')
 _logger = logging.getLogger('validate')
 
 
-def create_scoring_net(args) -> ScoringNet:
+def create_scoring_net(args, embedding_store: Optional[EmbeddingStore] = None) -> ScoringNet:
     # prepare
     # might as well try to validate something
     args.pretrained = args.pretrained or not args.checkpoint
@@ -130,7 +144,9 @@ def create_scoring_net(args) -> ScoringNet:
         transforms.ToTensor(),
         normalize,
     ])
-    return ScoringNet(model, device, transform)
+    pretrained_cfg = getattr(model, 'pretrained_cfg', None) or {}
+    input_size = args.input_size[-1] if args.input_size is not None else pretrained_cfg.get('input_size', (3, 224, 224))[-1]
+    return ScoringNet(model, device, transform, input_size=input_size, embedding_store=embedding_store)
 
 
 def create_runner(args, node_logger: NodeLogger):
@@ -146,10 +162,47 @@ def create_runner(args, node_logger: NodeLogger):
     return runner, explorer
 
 
-def create_hoo_explorer(hoo_conf: HOOConfig):
+def create_rollout(hoo_conf: HOOConfig, direction_conf: Optional[DirectionSearchConfig] = None,
+                   num_pos_diff: Optional[int] = None) -> Union[Rollout, SuccessiveHalvingRollout]:
+    """
+    Args:
+        num_pos_diff: 位置をずらすカメラの数 (None: hoo_conf.num_local_pos) グリッドサーチは格子点から動かさないよう0を渡す
+            number of cameras at perturbed positions (None: hoo_conf.num_local_pos), the grid search passes 0 to stay on the lattice points
+    """
+    direction_conf = direction_conf if direction_conf is not None else DirectionSearchConfig()
+    num_pos_diff = num_pos_diff if num_pos_diff is not None else hoo_conf.num_local_pos
+    if direction_conf.direction_search == "uniform":
+        return Rollout(num_pos_diff=num_pos_diff, num_dir=hoo_conf.num_local_dir)
+    elif direction_conf.direction_search == "successive_halving":
+        if num_pos_diff > 0:
+            raise ValueError("num_local_pos is not supported by the successive_halving direction search, use the uniform one")
+        return SuccessiveHalvingRollout(num_dir=hoo_conf.num_local_dir,
+                                        num_rounds=direction_conf.sh_num_rounds,
+                                        keep_ratio=direction_conf.sh_keep_ratio)
+    raise ValueError(f"unknown direction search: {direction_conf.direction_search}")
+
+
+def create_sample_reuse(reuse_conf: SampleReuseConfig) -> Optional[SampleReuse]:
+    if reuse_conf.sample_reuse == "off":
+        return None
+    return SampleReuse(mode=reuse_conf.sample_reuse,
+                       region_scale=reuse_conf.reuse_region_scale,
+                       max_angle=reuse_conf.reuse_max_angle,
+                       min_samples=reuse_conf.reuse_min_samples)
+
+
+def create_hoo_explorer(hoo_conf: HOOConfig, occupancy_conf: Optional[OccupancyGridConfig] = None,
+                        direction_conf: Optional[DirectionSearchConfig] = None,
+                        reuse_conf: Optional[SampleReuseConfig] = None):
+    occupancy_conf = occupancy_conf if occupancy_conf is not None else OccupancyGridConfig()
+    reuse_conf = reuse_conf if reuse_conf is not None else SampleReuseConfig()
     return HOOExplorer(c=hoo_conf.c, v1=hoo_conf.v1, rho=hoo_conf.rho, policyName=hoo_conf.policy_name, \
-                       num_pos_diff=0, num_dir=hoo_conf.num_local_dir,
-                       value_storategy=hoo_conf.value_strategy)
+                       num_pos_diff=hoo_conf.num_local_pos, num_dir=hoo_conf.num_local_dir,
+                       value_storategy=hoo_conf.value_strategy,
+                       invalid_position_strategy=occupancy_conf.invalid_position_strategy,
+                       invalid_score=occupancy_conf.invalid_score,
+                       rollout=create_rollout(hoo_conf, direction_conf),
+                       sample_reuse=create_sample_reuse(reuse_conf))
 
 
 def create_render_api_client(api_client_conf: RenderAPIConfig):
@@ -157,4 +210,97 @@ def create_render_api_client(api_client_conf: RenderAPIConfig):
     if host is None:
         host = "localhost" if not is_running_in_wsl() else get_windows_host_ip()
 
-    return RenderAPIClient(f"http://{host}:{api_client_conf.api_port}/")
+    recorder = RenderArchiveWriter(api_client_conf.record_archive) if api_client_conf.record_archive else None
+    return RenderAPIClient(f"http://{host}:{api_client_conf.api_port}/", recorder=recorder)
+
+
+def create_depth_pre_pass(depth_conf: DepthPrePassConfig, api_client: RenderAPIClient) -> Optional[DepthPrePass]:
+    if not depth_conf.depth_pre_pass:
+        return None
+    return DepthPrePass(api_client,
+                        depth_threshold=depth_conf.depth_threshold,
+                        texture_size=depth_conf.depth_texture_size,
+                        pruned_score=depth_conf.depth_pruned_score)
+
+
+def create_occupancy_grid_cache(occupancy_conf: OccupancyGridConfig, api_client: RenderAPIClient, world_id: str) -> Optional[OccupancyGridCache]:
+    if not occupancy_conf.occupancy_grid:
+        return None
+    return OccupancyGridCache(api_client,
+                              cache_dir=occupancy_conf.occupancy_cache_dir,
+                              world_id=world_id,
+                              voxel_size=occupancy_conf.occupancy_voxel_size,
+                              keep_largest_region=occupancy_conf.occupancy_keep_largest_region,
+                              refresh=occupancy_conf.occupancy_refresh)
+
+
+def create_pose_optimizer(refine_conf: PoseRefinementConfig, scoring_net: ScoringNet, api_client: RenderAPIClient, seed: Optional[int] = None) -> LocalPoseOptimizer:
+    return LocalPoseOptimizer(scoring_net, api_client,
+                              num_generations=refine_conf.refine_generations,
+                              population_size=refine_conf.refine_population_size,
+                              num_starts=refine_conf.refine_num_starts,
+                              sigma=refine_conf.refine_sigma,
+                              optimize_fov=refine_conf.refine_optimize_fov,
+                              fov_range=(refine_conf.refine_fov_min, refine_conf.refine_fov_max),
+                              seed=seed)
+
+
+def create_surrogate_gate(surrogate_conf: SurrogateConfig, audit_path: Optional[str]) -> Optional[SurrogateGate]:
+    if not surrogate_conf.surrogate:
+        return None
+    surrogate = KNNScoreSurrogate(k=surrogate_conf.surrogate_k,
+                                  direction_weight=surrogate_conf.surrogate_direction_weight,
+                                  length_scale=surrogate_conf.surrogate_length_scale,
+                                  prior_std=surrogate_conf.surrogate_prior_std)
+    return SurrogateGate(surrogate,
+                         margin=surrogate_conf.surrogate_margin,
+                         beta=surrogate_conf.surrogate_beta,
+                         min_samples=surrogate_conf.surrogate_min_samples,
+                         verify_fraction=surrogate_conf.surrogate_verify_fraction,
+                         audit_path=audit_path)
+
+
+def create_embedding_store(embedding_conf: EmbeddingCacheConfig, root: Optional[str]) -> Optional[EmbeddingStore]:
+    if not embedding_conf.embedding_cache or not root:
+        return None
+    return EmbeddingStore(root, dtype=embedding_conf.embedding_dtype)
+
+
+def create_node_logger(log_conf: NodeLogConfig, log_root: Optional[str], session_id: str, world_id: str) -> NodeLogger:
+    if not log_root:
+        return NullNodeLogger()
+    if log_conf.node_log_writer == "sync":
+        return FileNodeLogger(log_root, session_id, world_id)
+    elif log_conf.node_log_writer == "buffered":
+        return BufferedFileNodeLogger(log_root, session_id, world_id,
+                                      flush_interval=log_conf.node_log_flush_interval,
+                                      batch_size=log_conf.node_log_batch_size,
+                                      fsync=log_conf.node_log_fsync,
+                                      compress=log_conf.node_log_compress,
+                                      max_queue_size=log_conf.node_log_max_queue_size)
+    raise ValueError(f"unknown node log writer: {log_conf.node_log_writer}")
+
+
+def create_node_uploader(upload_conf: NodeUploadConfig, api_client: RenderAPIClient) -> NodeUploader:
+    return NodeUploader(api_client,
+                        chunk_size=upload_conf.node_upload_chunk_size,
+                        compress=upload_conf.node_upload_compress,
+                        lod_top_k=upload_conf.node_upload_lod_top_k,
+                        lod_max_depth=upload_conf.node_upload_lod_max_depth)
+
+
+def create_trace_recorder(trace_conf: TraceConfig, log_root: Optional[str]) -> Optional[TraceRecorder]:
+    if not trace_conf.trace or not log_root:
+        return None
+    return TraceRecorder(max_events=trace_conf.trace_buffer_size)
+
+
+def create_run_profiler(profile_conf: ProfileConfig, log_root: Optional[str], session_id: str) -> Optional[RunProfiler]:
+    profilers = [p.strip() for p in profile_conf.profile.split(",") if p.strip()]
+    if len(profilers) == 0 or not log_root:
+        return None
+    return RunProfiler(log_root, session_id, profilers,
+                       start=profile_conf.profile_start,
+                       num_iterations=profile_conf.profile_iterations,
+                       memory_interval=profile_conf.profile_memory_interval,
+                       memory_top=profile_conf.profile_memory_top)
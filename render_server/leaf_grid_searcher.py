@@ -1,68 +1,126 @@
+import os
+import time
 from dataclasses import dataclass
 from itertools import chain
-from typing import List, TypeVar, Callable, Optional, Iterator, Generator, Tuple
+from typing import List, TypeVar, Callable, Optional, Iterator, Generator, Tuple, Union
 
 import numpy as np
 from textual.widgets import RichLog
 
-from exploration.algorithm import Rollout
+from exploration.algorithm import Rollout, SuccessiveHalvingRollout
+from exploration.spatial_index import SampleIndex
+from render_server.depth_pre_pass import DepthPrePass
 from render_server.render_api_client import RenderAPIClient
-from render_server.render_api_data import RenderSceneRequest, CameraParameter, Vector3f, Bounds, PhotoScoring
+from render_server.perf_summary import build_perf_summary, write_perf_summary, server_info
+from render_server.render_api_data import RenderSceneRequest, CameraParameter, Vector3f, Bounds, PhotoScoring, NodeViewModel, \
+    LeafGridNode, CustomJsonEncoder
+from render_server.sample_index_loader import to_photo_scorings
 from render_server.scoring_net import ScoringNet
 from util import iterutils
 from util.time_measure import TimeMeasure
 
 T = TypeVar("T")
 
+# offsets of the centers of the 8 children of a cell, in units of the cell size
+_CHILD_OFFSETS = np.array([[x, y, z] for x in (-0.25, 0.25) for y in (-0.25, 0.25) for z in (-0.25, 0.25)])
+
+
+def lattice_points(bounds_min: np.ndarray, bounds_max: np.ndarray, divider: int) -> np.ndarray:
+    """
+    バウンディングボックスを divider-1 等分した格子の内部の点を返す
+    Interior points of the lattice dividing the bounding box into divider-1 steps per axis, in x, y, z order.
+    Returns:
+        (n, 3)
+    """
+    t = np.arange(1, divider - 1) / (divider - 1)
+    axes = [lo + t * (hi - lo) for lo, hi in zip(bounds_min, bounds_max)]
+    return np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)
+
+
+def subdivide_cells(centers: np.ndarray, cell_size: np.ndarray) -> np.ndarray:
+    """
+    各セルを2x2x2の子セルに分割し、子セルの中心を返す
+    Split each cell into 2x2x2 children.
+    Args:
+        centers: (n, 3) centers of the cells
+        cell_size: (3,) size of the cells
+    Returns:
+        (n * 8, 3) centers of the children, grouped by the parent
+    """
+    return (centers[:, None, :] + _CHILD_OFFSETS[None, :, :] * cell_size).reshape(-1, 3)
+
 
 @dataclass
 class GridNode:
     id: str
     position: Vector3f
-    images: List[np.ndarray]
+    images: List[Optional[np.ndarray]]  # None for the directions dropped by the depth pre-pass
     photo_scorings: List[PhotoScoring]
 
 
 class LeafGridSearcher:
     def __init__(self,
                  scoring_net: ScoringNet,
-                 rollout: Rollout,
+                 rollout: Union[Rollout, SuccessiveHalvingRollout],
                  render_api_client: RenderAPIClient,
-                 divider: int = 5):
+                 divider: int = 5,
+                 depth_pre_pass: Optional[DepthPrePass] = None,
+                 max_depth: int = 0,
+                 margin: float = 0.05,
+                 render_budget: int = 0,
+                 num_reference: int = 36):
+        """
+        Args:
+            divider: the coarse lattice has divider-2 points per axis
+            max_depth: セルを再帰的に分割する最大回数 (0: 粗い格子のみ) maximum number of subdivisions of the promising cells (0: coarse lattice only)
+            margin: 最良スコアとの差がこの値以内のセルを分割する cells whose best score is within this margin of the best score of the leaf are subdivided
+            render_budget: 1リーフあたりのレンダリング数の上限 (0: 無制限) maximum number of renders per leaf (0: unlimited)
+            num_reference: サンプルインデックスから比較用にレンダリングするリーフ内の上位のサンプル数
+                number of the best indexed samples inside the leaf rendered for reference, when a sample index is given
+        """
         self.divider = divider
+        self.max_depth = max_depth
+        self.margin = margin
+        self.render_budget = render_budget
+        self.num_reference = num_reference
+        self.depth_pre_pass = depth_pre_pass
         self.scoring_net = scoring_net
         self.rollout = rollout
         self.render_api_client = render_api_client
 
-    def search(self, objs: List[T], selector: Callable[[T], Bounds], on_progress: Optional[Callable[[int, T], None]] = None, num_batch: int = 144, rich_log: RichLog = None) -> Generator[Tuple[List[GridNode], T], None, None]:
+    def search(self, objs: List[T], selector: Callable[[T], Bounds], on_progress: Optional[Callable[[int, T], None]] = None, num_batch: int = 144, rich_log: Optional[RichLog] = None,
+               sample_index: Optional[SampleIndex] = None) -> Generator[Tuple[List[GridNode], T], None, None]:
         for i, obj in enumerate(objs):
             bounds = selector(obj)
             with TimeMeasure.default().measure("1 leaf"):
-                cps = list(chain.from_iterable(self._camera_params_generator(bounds)))
-                cps_n = [ps.cameraParameter for ps in obj.photoScorings]
-                rich_log.write(f"leaf {obj.id}")
-                rich_log.write(cps)
-                rich_log.write(cps_n)
-                images = self._render(cps)
-                images_n = self._render(cps_n)
+                if sample_index is not None:
+                    reference = sample_index.top_k(self.num_reference, sample_index.within_bounds(bounds.min.elements, bounds.max.elements))
+                    cps_n = [ps.cameraParameter for ps in to_photo_scorings(sample_index, reference)]
+                else:
+                    cps_n = [ps.cameraParameter for ps in obj.photoScorings]
+                budget = None
+                if self.render_budget > 0:
+                    # the reference renders are charged to the budget of the leaf first, the grid gets the rest
+                    cps_n = cps_n[:self.render_budget]
+                    budget = self.render_budget - len(cps_n)
+                positions, evaluated = self._search_cells(bounds, num_batch, budget)
+                cps = list(chain.from_iterable(e[0] for e in evaluated))
+                if rich_log is not None:
+                    rich_log.write(f"leaf {obj.id}")
+                    rich_log.write(cps)
+                    rich_log.write(cps_n)
+                images_n, scores_n = self._render_and_score(cps_n, num_batch) if len(cps_n) > 0 else ([], [])
                 if on_progress:
                     on_progress(i, obj)
-                with TimeMeasure.default().measure("batch inference"):
-                    scores = [self.scoring_net.forward(gimages) for gimages in iterutils.grouped(num_batch, iter(images))]
-                    scores = list(chain.from_iterable([s.cpu().numpy() for s in scores]))
-                    scores_n = [self.scoring_net.forward(gimages) for gimages in iterutils.grouped(num_batch, iter(images_n))]
-                    scores_n = list(chain.from_iterable([s.cpu().numpy() for s in scores_n]))
-                rich_log.write(scores)
-                rich_log.write(scores_n)
+                if rich_log is not None:
+                    rich_log.write([e[2] for e in evaluated])
+                    rich_log.write(scores_n)
 
                 node_id = 0
                 grid_nodes = []
-                for g in iterutils.grouped(self.rollout.num_dir, zip(images, scores, cps)):
-                    images2 = [e[0] for e in g]
-                    scores2 = [e[1] for e in g]
-                    cps2 = [e[2] for e in g]
+                for position, (cps2, images2, scores2) in zip(positions, evaluated):
                     pss = [PhotoScoring(cameraParameter=cp, score=score).filter_np() for cp, score in zip(cps2, scores2)]
-                    grid_nodes.append(GridNode(f"grid {node_id}", bounds.center.filter_np(), images2, pss))
+                    grid_nodes.append(GridNode(f"grid {node_id}", Vector3f.from_array(position).filter_np(), images2, pss))
 
                     # for g in range(len(images2)):
                     #     images2[g] = np.array(images2[g])
@@ -78,28 +136,152 @@ class LeafGridSearcher:
                     # cv2.waitKey(0)
                 yield grid_nodes, obj
 
+    def _search_cells(self, bounds: Bounds, num_batch: int, budget: Optional[int] = None) -> Tuple[List[np.ndarray], List[Tuple[List[CameraParameter], List[Optional[np.ndarray]], List[float]]]]:
+        """
+        粗い格子から始め、有望なセルのみを再帰的に分割して探索する
+        粗い格子が予算に収まらない場合は、予算に収まる最も細かい粗い格子で一様に探索する
+        Start from the coarse lattice and recursively subdivide only the promising cells, within the render budget.
+        When the coarse lattice does not fit the budget, the finest coarser lattice which fits is used,
+        so that the leaf is still covered uniformly.
+        Args:
+            budget: レンダリング数の上限 (None: 無制限) maximum number of renders (None: unlimited)
+        Returns:
+            evaluated positions and (camera parameters, images, scores) of each position
+        """
+        bounds_min = np.asarray(bounds.min.elements, dtype=np.float64)
+        bounds_max = np.asarray(bounds.max.elements, dtype=np.float64)
+        divider = self.divider
+        if budget is not None:
+            while divider > 3 and (divider - 2) ** 3 * self.rollout.num > budget:
+                divider -= 1
+            if self.rollout.num > budget:
+                print(f'[GRID SEARCH] the render budget {budget} of the leaf cannot cover a single grid point of {self.rollout.num} renders, '
+                      f'the grid search of the leaf is skipped', flush=True)
+                return [], []
+        centers = lattice_points(bounds_min, bounds_max, divider)
+        cell_size = (bounds_max - bounds_min) / (divider - 1)
+
+        positions: List[np.ndarray] = []
+        evaluated = []
+        best_score = -np.inf
+        for depth in range(self.max_depth + 1):
+            if budget is not None:
+                # below the coarse lattice, the centers are ordered by the score of their parents and the best ones are kept
+                centers = centers[:budget // self.rollout.num]
+                budget -= len(centers) * self.rollout.num
+            if len(centers) == 0:
+                break
+
+            level = self._evaluate_positions(list(centers), num_batch)
+            positions.extend(centers)
+            evaluated.extend(level)
+
+            cell_best = np.array([max(scores) for _, _, scores in level])
+            best_score = max(best_score, cell_best.max())
+            promising = np.flatnonzero(cell_best >= best_score - self.margin)
+            promising = promising[np.argsort(-cell_best[promising], kind="stable")]
+            centers = subdivide_cells(centers[promising], cell_size)
+            cell_size = cell_size / 2
+        return positions, evaluated
+
+    def _evaluate_positions(self, positions: List[np.ndarray], num_batch: int) -> List[Tuple[List[CameraParameter], List[Optional[np.ndarray]], List[float]]]:
+        """
+        グリッドの各点でrolloutを実行する
+        適応的なrolloutの場合、全ての点のラウンドをまとめてレンダリングする
+        Run the rollout at every grid point.
+        The rounds of an adaptive rollout are rendered in lockstep over all the points, one batch per round.
+        Returns:
+            (camera parameters, images, scores) of each position
+        """
+        rollouts = [self.rollout.clone() for _ in positions]
+        results = [([], [], []) for _ in positions]
+        while True:
+            active = [i for i, rollout in enumerate(rollouts) if not rollout.finished]
+            if len(active) == 0:
+                break
+            proposals = [[self._to_camera_parameter(cp) for cp in rollouts[i].propose(positions[i], pos_diff_scale=1)] for i in active]
+            cps = list(chain.from_iterable(proposals))
+            if self.depth_pre_pass is not None:
+                images, scores = self.depth_pre_pass.evaluate(cps, lambda c: self._render_and_score(c, num_batch))
+            else:
+                images, scores = self._render_and_score(cps, num_batch)
+
+            offset = 0
+            for i, proposal in zip(active, proposals):
+                round_images = list(images[offset:offset + len(proposal)])
+                round_scores = list(scores[offset:offset + len(proposal)])
+                offset += len(proposal)
+                rollouts[i].observe(round_scores)
+                results[i][0].extend(proposal)
+                results[i][1].extend(round_images)
+                results[i][2].extend(round_scores)
+        return results
+
+    def _render_and_score(self, camera_parameters: List[CameraParameter], num_batch: int) -> Tuple[List[np.ndarray], List[float]]:
+        # a level may hold more cameras than num_batch, a single request for all of them could exceed the client timeout
+        images = list(chain.from_iterable(self._render(list(group)) for group in iterutils.grouped(num_batch, iter(camera_parameters))))
+        with TimeMeasure.default().measure("batch inference") as scope:
+            scope.count("images", len(images))
+            scores = [self.scoring_net.forward(gimages, gcps)
+                      for gimages, gcps in zip(iterutils.grouped(num_batch, iter(images)), iterutils.grouped(num_batch, iter(camera_parameters)))]
+            scores = list(chain.from_iterable([s.cpu().numpy() for s in scores]))
+        return images, scores
+
     def _render(self, camera_parameters: List[CameraParameter]):
-        with TimeMeasure.default().measure("render"):
+        with TimeMeasure.default().measure("render") as scope:
+            scope.count("images", len(camera_parameters))
             images = self.render_api_client.request_render(RenderSceneRequest(cameraParameters=camera_parameters))
         return images
 
-    def _camera_params_generator(self, bbox):
-        camera_positions = self._divide_bbox(bbox)
-        for cam_pos in camera_positions:
-            cp = self._get_camera_parameters(cam_pos)
-            yield cp
-
-    def _divide_bbox(self, bounds: Bounds):
-        divider = self.divider - 1
-        step_size = bounds.size / Vector3f(x=divider, y=divider, z=divider)
-
-        for x in range(1, divider):
-            for y in range(1, divider):
-                for z in range(1, divider):
-                    yield (bounds.min + Vector3f(x=x, y=y, z=z) * step_size).elements
-
-    def _get_camera_parameters(self, node_pos):
-        self.rollout.reset()
-        while not self.rollout.finished:
-            cp = self.rollout.step(node_pos, pos_diff_scale=1)
-            yield CameraParameter(position=Vector3f.from_array(cp[0]), direction=Vector3f.from_array(cp[1])).filter_np()
+    @staticmethod
+    def _to_camera_parameter(cp: Tuple[np.ndarray, np.ndarray]) -> CameraParameter:
+        return CameraParameter(position=Vector3f.from_array(cp[0]), direction=Vector3f.from_array(cp[1])).filter_np()
+
+
+def run_grid_search(lgs: LeafGridSearcher,
+                    nodes: List[NodeViewModel],
+                    score_threshold: float,
+                    out_file_path: str,
+                    run_config: dict,
+                    sample_index: Optional[SampleIndex] = None,
+                    on_progress: Optional[Callable[[int, NodeViewModel], None]] = None,
+                    on_node: Optional[Callable[[NodeViewModel], None]] = None,
+                    rich_log: Optional[RichLog] = None) -> dict:
+    """
+    スコアが score_threshold 以上のノードをグリッドサーチし、leafGridNodes を付けたノードを out_file_path (jsonl) に、
+    性能の要約を _perf.json に書き出す
+    Grid search the nodes scored at least score_threshold, write the nodes with their leafGridNodes to
+    out_file_path (jsonl) and the performance summary next to it (_perf.json).
+    Args:
+        on_node: グリッドサーチしたノードごとに呼ばれる called with each searched node
+    Returns:
+        counts of the nodes, the grid nodes and the rendered images, the wall time and the paths of the outputs
+    """
+    tm = TimeMeasure.default()
+    # the performance summary covers this grid search only
+    tm.reset_all_avg()
+    start = time.perf_counter()
+    num_grid_nodes = 0
+    scores = np.array([n.score for n in nodes])
+    node_list = [nodes[i] for i in np.flatnonzero(scores >= score_threshold)]
+
+    if os.path.exists(out_file_path):
+        os.remove(out_file_path)
+    for grid_nodes, node in lgs.search(node_list, lambda n: n.bounds, on_progress, rich_log=rich_log, sample_index=sample_index):
+        node.leafGridNodes = [LeafGridNode(gridId=f"{node.id} {gn.id}", nodeId=node.id, position=gn.position, photoScorings=gn.photo_scorings)
+                              for gn in grid_nodes]
+        num_grid_nodes += len(node.leafGridNodes)
+        if on_node is not None:
+            on_node(node)
+        with open(out_file_path, "a") as f:
+            f.write(CustomJsonEncoder().encode(node) + "\n")
+    wall_seconds = time.perf_counter() - start
+    render = tm.sessions.get("render")
+    counts = {"nodes": len(node_list), "grid_nodes": num_grid_nodes,
+              "images": render.counters.get("images", 0) if render is not None else 0}
+    caches = {"depth_pre_pass": lgs.depth_pre_pass.stats()} if lgs.depth_pre_pass is not None else {}
+    session_id = os.path.basename(out_file_path).removesuffix(".jsonl")
+    perf_path = out_file_path.removesuffix(".jsonl") + "_perf.json"
+    write_perf_summary(perf_path, build_perf_summary("grid_search", session_id, run_config, wall_seconds, counts=counts, caches=caches,
+                                                     server=server_info(lgs.render_api_client)))
+    return {**counts, "wall_seconds": wall_seconds, "path": out_file_path, "perf_path": perf_path}
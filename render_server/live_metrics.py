@@ -0,0 +1,99 @@
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Optional, Dict, List
+
+from render_server.perf_summary import counter_total
+from render_server.world_explorer_runner import WorldExplorerRunner
+from util.time_measure import TimeMeasure, LatencyHistogram
+
+# the TimeMeasure sessions shown in the panel, and the sessions whose "bytes" counters are the HTTP traffic
+RENDER_SESSION = "http request (rendering)"
+INFERENCE_SESSION = "inference scoring net"
+HTTP_SESSIONS = ["render request", "depth request", "node upload request"]
+
+
+def resident_memory_bytes() -> Optional[int]:
+    """
+    プロセスの常駐メモリ psutil がない場合は /proc から読む (Linux のみ)
+    The resident memory of the process, read from /proc (Linux only) when psutil is not installed.
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+@dataclass
+class MetricsSnapshot:
+    time: float
+    num_evaluated_nodes: int
+    num_logged_nodes: int
+    num_images: int
+    http_bytes: int
+    best_score: float
+    memory_bytes: Optional[int]
+    latencies: Dict[str, LatencyHistogram] = field(default_factory=dict)
+
+
+class LiveMetrics:
+    """
+    探索の進み具合を表示用に集める 値は探索スレッドが更新する属性と TimeMeasure のヒストグラムをロックを取らずに読む
+    Gathers the progress of the exploration for the live panel of the TUI. The values are read without any lock
+    from the attributes the exploration thread updates and from the TimeMeasure histograms,
+    so that refreshing the panel never slows the exploration down.
+    """
+
+    def __init__(self, runner: WorldExplorerRunner, tm: Optional[TimeMeasure] = None):
+        self.runner = runner
+        self.tm = tm if tm is not None else TimeMeasure.default()
+
+    def snapshot(self) -> MetricsSnapshot:
+        sessions = self.tm.sessions
+        http_bytes = counter_total(self.tm, HTTP_SESSIONS, "bytes")
+        latencies = {}
+        for name in [RENDER_SESSION, INFERENCE_SESSION]:
+            session = sessions.get(name)
+            if session is not None:
+                latencies[name] = session.snapshot()
+        runner = self.runner
+        return MetricsSnapshot(time=time.perf_counter(),
+                               num_evaluated_nodes=runner.num_evaluated_nodes,
+                               num_logged_nodes=runner.num_logged_nodes,
+                               num_images=runner.num_rendered_images,
+                               http_bytes=http_bytes,
+                               best_score=runner.best_value,
+                               memory_bytes=resident_memory_bytes(),
+                               latencies=latencies)
+
+    @staticmethod
+    def format(previous: Optional[MetricsSnapshot], current: MetricsSnapshot) -> str:
+        """
+        直前のスナップショットとの差分から毎秒の値を求めて表示用の文字列にする
+        Format the snapshot, with the rates per second since the previous one.
+        """
+        lines: List[str] = []
+        if previous is not None and current.time > previous.time:
+            dt = current.time - previous.time
+            # the TimeMeasure counters restart at the beginning of each run
+            http_bytes = max(current.http_bytes - previous.http_bytes, 0)
+            lines.append(f"nodes/s  {(current.num_evaluated_nodes - previous.num_evaluated_nodes) / dt:9.2f}   "
+                         f"images/s {(current.num_images - previous.num_images) / dt:9.1f}   "
+                         f"HTTP {http_bytes / dt / 2 ** 20:8.2f}MiB/s")
+        lines.append(f"nodes    {current.num_evaluated_nodes:9}   images   {current.num_images:9}   "
+                     f"tree {current.num_logged_nodes} nodes")
+        for name, h in current.latencies.items():
+            if h.count == 0:
+                continue
+            lines.append(f"{name}: p50 {h.percentile(50) * 1000:.1f}ms  p95 {h.percentile(95) * 1000:.1f}ms  "
+                         f"p99 {h.percentile(99) * 1000:.1f}ms  max {h.max * 1000:.1f}ms")
+        memory = f"{current.memory_bytes / 2 ** 20:.0f}MiB" if current.memory_bytes is not None else "n/a"
+        best = f"{current.best_score:.4f}" if current.num_evaluated_nodes > 0 else "-"
+        lines.append(f"memory   {memory:>9}   best score {best}")
+        return "\n".join(lines)
@@ -1,6 +1,22 @@
+import gzip
 import os
+import queue
+import threading
+import time
+from typing import List, Optional, Union
 
 from render_server.render_api_data import NodeViewModel
+from util.time_measure import TimeMeasure
+
+
+def open_node_log(log_file_path: str):
+    """
+    ノードログをテキストとして開く gzip圧縮されたログ (.jsonl.gz) にも対応する
+    Open a node log as text, including the gzip compressed logs (.jsonl.gz).
+    """
+    if str(log_file_path).endswith(".gz"):
+        return gzip.open(log_file_path, "rt")
+    return open(log_file_path)
 
 
 class Logger:
@@ -20,6 +36,12 @@ class NodeLogger:
     def log_artifact(self):
         pass
 
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
 
 class NullNodeLogger(NodeLogger):
     pass
@@ -32,6 +54,10 @@ class FileNodeLogger(NodeLogger):
         self._log_file_path = f"{self._base_path}/{world_id}_{self._session_id}_nodes.jsonl"
         os.makedirs(self._base_path, exist_ok=True)
 
+    @property
+    def log_file_path(self) -> str:
+        return self._log_file_path
+
     def log_artifact(self):
         """
         log the exploration log file as a wandb artifact
@@ -44,3 +70,153 @@ class FileNodeLogger(NodeLogger):
         with open(self._log_file_path, "a") as f:
             f.write(node.model_dump_json())
             f.write("\n")
+
+
+class _FlushRequest:
+    def __init__(self):
+        self.done = threading.Event()
+
+
+_CLOSE = object()
+
+
+class BufferedFileNodeLogger(FileNodeLogger):
+    """
+    ノードをキューに入れ、バックグラウンドのスレッドでまとめてシリアライズしてファイルに書き込む
+    探索のスレッドのコストはキューへの追加のみになる
+    Puts the nodes on a queue, and a background thread serializes and writes them in batches,
+    so that logging a node costs the exploration thread a queue put only.
+    The write latency and the backlog of the queue are recorded in TimeMeasure.
+    """
+
+    def __init__(self,
+                 base_path: str,
+                 session_id: str,
+                 world_id: str,
+                 flush_interval: float = 1.0,
+                 batch_size: int = 256,
+                 fsync: str = "close",
+                 compress: bool = False,
+                 max_queue_size: int = 0):
+        """
+        Args:
+            flush_interval: ファイルをフラッシュする間隔[秒] interval in seconds between the flushes of the file
+            batch_size: 一度に書き込むノードの最大数 maximum number of nodes written at once
+            fsync: "never", "flush" (フラッシュごと on every flush) or "close" (終了時のみ on close only)
+            compress: gzipで圧縮して .jsonl.gz に書き込む write a gzip compressed .jsonl.gz
+            max_queue_size: キューの最大長 (0は無制限) 満杯の場合は探索のスレッドが待つ
+                maximum length of the queue (0: unbounded), the exploration thread waits while it is full
+        """
+        super().__init__(base_path, session_id, world_id)
+        assert fsync in ["never", "flush", "close"]
+        if compress:
+            self._log_file_path += ".gz"
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.compress = compress
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._closed = False
+        # the exception which stopped the writer thread, raised to the exploration thread
+        self._error: Optional[Exception] = None
+        self._thread = threading.Thread(target=self._run, name="node-log-writer", daemon=True)
+        self._thread.start()
+
+    def log_node(self, world_id: str, node: NodeViewModel):
+        assert not self._closed, "the logger is closed"
+        self._raise_error()
+        self._queue.put(node)
+
+    def flush(self):
+        """
+        キューの全てのノードを書き込み、ファイルをフラッシュするまで待つ
+        Wait until every queued node is written and the file is flushed.
+        """
+        if self._closed:
+            return
+        self._raise_error()
+        request = _FlushRequest()
+        self._queue.put(request)
+        request.done.wait()
+        self._raise_error()
+
+    def close(self):
+        """
+        キューの全てのノードを書き込んでからファイルを閉じる
+        Drain the queue, then close the file.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise RuntimeError(f"the node log writer of {self._log_file_path} failed") from self._error
+
+    def _open(self):
+        if self.compress:
+            return gzip.open(self._log_file_path, "ab")
+        return open(self._log_file_path, "ab")
+
+    def _write(self, f, nodes: List[NodeViewModel]):
+        tm = TimeMeasure.default()
+        start = time.perf_counter()
+        f.write("".join([node.model_dump_json() + "\n" for node in nodes]).encode())
+        tm.record("node log write", time.perf_counter() - start)
+        tm.record("node log backlog", self._queue.qsize(), mult=1.0, unit="nodes")
+
+    def _flush(self, f):
+        f.flush()
+        if self.fsync == "flush":
+            os.fsync(f.fileno())
+
+    def _run(self):
+        item: Optional[Union[NodeViewModel, _FlushRequest, object]] = None
+        try:
+            with self._open() as f:
+                last_flush = time.perf_counter()
+                dirty = False
+                while True:
+                    timeout = max(self.flush_interval - (time.perf_counter() - last_flush), 0) if dirty else None
+                    try:
+                        item = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        item = None
+
+                    # take the rest of the batch without waiting
+                    nodes = []
+                    while isinstance(item, NodeViewModel):
+                        nodes.append(item)
+                        if len(nodes) >= self.batch_size:
+                            item = None
+                            break
+                        try:
+                            item = self._queue.get_nowait()
+                        except queue.Empty:
+                            item = None
+                    if len(nodes) > 0:
+                        self._write(f, nodes)
+                        dirty = True
+
+                    if item is not None or (dirty and time.perf_counter() - last_flush >= self.flush_interval):
+                        if dirty:
+                            self._flush(f)
+                        dirty = False
+                        last_flush = time.perf_counter()
+                    if isinstance(item, _FlushRequest):
+                        item.done.set()
+                    elif item is _CLOSE:
+                        break
+                f.flush()
+                if self.fsync != "never":
+                    os.fsync(f.fileno())
+        except Exception as e:
+            self._error = e
+            # keep taking the queue until the close, so that the flushes waiting on it and the puts to a full queue return
+            while item is not _CLOSE:
+                if isinstance(item, _FlushRequest):
+                    item.done.set()
+                item = self._queue.get()
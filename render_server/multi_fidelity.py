@@ -0,0 +1,126 @@
+import heapq
+import itertools
+import math
+from typing import List, Tuple, Optional, Dict, Callable
+
+import numpy as np
+
+from render_server.render_api_data import CameraParameter
+
+# the render server packs up to 6x6 images into one RGB24 atlas regardless of the number of images
+TILE_ROW_COL = 6
+
+
+class ResolutionSchedule:
+    """
+    HOOのノードの深さからレンダリングする解像度を決める
+    浅いノードは大きなセルを表すため、大まかなスコアで十分であり、低い解像度でレンダリングする
+    Decide the render resolution from the depth of the HOO node.
+    Shallow nodes cover large cells where a rough score is enough, so they are rendered at a lower resolution.
+    """
+
+    def __init__(self, levels: List[Tuple[int, int]], full_texture_size: int = 224):
+        """
+        Args:
+            levels: (この深さ以上, 解像度) のリスト list of (minimum depth, texture size), e.g. [(0, 56), (6, 112), (12, 224)]
+            full_texture_size:
+        """
+        assert len(levels) > 0
+        self.levels = sorted(levels)
+        self.full_texture_size = full_texture_size
+
+    @classmethod
+    def parse(cls, spec: str, full_texture_size: int = 224) -> Optional['ResolutionSchedule']:
+        """
+        Args:
+            spec: "depth:size" pairs separated by comma, e.g. "0:56,6:112,12:224". Empty string disables the schedule.
+        """
+        if not spec:
+            return None
+        levels = []
+        for item in spec.split(","):
+            depth, size = item.split(":")
+            levels.append((int(depth), int(size)))
+        return ResolutionSchedule(levels, full_texture_size)
+
+    def texture_size(self, depth: int) -> int:
+        size = self.levels[0][1]
+        for min_depth, level_size in self.levels:
+            if depth >= min_depth:
+                size = level_size
+        return size
+
+
+def atlas_bytes(texture_size: int, num_images: int) -> int:
+    return math.ceil(num_images / (TILE_ROW_COL * TILE_ROW_COL)) * (texture_size * TILE_ROW_COL) ** 2 * 3
+
+
+class MultiFidelityReport:
+    """
+    解像度ごとのレンダリング枚数、時間、転送量を集計し、低解像度で得られた上位の撮影スポットをフル解像度で再評価する
+    Aggregates the number of images, render time and transfer per resolution,
+    and re-scores the best photospots found at a lower resolution at the full resolution.
+    """
+
+    def __init__(self, full_texture_size: int = 224, top_k: int = 10):
+        self.full_texture_size = full_texture_size
+        self.top_k = top_k
+        self.num_images: Dict[int, int] = {}
+        self.render_seconds: Dict[int, float] = {}
+        self.transfer_bytes: Dict[int, int] = {}
+        self.full_res_transfer_bytes = 0
+        self._counter = itertools.count()
+        self._top_low_res: List[Tuple[float, int, CameraParameter]] = []
+        self.verified: List[Tuple[float, float]] = []
+
+    def record(self, texture_size: int, camera_parameters: List[CameraParameter], scores: np.ndarray, render_seconds: float):
+        n = len(camera_parameters)
+        self.num_images[texture_size] = self.num_images.get(texture_size, 0) + n
+        self.render_seconds[texture_size] = self.render_seconds.get(texture_size, 0.0) + render_seconds
+        self.transfer_bytes[texture_size] = self.transfer_bytes.get(texture_size, 0) + atlas_bytes(texture_size, n)
+        self.full_res_transfer_bytes += atlas_bytes(self.full_texture_size, n)
+        if texture_size == self.full_texture_size:
+            return
+        for cp, score in zip(camera_parameters, scores):
+            item = (float(score), next(self._counter), cp)
+            if len(self._top_low_res) < self.top_k:
+                heapq.heappush(self._top_low_res, item)
+            else:
+                heapq.heappushpop(self._top_low_res, item)
+
+    def verify(self, score_full_res: Callable[[List[CameraParameter]], np.ndarray]):
+        """
+        低解像度で最もスコアが高かった top_k 個のカメラパラメータをフル解像度で再評価する
+        Re-score the top_k camera parameters scored at a lower resolution at the full resolution.
+        Args:
+            score_full_res: フル解像度でレンダリングしてスコアを返す関数 renders at the full resolution and returns the scores
+        """
+        items = sorted(self._top_low_res, reverse=True)
+        if len(items) == 0:
+            return
+        full_scores = score_full_res([cp for _, _, cp in items])
+        self.verified = [(low, float(full)) for (low, _, _), full in zip(items, full_scores)]
+
+    def print_report(self):
+        total_bytes = sum(self.transfer_bytes.values())
+        for size in sorted(self.num_images):
+            print(f'[MULTI-FIDELITY] {size:4}px: {self.num_images[size]:8} images, '
+                  f'render {self.render_seconds[size]:8.3f}s, transfer {self.transfer_bytes[size] / 2 ** 20:10.1f}MiB', flush=True)
+
+        saved_bytes = self.full_res_transfer_bytes - total_bytes
+        print(f'[MULTI-FIDELITY] transfer {total_bytes / 2 ** 20:.1f}MiB, saved {saved_bytes / 2 ** 20:.1f}MiB '
+              f'({saved_bytes / max(self.full_res_transfer_bytes, 1):.1%}) against full resolution', flush=True)
+
+        full_images = self.num_images.get(self.full_texture_size, 0)
+        if full_images > 0:
+            # estimated from the measured render time per image at the full resolution
+            seconds_per_image = self.render_seconds[self.full_texture_size] / full_images
+            estimated = seconds_per_image * sum(self.num_images.values())
+            saved_seconds = estimated - sum(self.render_seconds.values())
+            print(f'[MULTI-FIDELITY] render time saved {saved_seconds:.3f}s (estimated full resolution render time {estimated:.3f}s)', flush=True)
+
+        if len(self.verified) > 0:
+            low = np.array([e[0] for e in self.verified])
+            full = np.array([e[1] for e in self.verified])
+            print(f'[MULTI-FIDELITY] top {len(self.verified)} low resolution photospots re-scored at full resolution: '
+                  f'best {low.max():.4f} -> {full.max():.4f}, mean abs diff {np.abs(low - full).mean():.4f}', flush=True)
@@ -0,0 +1,98 @@
+from typing import List, Optional, Callable, Tuple
+
+import numpy as np
+
+from render_server.render_api_client import RenderAPIClient
+from render_server.render_api_data import NodeViewModel, UpdateNodesRequest, PhotoScoring
+
+
+def level_of_detail_order(nodes: List[NodeViewModel], top_k: int = 0, max_depth: int = -1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    ノードを送信する順序を決める 粗いレベル (max_depth以下のノードとスコア上位top_k個のノードとその祖先) を先に送り、残りをその後に送る
+    レンダリングサーバーは親が先に存在しないノードを親の下に置けないため、どちらのレベルも深さ順 (同じ深さではスコアの高い順) に並べる
+    Decide the order in which the nodes are sent. The coarse level, the nodes down to max_depth and the top_k nodes
+    by score together with their ancestors, is sent first and the rest after it.
+    Both levels are sorted by depth, then by descending score, since the rendering server can only place a node
+    under its parent when the parent is already there.
+    Args:
+        top_k: 粗いレベルに含めるスコア上位のノードの数 0で無効 number of best scored nodes in the coarse level, 0 to disable
+        max_depth: 粗いレベルに含める最大の深さ 負の値で無効 maximum depth of the coarse level, negative to disable
+    Returns:
+        (rows of the coarse level, rows of the rest) in the order to send
+    """
+    n = len(nodes)
+    depths = np.array([node.depth for node in nodes], dtype=np.int64)
+    scores = np.array([node.score for node in nodes], dtype=np.float64)
+    rows = {node.id: i for i, node in enumerate(nodes)}
+    parent = np.array([rows.get(node.parentId, -1) for node in nodes], dtype=np.int64)
+
+    coarse = np.zeros(n, dtype=bool)
+    if max_depth >= 0:
+        coarse |= depths <= max_depth
+    if top_k > 0:
+        selected = np.argsort(-scores, kind="stable")[:top_k]
+        while len(selected) > 0:
+            selected = np.unique(selected[~coarse[selected]])
+            coarse[selected] = True
+            selected = parent[selected]
+            selected = selected[selected >= 0]
+    order = np.lexsort((-scores, depths))
+    return order[coarse[order]], order[~coarse[order]]
+
+
+class NodeUploader:
+    """
+    表示ノードをまとめてレンダリングサーバーに送る
+    ノードは子を除いた浅いコピーとしてchunk_size個ずつ1回のリクエストで送り、粗いレベルから順に詳細なノードを送る
+    Uploads the display nodes to the rendering server in bulk.
+    The nodes are sent as shallow copies without their children, chunk_size nodes per request,
+    the coarse level of detail first and the rest progressively after it.
+    """
+
+    def __init__(self,
+                 api_client: RenderAPIClient,
+                 chunk_size: int = 256,
+                 compress: bool = False,
+                 lod_top_k: int = 0,
+                 lod_max_depth: int = -1):
+        """
+        Args:
+            chunk_size: 1回のリクエストで送るノードの数 number of nodes sent per request
+            compress: リクエストボディをgzipで圧縮する compress the request bodies with gzip
+            lod_top_k: 先に送るスコア上位のノードの数 number of best scored nodes sent first
+            lod_max_depth: 先に送るノードの最大の深さ maximum depth of the nodes sent first
+        """
+        assert chunk_size > 0
+        self.api_client = api_client
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self.lod_top_k = lod_top_k
+        self.lod_max_depth = lod_max_depth
+
+    def upload(self,
+               nodes: List[NodeViewModel],
+               photo_scorings: Optional[Callable[[NodeViewModel], Optional[List[PhotoScoring]]]] = None,
+               on_progress: Optional[Callable[[int, int, int], None]] = None):
+        """
+        Args:
+            photo_scorings: 送信時にノードの PhotoScoring を補う関数 Noneを返したノードはそのまま送る
+                fills in the photo scorings of a node when it is sent, the node is sent as is when it returns None
+            on_progress: リクエストごとに (送信済みのノード数, 粗いレベルのノード数, 全ノード数) で呼ばれる
+                called after each request with (number of sent nodes, number of coarse nodes, number of nodes)
+        """
+        first, rest = level_of_detail_order(nodes, self.lod_top_k, self.lod_max_depth)
+        num_sent = 0
+        for level in (first, rest):
+            for start in range(0, len(level), self.chunk_size):
+                chunk = []
+                for row in level[start:start + self.chunk_size]:
+                    node = nodes[row]
+                    filled = photo_scorings(node) if photo_scorings is not None else None
+                    if filled is not None:
+                        chunk.append(node.copy_without_children(photoScorings=filled))
+                    else:
+                        chunk.append(node.copy_without_children())
+                self.api_client.request_update_nodes(UpdateNodesRequest(nodes=chunk), compress=self.compress)
+                num_sent += len(chunk)
+                if on_progress is not None:
+                    on_progress(num_sent, len(first), len(nodes))
@@ -0,0 +1,81 @@
+import base64
+import hashlib
+import os
+from typing import Optional, Dict
+
+import numpy as np
+
+from exploration.occupancy_grid import OccupancyGrid
+from render_server.render_api_client import RenderAPIClient
+from render_server.render_api_data import BoundingBox, OccupancyGridRequest, OccupancyGridResponse
+
+
+def decode_occupancy_grid(response: OccupancyGridResponse) -> OccupancyGrid:
+    dims = (response.dims.x, response.dims.y, response.dims.z)
+    free = np.frombuffer(base64.b64decode(response.free), dtype=np.uint8).reshape(dims)
+    return OccupancyGrid(free.astype(bool), response.bbox.min.elements, response.voxelSize)
+
+
+class OccupancyGridCache:
+    """
+    ワールドごとのボクセル占有グリッドを一度だけレンダリングサーバーから取得し、ディスクにキャッシュする
+    Fetch the voxel occupancy grid of a world from the rendering server once, and cache it on disk.
+    The cache key contains the world id, the bounding box and the voxel settings, so that the worlds sharing a cache directory
+    keep their own grids. The content of the world is not part of the key: a world edited without changing its bounding box
+    keeps its cached grid until it is fetched again with refresh.
+    """
+
+    def __init__(self,
+                 api_client: RenderAPIClient,
+                 cache_dir: str,
+                 world_id: str,
+                 voxel_size: float = 0.5,
+                 keep_largest_region: bool = True,
+                 refresh: bool = False):
+        """
+        Args:
+            refresh: キャッシュされたグリッドを使わずに取得し直して上書きする fetch the grids again and overwrite the cached ones
+        """
+        self.api_client = api_client
+        self.cache_dir = cache_dir
+        self.world_id = world_id
+        self.voxel_size = voxel_size
+        self.keep_largest_region = keep_largest_region
+        self.refresh = refresh
+        self._grids: Dict[str, OccupancyGrid] = {}
+        self.num_memory_hits = 0
+        self.num_disk_hits = 0
+        self.num_fetched = 0
+
+    def cache_path(self, bbox: BoundingBox) -> str:
+        corners = [bbox.min.x, bbox.min.y, bbox.min.z, bbox.max.x, bbox.max.y, bbox.max.z]
+        key = ",".join(f"{float(e):.4f}" for e in corners)
+        key = f"{key},{self.voxel_size:.4f},{self.keep_largest_region}"
+        digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+        return f"{self.cache_dir}/{self.world_id}_occupancy_{digest}.npz"
+
+    def get(self, bbox: BoundingBox) -> OccupancyGrid:
+        path = self.cache_path(bbox)
+        grid: Optional[OccupancyGrid] = self._grids.get(path)
+        if grid is not None:
+            self.num_memory_hits += 1
+            return grid
+
+        if os.path.exists(path) and not self.refresh:
+            self.num_disk_hits += 1
+            grid = OccupancyGrid.load(path)
+        else:
+            self.num_fetched += 1
+            response = self.api_client.request_occupancy_grid(OccupancyGridRequest(voxelSize=self.voxel_size))
+            grid = decode_occupancy_grid(response)
+            if self.keep_largest_region:
+                grid = grid.largest_free_region()
+            os.makedirs(self.cache_dir, exist_ok=True)
+            grid.save(path)
+        self._grids[path] = grid
+        return grid
+
+    def stats(self) -> dict:
+        num_requests = self.num_memory_hits + self.num_disk_hits + self.num_fetched
+        return {"memory_hits": self.num_memory_hits, "disk_hits": self.num_disk_hits, "fetched": self.num_fetched,
+                "hit_rate": (self.num_memory_hits + self.num_disk_hits) / max(num_requests, 1)}
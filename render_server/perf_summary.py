@@ -0,0 +1,181 @@
+import dataclasses
+import json
+import sys
+import time
+from typing import Optional, Dict, List, Tuple
+
+import requests
+
+from render_server.render_api_client import RenderAPIClient
+from util.time_measure import TimeMeasure
+
+PERF_SUMMARY_FORMAT = "panotree-perf-1"
+
+
+def peak_memory_bytes() -> Optional[int]:
+    """
+    プロセスの最大常駐メモリ Peak resident memory of the process.
+    """
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset
+        except (ImportError, AttributeError):
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def server_info(api_client: RenderAPIClient) -> Optional[dict]:
+    """
+    レンダリングサーバーのバージョンとプラットフォーム 取得できない場合はNone
+    The version and the platform of the render server, None when they cannot be fetched.
+    """
+    try:
+        info = api_client.get_server_info()
+    except (requests.RequestException, RuntimeError):
+        return None
+    v = info.versionInfo
+    return {"version": info.version, "build": f"{v.majorVersion}.{v.minorVersion}.{v.buildNumber}.{v.revisionNumber}", "platform": info.platform}
+
+
+def counter_total(tm: TimeMeasure, identifiers: List[str], name: str) -> int:
+    """
+    複数のセッションのカウンタの合計 Sum of a counter over several TimeMeasure sessions.
+    """
+    return sum(tm.sessions[i].counters.get(name, 0) for i in identifiers if i in tm.sessions)
+
+
+def config_dict(*configs, args=None) -> dict:
+    """
+    設定のdataclassと残りの引数 (ScoringNetのパラメータなど) を1つのdictにまとめる
+    Merge the config dataclasses and the remaining arguments, such as the scoring net parameters, into one dict.
+    """
+    config = {}
+    for conf in configs:
+        config[type(conf).__name__] = dataclasses.asdict(conf)
+    if args is not None:
+        config["args"] = dict(vars(args))
+    return config
+
+
+def build_perf_summary(kind: str,
+                       session_id: str,
+                       config: dict,
+                       wall_seconds: float,
+                       counts: Dict[str, int],
+                       caches: Optional[Dict[str, dict]] = None,
+                       server: Optional[dict] = None,
+                       tm: Optional[TimeMeasure] = None) -> dict:
+    """
+    1回の探索またはグリッドサーチの性能の要約 探索ごとに比較できるよう機械可読な形式にする
+    The performance summary of an exploration or a grid search, machine readable so that runs can be compared.
+    Args:
+        kind: explore, grid_search
+        counts: ノード数や画像数などの件数 毎秒の値も求める counts such as the nodes and the images, their rates per second are added
+        caches: キャッシュごとの件数とヒット率 counts and hit rates of each cache
+        server: レンダリングサーバーの情報 (バージョン、プラットフォーム) render server information (version, platform)
+    """
+    tm = tm if tm is not None else TimeMeasure.default()
+    return {"format": PERF_SUMMARY_FORMAT,
+            "kind": kind,
+            "session_id": session_id,
+            "created_at": time.time(),
+            "wall_seconds": wall_seconds,
+            "config": config,
+            "server": server,
+            "counts": counts,
+            "throughput": {f"{name}_per_second": n / wall_seconds if wall_seconds > 0 else 0.0 for name, n in counts.items()},
+            "stages": tm.summary(),
+            "caches": caches or {},
+            "memory": {"peak_rss_bytes": peak_memory_bytes()}}
+
+
+def write_perf_summary(path: str, summary: dict):
+    with open(path, "w") as f:
+        # the config may hold values such as paths or devices which are not json serializable
+        json.dump(summary, f, indent=2, default=str)
+    print(f'[PERF] {summary["kind"]} performance summary in {path}', flush=True)
+
+
+def load_perf_summary(path: str) -> dict:
+    with open(path) as f:
+        summary = json.load(f)
+    assert summary.get("format") == PERF_SUMMARY_FORMAT, f"{path} is not a performance summary"
+    return summary
+
+
+def flatten(d: dict, prefix: str = "") -> Dict[str, object]:
+    ret = {}
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            ret.update(flatten(v, key + "."))
+        else:
+            ret[key] = v
+    return ret
+
+
+def metric_direction(key: str) -> int:
+    """
+    Returns:
+        1 if a larger value is better, -1 if a smaller value is better, 0 if the metric is not compared
+    """
+    if key.startswith("throughput."):
+        return 1
+    if key.startswith("caches.") and key.endswith(("hit_rate", "pruned_ratio")):
+        return 1
+    if key.startswith("stages.") and key.rsplit(".", 1)[-1] in ("mean", "p50", "p95", "p99"):
+        return -1
+    if key in ("wall_seconds", "memory.peak_rss_bytes"):
+        return -1
+    return 0
+
+
+def performance_metrics(summary: dict, min_count: int = 1) -> Dict[str, float]:
+    """
+    比較する指標 計測回数がmin_count未満のステージは除く
+    The compared metrics, without the stages measured fewer than min_count times.
+    """
+    metrics = {}
+    for key, value in flatten({k: summary.get(k) for k in ("wall_seconds", "throughput", "stages", "caches", "memory")}).items():
+        if metric_direction(key) == 0 or not isinstance(value, (int, float)) or isinstance(value, bool):
+            continue
+        if key.startswith("stages."):
+            stage = key[len("stages."):].rsplit(".", 1)[0]
+            if summary["stages"][stage]["count"] < min_count:
+                continue
+        metrics[key] = float(value)
+    return metrics
+
+
+def compare_perf_summaries(base: dict, other: dict, threshold: float = 0.1, min_count: int = 1) -> List[Tuple[str, float, float, float, bool]]:
+    """
+    Args:
+        threshold: 悪化とみなす相対的な変化 relative change in the worse direction flagged as a regression
+    Returns:
+        (metric, base value, other value, relative change, regression) of the metrics present in both summaries
+    """
+    base_metrics = performance_metrics(base, min_count)
+    other_metrics = performance_metrics(other, min_count)
+    rows = []
+    for key in sorted(set(base_metrics) & set(other_metrics)):
+        b, o = base_metrics[key], other_metrics[key]
+        change = (o - b) / abs(b) if b != 0 else (0.0 if o == 0 else float("inf"))
+        rows.append((key, b, o, change, change * metric_direction(key) < -threshold))
+    return rows
+
+
+def config_differences(base: dict, other: dict) -> List[Tuple[str, object, object]]:
+    """
+    設定とサーバー情報の違い 性能の変化の原因 (チェックポイント、サーバーのビルド、HOOのパラメータなど) を示す
+    The differences of the config and the server information, which point at the cause of a change
+    such as the checkpoint, the render server build or the HOO parameters.
+    """
+    base_flat = flatten({"config": base.get("config") or {}, "server": base.get("server") or {}})
+    other_flat = flatten({"config": other.get("config") or {}, "server": other.get("server") or {}})
+    return [(key, base_flat.get(key), other_flat.get(key)) for key in sorted(set(base_flat) | set(other_flat))
+            if base_flat.get(key) != other_flat.get(key)]
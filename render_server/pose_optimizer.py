@@ -0,0 +1,135 @@
+from dataclasses import dataclass, field
+from typing import List, Tuple, Optional
+
+import numpy as np
+
+from exploration.cma_es import CMAES
+from render_server.render_api_client import RenderAPIClient
+from render_server.render_api_data import NodeViewModel, PhotoScoring, CameraParameter, Vector3f, RenderSceneRequest
+from render_server.scoring_net import ScoringNet
+from util.time_measure import TimeMeasure
+
+# pitch is kept away from the poles where the yaw is undefined
+_MAX_PITCH = np.pi / 2 * 0.95
+
+
+def direction_to_yaw_pitch(direction: np.ndarray) -> Tuple[float, float]:
+    x, y, z = np.asarray(direction, dtype=np.float64) / np.linalg.norm(direction)
+    return float(np.arctan2(x, z)), float(np.arcsin(np.clip(y, -1, 1)))
+
+
+def yaw_pitch_to_direction(yaw: np.ndarray, pitch: np.ndarray) -> np.ndarray:
+    """
+    Returns:
+        (..., 3) unit vectors in the Unity coordinate system (y up, yaw 0 looks at +z)
+    """
+    return np.stack([np.cos(pitch) * np.sin(yaw), np.sin(pitch), np.cos(pitch) * np.cos(yaw)], axis=-1)
+
+
+@dataclass
+class PoseRefinementResult:
+    node_id: str
+    best: Optional[PhotoScoring]
+    # (number of renders, best score so far) after each generation
+    history: List[Tuple[int, float]] = field(default_factory=list)
+
+    @property
+    def num_renders(self) -> int:
+        return self.history[-1][0] if len(self.history) > 0 else 0
+
+
+class LocalPoseOptimizer:
+    """
+    リーフのバウンディングボックス内で、カメラの位置とヨー・ピッチ (およびオプションで画角) を連続的に最適化する
+    ノードに保存されたスコアの高い PhotoScoring を初期値として、複数の CMA-ES を並列に実行する
+    各世代の全ての候補は、1回の request_render と1回の ScoringNet.forward で評価される
+    Continuous refinement of the camera position, yaw and pitch (and optionally the field of view) inside the bounds of a leaf.
+    Several CMA-ES instances start from the best PhotoScorings stored on the node and run in lockstep,
+    all candidates of a generation are scored with a single request_render and a single ScoringNet.forward.
+    """
+
+    def __init__(self,
+                 scoring_net: ScoringNet,
+                 render_api_client: RenderAPIClient,
+                 num_generations: int = 10,
+                 population_size: int = 8,
+                 num_starts: int = 3,
+                 sigma: float = 0.15,
+                 optimize_fov: bool = False,
+                 fov_range: Tuple[float, float] = (40.0, 80.0),
+                 seed: Optional[int] = None):
+        """
+        Args:
+            num_generations: CMA-ESの世代数 number of CMA-ES generations
+            population_size: 1つのCMA-ESの1世代あたりの候補数 candidates per generation of each CMA-ES
+            num_starts: 初期値とするPhotoScoringの数 number of the best PhotoScorings used as the starting points
+            sigma: 正規化された探索空間での初期ステップ幅 initial step size in the normalized search space
+            optimize_fov: 画角も最適化する optimize the field of view as well
+            fov_range: 画角の範囲[deg] range of the field of view
+        """
+        self.scoring_net = scoring_net
+        self.render_api_client = render_api_client
+        self.num_generations = num_generations
+        self.population_size = population_size
+        self.num_starts = num_starts
+        self.sigma = sigma
+        self.optimize_fov = optimize_fov
+        self.fov_range = fov_range
+        self.rng = np.random.default_rng(seed)
+
+    def _encode(self, photo_scoring: PhotoScoring, bounds_min: np.ndarray, bounds_size: np.ndarray) -> np.ndarray:
+        cp = photo_scoring.cameraParameter
+        position = (np.asarray(cp.position.elements) - bounds_min) / bounds_size
+        yaw, pitch = direction_to_yaw_pitch(np.asarray(cp.direction.elements))
+        x = [*position, (yaw + np.pi) / (2 * np.pi), (np.clip(pitch, -_MAX_PITCH, _MAX_PITCH) + _MAX_PITCH) / (2 * _MAX_PITCH)]
+        if self.optimize_fov:
+            x.append((cp.fieldOfView - self.fov_range[0]) / (self.fov_range[1] - self.fov_range[0]))
+        return np.clip(np.array(x), 0, 1)
+
+    def _decode(self, x: np.ndarray, bounds_min: np.ndarray, bounds_size: np.ndarray) -> List[CameraParameter]:
+        positions = bounds_min + x[:, :3] * bounds_size
+        yaw = x[:, 3] * 2 * np.pi - np.pi
+        pitch = x[:, 4] * 2 * _MAX_PITCH - _MAX_PITCH
+        directions = yaw_pitch_to_direction(yaw, pitch)
+        fovs = self.fov_range[0] + x[:, 5] * (self.fov_range[1] - self.fov_range[0]) if self.optimize_fov else [60.0] * len(x)
+        return [CameraParameter(position=Vector3f.from_array(p), direction=Vector3f.from_array(d), fieldOfView=float(fov)).filter_np()
+                for p, d, fov in zip(positions, directions, fovs)]
+
+    def _render_and_score(self, camera_parameters: List[CameraParameter]) -> np.ndarray:
+        tm = TimeMeasure.default()
+        with tm.measure("render"):
+            images = self.render_api_client.request_render(RenderSceneRequest(cameraParameters=camera_parameters))
+        with tm.measure("batch inference"):
+            return self.scoring_net.forward(images, camera_parameters).cpu().numpy()
+
+    def refine(self, node: NodeViewModel) -> PoseRefinementResult:
+        bounds_min = np.asarray(node.min.elements, dtype=np.float64)
+        # flat leaves still get a small range so that the normalization is defined
+        bounds_size = np.maximum(np.asarray(node.size.elements, dtype=np.float64), 1e-3)
+
+        starts = sorted([ps for ps in node.photoScorings if ps.cameraParameter.direction is not None], key=lambda ps: -ps.score)[:self.num_starts]
+        if len(starts) == 0:
+            center = PhotoScoring(cameraParameter=CameraParameter(position=node.bounds.center, direction=Vector3f(x=0, y=0, z=1)), score=0)
+            starts = [center]
+
+        periodic = [False, False, False, True, False] + ([False] if self.optimize_fov else [])
+        optimizers = [CMAES(self._encode(ps, bounds_min, bounds_size), self.sigma, self.population_size, periodic, self.rng) for ps in starts]
+
+        result = PoseRefinementResult(node.id, None)
+        num_renders = 0
+        with TimeMeasure.default().measure("pose refinement"):
+            for _ in range(self.num_generations):
+                candidates = [optimizer.ask() for optimizer in optimizers]
+                camera_parameters = self._decode(np.concatenate(candidates), bounds_min, bounds_size)
+                scores = self._render_and_score(camera_parameters)
+                num_renders += len(camera_parameters)
+
+                offset = 0
+                for optimizer, x in zip(optimizers, candidates):
+                    optimizer.tell(x, scores[offset:offset + len(x)])
+                    offset += len(x)
+                best = int(np.argmax(scores))
+                if result.best is None or scores[best] > result.best.score:
+                    result.best = PhotoScoring(cameraParameter=camera_parameters[best], score=float(scores[best]))
+                result.history.append((num_renders, result.best.score))
+        return result
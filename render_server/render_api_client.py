@@ -1,15 +1,17 @@
 import gzip
 import json
+import time
 import zlib
 from io import StringIO
-from typing import List, TypeVar, Type
+from typing import List, TypeVar, Type, Optional
 
 import numpy as np
 import requests
 from requests_toolbelt.multipart.decoder import MultipartDecoder
 
-from render_server.render_api_data import CustomJsonEncoder, RenderSceneRequest, \
-    CalculateWorldBoundingBoxResponse, UpdateNodesRequest, UpdateConfigRequest, GetServerInfoResponse, PostComputeFakePhotoPositionsResponse
+from render_server.render_api_data import CustomJsonEncoder, RenderSceneRequest, RenderDepthRequest, \
+    CalculateWorldBoundingBoxResponse, OccupancyGridRequest, OccupancyGridResponse, UpdateNodesRequest, UpdateConfigRequest, GetServerInfoResponse, PostComputeFakePhotoPositionsResponse
+from render_server.render_archive import RenderArchiveWriter, DISPLAY_ONLY_PATHS
 from util.serialize_utils import decode_as_simple_namespace
 from util.time_measure import TimeMeasure
 
@@ -32,29 +34,38 @@ class RenderAPIClient:
     以下の機能を持つ
     * シーンのロード
     * シーンのレンダリング
+    * 低解像度の深度マップのレンダリング
     * シーンのバウンディングボックスの計算
+    * シーンのボクセル占有グリッドの計算
     * 表示ノードの更新
     * 表示ノードのリセット)
     * サーバー情報の取得 (OS, プラットフォーム, レンダラーの設定など)
     * フェイク写真の位置計算 (教師データ作成時のみ使用)
+    recorder を指定すると、表示用以外のすべてのリクエストとレスポンスを記録する 記録は render_server.replay_render_server で再生できる
     The client for sending requests to the Unity Render Server
     It has the following functions:
     * Load scene
     * Render scene
+    * Render low resolution depth maps
     * Calculate the bounding box of the scene
+    * Calculate the voxel occupancy grid of the scene
     * Update display nodes
     * Reset display nodes
     * Get server information (OS, platform, renderer settings, etc.)
     * Calculate the position of fake photos (used only when creating training data)
+    When a recorder is given, every request and response except the display only ones is recorded,
+    and the recording can be served offline by render_server.replay_render_server.
     """
 
-    def __init__(self, endpoint_url: str):
+    def __init__(self, endpoint_url: str, recorder: Optional[RenderArchiveWriter] = None):
         """
 
         Args:
             endpoint_url:
+            recorder: リクエストとレスポンスを記録するアーカイブ archive recording the requests and the responses
         """
         self.endpoint_url = endpoint_url
+        self.recorder = recorder
         self._json_encoder = CustomJsonEncoder()
         # レンダリング画像のサイズ。原則224固定で良い。
         self._texture_size = 224
@@ -62,12 +73,28 @@ class RenderAPIClient:
         self._kwargs = {
             "timeout": (5.0, 5.0)
         }
+
+    def _request(self, method: str, path: str, data=None, **kwargs) -> requests.Response:
+        """
+        リクエストを送り、記録モードの場合はリクエストとレスポンスを記録する
+        Send a request, and record it with its response in the recording mode.
+        """
+        start = time.perf_counter()
+        response = requests.request(method, f"{self.endpoint_url}{path}", data=data, **kwargs)
+        if self.recorder is not None and path not in DISPLAY_ONLY_PATHS:
+            body = data.encode("utf-8") if isinstance(data, str) else (data or b"")
+            self.recorder.record(method, path, body, response.status_code, response.headers.get("Content-Type", ""),
+                                 response.content, time.perf_counter() - start)
+        return response
+
     def request_render(self, camera_parameters: RenderSceneRequest) -> List[np.ndarray]:
         """
         レンダリングサーバーに対して、指定されたカメラパラメータでシーンをレンダリングするようリクエストする
         Rquest the rendering server to render the scene with the specified camera parameters
         Args:
             camera_parameters: レンダリングするカメラパラメータ camera parameters to render
+                textureSize を指定すると、このリクエストのみ指定された解像度でレンダリングする
+                if textureSize is set, only this request is rendered at the given resolution
         Returns:
             6x6でタイリングされた画像のリスト。
             大きさは (self._texture_size * 6, self._texture_size * 6, 3) 規定値の場合は (1344, 1344, 3)
@@ -82,14 +109,16 @@ class RenderAPIClient:
         tm = TimeMeasure.default()
 
         request_body = self._encode_request_body(camera_parameters)
-        with tm.measure("render request"):
-            response = requests.post(f"{self.endpoint_url}world/render", data=request_body, headers=headers, **self._kwargs)
+        with tm.measure("render request") as scope:
+            response = self._request("POST", "world/render", data=request_body, headers=headers, **self._kwargs)
+            scope.count("images", len(camera_parameters.cameraParameters)).count("bytes", len(response.content))
         if response.status_code == 200:
             # Parse the multipart response
             # is_encoded_in_gzip = response.headers["Content-Encoding"] == 'gzip'
             decoder = MultipartDecoder(response.content, response.headers['Content-Type'])
 
             num_params = len(camera_parameters.cameraParameters)
+            texture_size = camera_parameters.textureSize or self._texture_size
             images = []
             i = 0
             for part in decoder.parts:
@@ -98,7 +127,7 @@ class RenderAPIClient:
                 part_body = part.content
                 image_row_col = 6
                 image_buffer = np.frombuffer(part_body, np.uint8)
-                image_buffer = image_buffer.reshape((self._texture_size * image_row_col, self._texture_size * image_row_col, 3))
+                image_buffer = image_buffer.reshape((texture_size * image_row_col, texture_size * image_row_col, 3))
                 image_buffer = np.flip(image_buffer, axis=0)
 
                 i = 0
@@ -107,12 +136,37 @@ class RenderAPIClient:
                         num_params -= 1
                         if num_params < 0:
                             break
-                        images.append(image_buffer[y * self._texture_size:(y + 1) * self._texture_size, x * self._texture_size:(x + 1) * self._texture_size])
+                        images.append(image_buffer[y * texture_size:(y + 1) * texture_size, x * texture_size:(x + 1) * texture_size])
                         i += 1
             return images
         else:
             raise RuntimeError(f'Agent Server Error: {response.status_code}')
 
+    def request_render_depth(self, request: RenderDepthRequest) -> List[np.ndarray]:
+        """
+        レンダリングサーバーに対して、指定されたカメラパラメータで低解像度の深度マップを一括で計算するようリクエストする
+        フルサイズのカラー画像をレンダリングする前に、壁に向いたカメラ方向を取り除くために使用する
+        Request the rendering server to compute low resolution depth maps for all camera parameters in one call
+        Used to drop camera directions facing nearby walls before requesting full resolution color renders
+        Args:
+            request: 深度マップを計算するカメラパラメータと解像度 camera parameters and resolution of depth maps
+        Returns:
+            カメラパラメータごとの深度マップのリスト。大きさは (request.textureSize, request.textureSize)
+            各画素はカメラ位置からの距離[m]をfloat32で表す
+            List of depth maps for each camera parameter. The size is (request.textureSize, request.textureSize)
+            Each pixel is the distance [m] from the camera position in float32
+        """
+        headers = {'Content-Type': 'application/json'}
+        tm = TimeMeasure.default()
+
+        request_body = self._encode_request_body(request)
+        with tm.measure("depth request") as scope:
+            response = self._request("POST", "world/render/depth", data=request_body, headers=headers, **self._kwargs)
+            scope.count("images", len(request.cameraParameters)).count("bytes", len(response.content))
+        _assert_response(response)
+        depths = np.frombuffer(response.content, dtype="<f4")
+        return list(depths.reshape((len(request.cameraParameters), request.textureSize, request.textureSize)))
+
     def request_calculate_world_bounding_box(self) -> CalculateWorldBoundingBoxResponse:
         """
         現在レンダリングサーバーが読み込んでいるすべてのUnity Sceneのすべてのコライダーを含むバウンディングボックスを計算する
@@ -120,7 +174,7 @@ class RenderAPIClient:
         Returns:
 
         """
-        response = requests.get(f"{self.endpoint_url}world/bbox", **self._kwargs)
+        response = self._request("GET", "world/bbox", **self._kwargs)
         if response.status_code == 200:
             world_bbox = self._decode_response_body(response, CalculateWorldBoundingBoxResponse)
 
@@ -135,7 +189,26 @@ class RenderAPIClient:
         else:
             raise RuntimeError(f'Agent Server Error: {response.status_code}')
 
-    def request_update_nodes(self, request: UpdateNodesRequest):
+    def request_occupancy_grid(self, request: OccupancyGridRequest) -> OccupancyGridResponse:
+        """
+        ワールドのバウンディングボックスをボクセルに分割し、コライダーと重ならないボクセルを計算するようリクエストする
+        計算に時間がかかるため、タイムアウトは長めに設定する
+        Request the rendering server to divide the world bounding box into voxels and compute the voxels free of colliders
+        The timeout is longer than the other requests as the computation takes a while
+        Args:
+            request:
+
+        Returns:
+
+        """
+        headers = {'Content-Type': 'application/json'}
+
+        request_body = self._encode_request_body(request)
+        response = self._request("POST", "world/occupancy", data=request_body, headers=headers, timeout=(5.0, 300.0))
+        _assert_response(response)
+        return OccupancyGridResponse.model_validate_json(response.content.decode("utf_8_sig"))
+
+    def request_update_nodes(self, request: UpdateNodesRequest, compress: bool = False):
         """
         レンダリングサーバーに対して、表示ノードの更新をリクエストする
         これは純粋に描画用のノードのみを更新するためのAPIなので、探索ロジックの状態とは独立している
@@ -144,7 +217,9 @@ class RenderAPIClient:
         This is an API that updates only the nodes for drawing, so it is independent of the state of the search logic
         If you only want to implement the search logic, you don't need to implement this API on the server side
         Args:
-            request:
+            request: 1回のリクエストで複数のノードを送れる several nodes can be sent in one request
+            compress: リクエストボディをgzipで圧縮する (Content-Encoding: gzip)
+                compress the request body with gzip (Content-Encoding: gzip)
 
         Returns:
 
@@ -152,7 +227,12 @@ class RenderAPIClient:
         headers = {'Content-Type': 'application/json'}
 
         request_body = self._encode_request_body(request)
-        response = requests.post(f"{self.endpoint_url}world/node", data=request_body, headers=headers, **self._kwargs)
+        if compress:
+            request_body = gzip.compress(request_body.encode("utf-8"), compresslevel=1)
+            headers['Content-Encoding'] = 'gzip'
+        with TimeMeasure.default().measure("node upload request") as scope:
+            response = self._request("POST", "world/node", data=request_body, headers=headers, **self._kwargs)
+            scope.count("nodes", len(request.nodes)).count("bytes", len(request_body))
         _assert_response(response)
 
     def request_reset_node(self):
@@ -164,7 +244,7 @@ class RenderAPIClient:
         """
         headers = {'Content-Type': 'application/json'}
 
-        response = requests.post(f"{self.endpoint_url}world/node/reset", headers=headers, **self._kwargs)
+        response = self._request("POST", "world/node/reset", headers=headers, **self._kwargs)
         _assert_response(response)
 
     def update_config(self, config: UpdateConfigRequest):
@@ -182,7 +262,7 @@ class RenderAPIClient:
         self._texture_size = config.rendererConfig.textureSize
         headers = {'Content-Type': 'application/json'}
         request_body = self._encode_request_body(config)
-        response = requests.post(f"{self.endpoint_url}config", data=request_body, headers=headers, **self._kwargs)
+        response = self._request("POST", "config", data=request_body, headers=headers, **self._kwargs)
         _assert_response(response)
 
     def get_server_info(self, timeout: (float, float) = (5.0, 5.0)) -> GetServerInfoResponse:
@@ -199,7 +279,7 @@ class RenderAPIClient:
         Returns:
 
         """
-        response = requests.get(f"{self.endpoint_url}info", timeout=timeout)
+        response = self._request("GET", "info", timeout=timeout)
         _assert_response(response)
         return self._decode_response_body(response, GetServerInfoResponse)
 
@@ -215,7 +295,7 @@ class RenderAPIClient:
         Returns:
 
         """
-        response = requests.post(f"{self.endpoint_url}world/fakePhotoPositions?num={num_positions}", **self._kwargs)
+        response = self._request("POST", f"world/fakePhotoPositions?num={num_positions}", **self._kwargs)
         _assert_response(response)
         return self._decode_response_body(response, PostComputeFakePhotoPositionsResponse)
 
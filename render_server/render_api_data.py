@@ -1,6 +1,5 @@
 from pydantic import BaseModel
 from pydantic.dataclasses import dataclass
-from copy import deepcopy
 from json import JSONEncoder
 from typing import List, Optional, Iterator, Callable
 
@@ -98,6 +97,17 @@ class CameraParameter(BaseModel):
 
 class RenderSceneRequest(BaseModel):
     cameraParameters: List[CameraParameter]
+    # このリクエストのみに適用するテクスチャサイズ。0の場合はサーバーに設定されたサイズを使う
+    # texture size applied only to this request, 0 to use the size configured on the server
+    textureSize: int = 0
+
+
+class RenderDepthRequest(BaseModel):
+    """
+    低解像度の深度マップのレンダリングリクエスト
+    """
+    cameraParameters: List[CameraParameter]
+    textureSize: int = 8
 
 
 class BoundingBox(BaseModel):
@@ -191,25 +201,50 @@ class NodeViewModel(BaseModel):
 
         return node_dict["0000-00000001"]
 
-    def copy_without_children(self) -> 'NodeViewModel':
-        t_node = deepcopy(self)
-        t_node.child_left = None
-        t_node.child_right = None
-        return t_node
+    def copy_without_children(self, **update) -> 'NodeViewModel':
+        """
+        子を除いた浅いコピー PhotoScoring などのフィールドは元のノードと共有する
+        A shallow copy without the children, the other fields such as the photo scorings are shared with the node.
+        """
+        return self.model_copy(update={"child_left": None, "child_right": None, **update})
 
     def traverse(self, f: Callable[['NodeViewModel'], bool]):
-        def _traverse(node: 'NodeViewModel'):
+        """
+        前順に辿る f がFalseを返したノードの子は辿らない
+        Pre-order traversal with an explicit stack, the children of the nodes for which f returns False are skipped.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
             if f(node):
-                for child in node.children:
-                    _traverse(child)
-
-        _traverse(self)
+                stack.extend(reversed(node.children))
 
 
 class CalculateWorldBoundingBoxResponse(BaseModel):
     bbox: BoundingBox
 
 
+class OccupancyGridRequest(BaseModel):
+    voxelSize: float
+
+
+class Vector3i(BaseModel):
+    x: int = 0
+    y: int = 0
+    z: int = 0
+
+
+class OccupancyGridResponse(BaseModel):
+    """
+    ワールドのボクセル占有グリッド
+    freeは[x, y, z]の順の行優先で並んだuint8配列をbase64エンコードしたもの。1: 空いている, 0: コライダーと重なっている
+    """
+    bbox: BoundingBox
+    dims: Vector3i
+    voxelSize: float
+    free: str
+
+
 
 class UpdateNodesRequest(BaseModel):
     nodes: List[NodeViewModel]
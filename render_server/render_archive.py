@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import threading
+import zlib
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+# display only requests, their bodies are the whole node tree and their responses are empty, so they are not recorded
+DISPLAY_ONLY_PATHS = ("world/node", "world/node/reset")
+
+
+def request_key(method: str, path: str, body: bytes) -> str:
+    """
+    リクエストのメソッド、パス、ボディから求めるキー 同じカメラのバッチは同じキーになる
+    The key of a request from its method, path and body, the same camera batch always has the same key.
+    """
+    h = hashlib.sha1(f"{method} {path.lstrip('/')}\n".encode())
+    h.update(body)
+    return h.hexdigest()
+
+
+@dataclass
+class RecordedResponse:
+    key: str
+    method: str
+    path: str
+    status: int
+    content_type: str
+    # location of the compressed body in responses.bin
+    offset: int
+    size: int
+    raw_size: int
+    digest: str
+    # seconds from sending the request to receiving the whole response
+    elapsed: float
+
+
+class RenderArchiveWriter:
+    """
+    レンダリングサーバーへのリクエストとレスポンスの組をディスクに追記する RenderAPIClient の記録モードで使う
+    同じ内容のレスポンスは1度だけ保存する
+    Appends the request and response pairs of the render server to disk, used by the recording mode of RenderAPIClient.
+    A response body identical to a previously stored one is stored only once.
+
+    Files in the archive directory:
+        index.jsonl: one RecordedResponse per request, in the order of the requests
+        responses.bin: the response bodies compressed with zlib
+    """
+
+    def __init__(self, root: str, compress_level: int = 1):
+        self.root = root
+        self.compress_level = compress_level
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        # digest of a response body -> (offset, size), a recording can be resumed
+        self._stored: Dict[str, tuple] = {}
+        index_path = os.path.join(root, "index.jsonl")
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                for line in f:
+                    e = json.loads(line)
+                    self._stored[e["digest"]] = (e["offset"], e["size"])
+        self._index = open(index_path, "a")
+        self._data = open(os.path.join(root, "responses.bin"), "ab")
+        self.num_recorded = 0
+
+    def record(self, method: str, path: str, request_body: bytes, status: int, content_type: str, response_body: bytes, elapsed: float):
+        key = request_key(method, path, request_body)
+        digest = hashlib.sha1(response_body).hexdigest()
+        with self._lock:
+            if digest not in self._stored:
+                compressed = zlib.compress(response_body, self.compress_level)
+                self._stored[digest] = (self._data.tell(), len(compressed))
+                self._data.write(compressed)
+                self._data.flush()
+            offset, size = self._stored[digest]
+            entry = RecordedResponse(key=key, method=method, path=path.lstrip("/"), status=status, content_type=content_type,
+                                     offset=offset, size=size, raw_size=len(response_body), digest=digest, elapsed=elapsed)
+            self._index.write(json.dumps(entry.__dict__) + "\n")
+            self._index.flush()
+            self.num_recorded += 1
+
+    def close(self):
+        with self._lock:
+            self._index.close()
+            self._data.close()
+
+
+class RenderArchive:
+    """
+    RenderArchiveWriter で記録したアーカイブ 同じキーのリクエストが複数回記録された場合は記録された順に返し、最後のものを繰り返す
+    An archive recorded by RenderArchiveWriter. The responses of a request recorded several times are returned
+    in the recorded order, and the last one is repeated after that.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._responses: Dict[str, List[RecordedResponse]] = {}
+        with open(os.path.join(root, "index.jsonl")) as f:
+            for line in f:
+                entry = RecordedResponse(**json.loads(line))
+                self._responses.setdefault(entry.key, []).append(entry)
+        self._data = open(os.path.join(root, "responses.bin"), "rb")
+        self._cursors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(r) for r in self._responses.values())
+
+    def lookup(self, method: str, path: str, request_body: bytes) -> Optional[RecordedResponse]:
+        key = request_key(method, path, request_body)
+        responses = self._responses.get(key)
+        if responses is None:
+            return None
+        with self._lock:
+            i = self._cursors.get(key, 0)
+            self._cursors[key] = i + 1
+        return responses[min(i, len(responses) - 1)]
+
+    def read_body(self, response: RecordedResponse) -> bytes:
+        with self._lock:
+            self._data.seek(response.offset)
+            compressed = self._data.read(response.size)
+        return zlib.decompress(compressed)
+
+    def rewind(self):
+        with self._lock:
+            self._cursors.clear()
+
+    def close(self):
+        self._data.close()
@@ -0,0 +1,129 @@
+import argparse
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional, Dict
+
+from render_server.render_archive import RenderArchive, DISPLAY_ONLY_PATHS
+
+
+class ReplayRenderServer:
+    """
+    RenderAPIClient の記録モードで保存したアーカイブのレスポンスを返すサーバー
+    Unityのない環境で、記録した探索、グリッドサーチ、ベンチマークを同じバイト列で再実行するために使う
+    A server returning the responses of an archive recorded by the recording mode of RenderAPIClient,
+    so that explorations, grid searches and benchmarks can be re-run byte-for-byte without Unity.
+    The display only requests (node updates and resets) are not recorded and are always answered with an empty response.
+    """
+
+    def __init__(self, archive: RenderArchive, host: str = "localhost", port: int = 0, latency_scale: float = 0.0):
+        """
+        Args:
+            latency_scale: 記録されたレスポンス時間に掛ける係数 (0: 待たない、1: 記録どおり)
+                factor applied to the recorded response times (0: no delay, 1: the original latency)
+        """
+        self.archive = archive
+        self.latency_scale = latency_scale
+        self.num_replayed = 0
+        self.misses: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._create_handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def endpoint_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self) -> 'ReplayRenderServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.stop()
+
+    def print_stats(self):
+        print(f'[REPLAY] replayed {self.num_replayed} responses, {sum(self.misses.values())} requests not in the archive {self.misses}', flush=True)
+
+    def _replay(self, method: str, path: str, body: bytes):
+        """
+        Returns:
+            (status, content type, body)
+        """
+        path = path.lstrip("/")
+        if path in DISPLAY_ONLY_PATHS:
+            return 200, "text/plain", b""
+        response = self.archive.lookup(method, path, body)
+        if response is None:
+            with self._lock:
+                self.misses[path] = self.misses.get(path, 0) + 1
+            return 404, "text/plain", f"not recorded: {method} {path}".encode()
+        if self.latency_scale > 0:
+            time.sleep(response.elapsed * self.latency_scale)
+        with self._lock:
+            self.num_replayed += 1
+        return response.status, response.content_type, self.archive.read_body(response)
+
+    def _create_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _respond(self, method: str):
+                # read the body first so that the keep-alive connection stays in sync
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length) if length > 0 else b""
+                status, content_type, response_body = server._replay(method, self.path, body)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(response_body)))
+                self.end_headers()
+                self.wfile.write(response_body)
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST")
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a render server recording without Unity")
+    parser.add_argument('--archive', type=str, required=True, help="archive directory recorded by RenderAPIClient")
+    parser.add_argument('--host', type=str, default="localhost")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency_scale', type=float, default=0.0, help="factor applied to the recorded response times (0: no delay, 1: the original latency)")
+    args = parser.parse_args()
+
+    archive = RenderArchive(args.archive)
+    server = ReplayRenderServer(archive, host=args.host, port=args.port, latency_scale=args.latency_scale)
+    print(f"Replaying {len(archive)} responses of {args.archive} on {server.endpoint_url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.print_stats()
+
+
+if __name__ == "__main__":
+    main()
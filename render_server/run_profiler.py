@@ -0,0 +1,134 @@
+import cProfile
+import io
+import os
+import pstats
+import tracemalloc
+from typing import Optional, List
+
+import torch
+
+PROFILERS = ("cprofile", "torch", "tracemalloc")
+
+
+class RunProfiler:
+    """
+    探索ループのプロファイリング コードを変更せずに本番の探索の遅さを後から調べるために使う
+    * cprofile: 指定した区間の反復の探索スレッドを cProfile で計測する
+    * torch: 同じ区間で torch.profiler を実行する ScoringNet.forward は record_function でまとめて表示される
+    * tracemalloc: interval 回の反復ごとにメモリのスナップショットを取り、前回との差分を書き出す
+    成果物はノードログの隣に explore_{session_id}_* の名前で保存する
+    Profiles the exploration loop, so that a slow production run can be diagnosed after the fact without editing code.
+    * cprofile: runs cProfile on the exploration thread over a window of iterations
+    * torch: runs torch.profiler over the same window, ScoringNet.forward is grouped with record_function
+    * tracemalloc: takes a memory snapshot every interval iterations and writes the difference to the previous one
+    The artifacts are written next to the node log, named explore_{session_id}_*.
+    """
+
+    def __init__(self,
+                 log_root: str,
+                 session_id: str,
+                 profilers: List[str],
+                 start: int = 0,
+                 num_iterations: int = 50,
+                 memory_interval: int = 100,
+                 memory_top: int = 30):
+        """
+        Args:
+            profilers: 実行するプロファイラ (cprofile, torch, tracemalloc) profilers to run
+            start: cProfile と torch.profiler で計測する最初の反復 first iteration profiled by cProfile and torch.profiler
+            num_iterations: 計測する反復の数 number of profiled iterations
+            memory_interval: tracemalloc のスナップショットを取る反復の間隔 iterations between the tracemalloc snapshots
+            memory_top: 書き出すメモリ確保の行数 number of allocation sites written per snapshot
+        """
+        unknown = set(profilers) - set(PROFILERS)
+        assert len(unknown) == 0, f"unknown profilers: {unknown}, expected some of {PROFILERS}"
+        self.profilers = profilers
+        self.start = start
+        self.num_iterations = num_iterations
+        self.memory_interval = memory_interval
+        self.memory_top = memory_top
+        self._prefix = os.path.join(log_root, f"explore_{session_id}")
+        os.makedirs(log_root, exist_ok=True)
+        self._cprofile: Optional[cProfile.Profile] = None
+        self._torch_profile: Optional[torch.profiler.profile] = None
+        self._window_done = False
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self.artifacts: List[str] = []
+
+    def step(self, iteration: int):
+        """
+        各反復の最初に探索スレッドから呼ぶ Call at the beginning of each iteration, from the exploration thread.
+        """
+        if not self._window_done:
+            if iteration == self.start:
+                self._start_window()
+            elif iteration == self.start + self.num_iterations:
+                self._stop_window()
+        if "tracemalloc" in self.profilers and iteration % self.memory_interval == 0:
+            self._take_snapshot(iteration)
+
+    def finish(self, iteration: int):
+        """
+        探索の終了時に呼ぶ 区間の途中で終わった場合はそこまでを書き出す
+        Call at the end of the exploration. A window cut short by the end of the run is written as it is.
+        """
+        if self._cprofile is not None or self._torch_profile is not None:
+            self._stop_window()
+        if "tracemalloc" in self.profilers and tracemalloc.is_tracing():
+            self._take_snapshot(iteration)
+            tracemalloc.stop()
+        for path in self.artifacts:
+            print(f'[PROFILE] {path}', flush=True)
+        self.artifacts = []
+
+    def _start_window(self):
+        if "cprofile" in self.profilers:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        if "torch" in self.profilers:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._torch_profile = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True)
+            self._torch_profile.__enter__()
+
+    def _stop_window(self):
+        self._window_done = True
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self._path("cprofile.prof"))
+            self.artifacts.append(self._path("cprofile.prof"))
+            text = io.StringIO()
+            pstats.Stats(self._cprofile, stream=text).sort_stats("cumulative").print_stats(50)
+            self._write_text("cprofile.txt", text.getvalue())
+            self._cprofile = None
+        if self._torch_profile is not None:
+            self._torch_profile.__exit__(None, None, None)
+            self._torch_profile.export_chrome_trace(self._path("torch_trace.json"))
+            self.artifacts.append(self._path("torch_trace.json"))
+            self._write_text("torch_ops.txt", self._torch_profile.key_averages().table(sort_by="self_cpu_time_total", row_limit=50))
+            self._torch_profile = None
+
+    def _take_snapshot(self, iteration: int):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"iteration {iteration}: current {current / 2 ** 20:.1f}MiB, peak {peak / 2 ** 20:.1f}MiB"]
+        if self._snapshot is not None:
+            lines.append(f"  largest changes since the previous snapshot:")
+            lines.extend(f"  {stat}" for stat in snapshot.compare_to(self._snapshot, "lineno")[:self.memory_top])
+        lines.append(f"  largest allocations:")
+        lines.extend(f"  {stat}" for stat in snapshot.statistics("lineno")[:self.memory_top])
+        self._snapshot = snapshot
+        self._write_text("tracemalloc.txt", "\n".join(lines) + "\n\n", mode="a")
+
+    def _path(self, name: str) -> str:
+        return f"{self._prefix}_{name}"
+
+    def _write_text(self, name: str, text: str, mode: str = "w"):
+        with open(self._path(name), mode) as f:
+            f.write(text)
+        if self._path(name) not in self.artifacts:
+            self.artifacts.append(self._path(name))
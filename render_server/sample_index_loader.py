@@ -0,0 +1,117 @@
+import json
+from typing import Iterable, List, Tuple, Optional, Dict
+
+import numpy as np
+
+from exploration.spatial_index import SampleIndex
+from exploration.tree_pruning import PrunedTree, prune_tree, rows_of
+from render_server.columnar_log import ColumnarLog
+from render_server.logger import open_node_log
+from render_server.render_api_data import NodeViewModel, PhotoScoring, CameraParameter, Vector3f
+
+
+def build_sample_index(nodes: Iterable[NodeViewModel]) -> SampleIndex:
+    """
+    ノードの全ての PhotoScoring からサンプルインデックスを作る
+    Build the sample index from every PhotoScoring of the nodes.
+    """
+    positions, directions, scores, branch_ids, depths = [], [], [], [], []
+    for node in nodes:
+        for ps in node.photoScorings:
+            cp = ps.cameraParameter
+            positions.append(cp.position.elements)
+            directions.append(cp.direction.elements if cp.direction is not None else [0.0, 0.0, 0.0])
+            scores.append(ps.score)
+            branch_ids.append(int(node.branchId))
+            depths.append(node.depth)
+    return SampleIndex(np.array(positions).reshape(-1, 3), np.array(directions).reshape(-1, 3), np.array(scores),
+                       np.array(branch_ids, dtype=np.int64), np.array(depths, dtype=np.int64))
+
+
+def load_sample_index(log_file_path: str, include_grid_nodes: bool = True) -> SampleIndex:
+    """
+    探索ログ (jsonl, plog) またはグリッドサーチの結果 (_grid_search.jsonl) からサンプルインデックスを作る
+    NodeViewModelを経由せずにjsonを直接読むため、大きなログでも高速に読み込める
+    Build the sample index from an exploration log or a grid search output (_grid_search.jsonl).
+    The json is read directly without NodeViewModel validation, which keeps large logs fast to load.
+    Args:
+        include_grid_nodes: leafGridNodes の PhotoScoring も含める include the photo scorings of the leafGridNodes
+    """
+    return concat_sample_indices([load_sample_index_arrays(log_file_path, include_grid_nodes)])
+
+
+def load_sample_index_arrays(log_file_path: str, include_grid_nodes: bool = True) -> Tuple[np.ndarray, ...]:
+    """
+    Returns:
+        (positions, directions, scores, branch_ids, depths) of the samples in the file
+    """
+    if str(log_file_path).endswith(".plog"):
+        # columnar logs hold no leafGridNodes
+        return ColumnarLog(log_file_path).sample_index_arrays()
+    positions, directions, scores, branch_ids, depths = [], [], [], [], []
+
+    def add(photo_scorings, branch_id, depth):
+        for ps in photo_scorings:
+            cp = ps["cameraParameter"]
+            p = cp["position"]
+            d = cp.get("direction") or {"x": 0.0, "y": 0.0, "z": 0.0}
+            positions.append((p["x"], p["y"], p["z"]))
+            directions.append((d["x"], d["y"], d["z"]))
+            scores.append(ps["score"])
+            branch_ids.append(branch_id)
+            depths.append(depth)
+
+    with open_node_log(log_file_path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            node = json.loads(line)
+            branch_id, depth = int(node["branchId"]), node["depth"]
+            add(node["photoScorings"] or [], branch_id, depth)
+            if include_grid_nodes:
+                for grid_node in node.get("leafGridNodes") or []:
+                    add(grid_node["photoScorings"], branch_id, depth)
+    return (np.array(positions, dtype=np.float64).reshape(-1, 3), np.array(directions, dtype=np.float64).reshape(-1, 3),
+            np.array(scores, dtype=np.float64), np.array(branch_ids, dtype=np.int64), np.array(depths, dtype=np.int64))
+
+
+def concat_sample_indices(arrays: List[Tuple[np.ndarray, ...]]) -> SampleIndex:
+    return SampleIndex(*[np.concatenate(e) for e in zip(*arrays)])
+
+
+def to_photo_scorings(index: SampleIndex, indices: np.ndarray) -> List[PhotoScoring]:
+    return [PhotoScoring(cameraParameter=CameraParameter(position=Vector3f.from_array(index.positions[i]),
+                                                         direction=Vector3f.from_array(index.directions[i])),
+                         score=float(index.scores[i])).filter_np()
+            for i in indices]
+
+
+def prune_node_leaves(nodes: List[NodeViewModel], index: SampleIndex, lower_size_bound: float,
+                      columns: Optional[Dict[str, np.ndarray]] = None) -> Tuple[List[NodeViewModel], PrunedTree]:
+    """
+    子のサイズが lower_size_bound を下回るノードで木を切り、部分木の PhotoScoring を切ったノードにまとめる
+    Cut the tree at the nodes with a child smaller than lower_size_bound, and merge the photo scorings
+    of their subtrees into the cut nodes.
+    Args:
+        index: ノードのサンプルインデックス sample index of the nodes
+        columns: 列指向ログの列 ノードがその行の順の場合に指定する columns of a columnar log whose rows are the nodes
+    Returns:
+        ノードのうち切ったノードより下にないもの、行がノードに対応する PrunedTree
+        the nodes not below a cut node, and the PrunedTree whose rows refer to the nodes
+    """
+    if columns is not None:
+        branch_ids, depths = columns["branch_id"], columns["depth"]
+        sizes = columns["bounds_max"] - columns["bounds_min"]
+    else:
+        branch_ids = np.array([int(n.branchId) for n in nodes], dtype=np.int64)
+        depths = np.array([n.depth for n in nodes], dtype=np.int64)
+        sizes = np.array([n.size.elements for n in nodes]).reshape(-1, 3)
+    pruned = prune_tree(branch_ids, depths, sizes, lower_size_bound,
+                        sample_rows=rows_of(branch_ids, index.branch_ids), sample_scores=index.scores)
+    for row in np.flatnonzero(pruned.cut):
+        node = nodes[row]
+        # the photo scorings of the whole subtree are merged into the node
+        node.photoScorings = to_photo_scorings(index, pruned.samples(row))
+        node.child_left = None
+        node.child_right = None
+    return [n for n, hidden in zip(nodes, pruned.hidden) if not hidden], pruned
@@ -1,10 +1,12 @@
-from typing import List
+from typing import List, Optional
 
 import torch
 import numpy as np
 import torchvision
 from PIL import Image
 
+from render_server.embedding_store import EmbeddingStore
+from render_server.render_api_data import CameraParameter
 from util.time_measure import TimeMeasure
 
 
@@ -13,21 +15,82 @@ class ScoringNet:
     def __init__(self,
                  model: torch.nn.Module,
                  device: torch.device,
-                 transform: torchvision.transforms.Compose):
+                 transform: torchvision.transforms.Compose,
+                 input_size: int = 224,
+                 embedding_store: Optional[EmbeddingStore] = None):
         self.model = model
         self.transform = transform
         self.device = device
+        # images rendered at a lower resolution are upsampled to the input size of the model
+        self.input_size = input_size
+        # the embeddings of the images scored with their camera parameters are appended to the store
+        self.embedding_store = embedding_store
+        if embedding_store is not None:
+            assert self.supports_embeddings, "the model must provide forward_features, forward_head and get_classifier (timm) to store embeddings"
         self.model.eval()
 
-    def forward(self, images: List[np.ndarray]) -> torch.Tensor:
-        tm = TimeMeasure.default()
+    @property
+    def supports_embeddings(self) -> bool:
+        return all(hasattr(self.model, name) for name in ["forward_features", "forward_head", "get_classifier"])
+
+    def forward(self, images: List[np.ndarray], camera_parameters: Optional[List[CameraParameter]] = None) -> torch.Tensor:
+        """
+        Args:
+            camera_parameters: 画像のカメラパラメータ 指定された場合は埋め込みをストアに保存する
+                camera parameters of the images, their embeddings are stored when given
+        """
+        # groups the operators of a call in torch.profiler (--profile torch)
+        with torch.profiler.record_function("ScoringNet.forward"):
+            return self._forward(images, camera_parameters)
+
+    def _forward(self, images: List[np.ndarray], camera_parameters: Optional[List[CameraParameter]]) -> torch.Tensor:
+        if self.embedding_store is not None and camera_parameters is not None:
+            embeddings = self.embed(images)
+            scores = self.score_embeddings(embeddings)
+            with TimeMeasure.default().measure("store embeddings"):
+                self.embedding_store.add(camera_parameters, embeddings.float().cpu().numpy(), scores.cpu().numpy())
+            return scores
+
         with torch.no_grad():
-            with tm.measure("image conversion"):
-                images = [Image.fromarray(img) for img in images]
-            with tm.measure("inference"):
-                x = torch.stack([self.transform(img) for img in images], dim=0)
-                x = x.to(self.device)
-                x = x.reshape(len(images), *x.shape[1:])
+            x = self._to_input(images)
+            with TimeMeasure.default().measure("inference") as scope:
+                scope.count("images", len(images))
                 x = self.model(x)
                 scores = torch.nn.functional.softmax(x, dim=-1)[:, 1]
                 return scores
+
+    def embed(self, images: List[np.ndarray]) -> torch.Tensor:
+        """
+        Returns:
+            (n, dim) 分類ヘッドの直前の特徴量 (CLSトークンまたはプーリングされた特徴量)
+            the features right before the classifier head (CLS token or pooled features)
+        """
+        with torch.no_grad():
+            x = self._to_input(images)
+            with TimeMeasure.default().measure("inference") as scope:
+                scope.count("images", len(images))
+                return self.model.forward_head(self.model.forward_features(x), pre_logits=True)
+
+    def score_embeddings(self, embeddings: torch.Tensor) -> torch.Tensor:
+        """
+        分類ヘッドのみを実行してスコアを求める
+        Score the embeddings by running the classifier head only.
+        """
+        if not isinstance(embeddings, torch.Tensor):
+            # copied out of the (read only) memory map of the store
+            embeddings = torch.from_numpy(np.array(embeddings, dtype=np.float32))
+        with torch.no_grad():
+            x = self.model.get_classifier()(embeddings.to(self.device, dtype=torch.float32))
+            return torch.nn.functional.softmax(x, dim=-1)[:, 1]
+
+    def _to_input(self, images: List[np.ndarray]) -> torch.Tensor:
+        with TimeMeasure.default().measure("image conversion"):
+            images = [Image.fromarray(img) for img in images]
+            images = [self._resize(img) for img in images]
+            x = torch.stack([self.transform(img) for img in images], dim=0)
+        return x.to(self.device)
+
+    def _resize(self, image: Image.Image) -> Image.Image:
+        if image.size == (self.input_size, self.input_size):
+            return image
+        return image.resize((self.input_size, self.input_size), Image.BILINEAR)
@@ -0,0 +1,119 @@
+import json
+import os
+import random
+from dataclasses import dataclass
+from typing import List, Optional, Callable
+
+import numpy as np
+
+from exploration.surrogate import KNNScoreSurrogate
+from render_server.render_api_data import CameraParameter
+
+
+@dataclass
+class ImputationDecision:
+    scores: np.ndarray  # predicted score of each camera parameter
+    value: float  # predicted value of the node
+    upper_bound: float  # upper confidence bound of the value of the node
+    best_value: float  # best rendered node value when the decision was made
+    verify: bool  # render anyway to measure the error of the surrogate
+
+
+class SurrogateGate:
+    """
+    サロゲートモデルの信頼上限が現在の最良値を超えないと判断されたノードについて、レンダリングを行わず予測値を与える
+    判断の記録を監査用のjsonlに書き出し、一部のノードは検証のためにレンダリングして予測誤差を測る
+    Gives the predicted value to the nodes whose upper confidence bound cannot reach the best node value,
+    instead of rendering them.
+    The decisions are written to an audit jsonl, and a fraction of them is rendered anyway to measure the surrogate error.
+    """
+
+    def __init__(self,
+                 surrogate: KNNScoreSurrogate,
+                 margin: float = 0.05,
+                 beta: float = 2.0,
+                 min_samples: int = 200,
+                 verify_fraction: float = 0.1,
+                 audit_path: Optional[str] = None):
+        """
+        Args:
+            margin: 信頼上限が最良値よりこの値以上低いノードを予測値で置き換える
+                nodes whose upper confidence bound is below the best node value by at least this margin are imputed
+            beta: 信頼上限 mean + beta * std upper confidence bound is mean + beta * std
+            min_samples: サロゲートがこの数のサンプルを持つまでは常にレンダリングする
+                always render until the surrogate holds this many samples
+            verify_fraction: 予測値で置き換えられるノードのうち、検証のためにレンダリングする割合
+                fraction of the imputable nodes rendered anyway to measure the surrogate error
+            audit_path: 判断を記録するjsonlファイル jsonl file recording the decisions
+        """
+        self.surrogate = surrogate
+        self.margin = margin
+        self.beta = beta
+        self.min_samples = min_samples
+        self.verify_fraction = verify_fraction
+        self.audit_path = audit_path
+        if audit_path is not None:
+            os.makedirs(os.path.dirname(audit_path) or ".", exist_ok=True)
+        self.best_value = -np.inf
+        self.num_imputed = 0
+        self.num_imputed_images = 0
+        self.errors: List[float] = []
+
+    @staticmethod
+    def _arrays(camera_parameters: List[CameraParameter]):
+        positions = np.array([cp.position.elements for cp in camera_parameters], dtype=np.float64)
+        directions = np.array([cp.direction.elements for cp in camera_parameters], dtype=np.float64)
+        return positions, directions
+
+    def decide(self, camera_parameters: List[CameraParameter], get_value: Callable[[np.ndarray], float]) -> Optional[ImputationDecision]:
+        """
+        Args:
+            camera_parameters: camera parameters the node would render
+            get_value: node value from the scores, e.g. HOOExplorer.get_value
+        Returns:
+            None if the node has to be rendered
+        """
+        if self.surrogate.num_samples < self.min_samples or len(camera_parameters) == 0:
+            return None
+        mean, std = self.surrogate.predict(*self._arrays(camera_parameters))
+        upper_bound = float(get_value(mean + self.beta * std))
+        if upper_bound >= self.best_value - self.margin:
+            return None
+        return ImputationDecision(scores=mean, value=float(get_value(mean)), upper_bound=upper_bound,
+                                  best_value=float(self.best_value), verify=random.random() < self.verify_fraction)
+
+    def observe(self, camera_parameters: List[CameraParameter], scores: np.ndarray, value: float):
+        """
+        レンダリングで得られたスコアでサロゲートを更新する
+        Update the surrogate with the rendered scores of a node.
+        """
+        self.surrogate.add(*self._arrays(camera_parameters), np.asarray(scores, dtype=np.float64))
+        self.best_value = max(self.best_value, float(value))
+
+    def record(self, node_id: str, depth: int, decision: ImputationDecision, actual_value: Optional[float] = None):
+        """
+        Args:
+            actual_value: 検証のためにレンダリングしたノードの実際の値 rendered value of a verified node
+        """
+        if decision.verify:
+            self.errors.append(decision.value - actual_value)
+        else:
+            self.num_imputed += 1
+            self.num_imputed_images += len(decision.scores)
+        if self.audit_path is None:
+            return
+        entry = {"nodeId": node_id, "depth": depth, "imputed": not decision.verify,
+                 "predicted": decision.value, "upperBound": decision.upper_bound, "bestValue": decision.best_value,
+                 "actual": actual_value}
+        with open(self.audit_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def stats(self) -> dict:
+        return {"imputed": self.num_imputed, "imputed_images": self.num_imputed_images, "verified": len(self.errors)}
+
+    def print_stats(self):
+        print(f'[SURROGATE] imputed {self.num_imputed} nodes, skipped {self.num_imputed_images} renders', flush=True)
+        if len(self.errors) > 0:
+            errors = np.array(self.errors)
+            print(f'[SURROGATE] verified {len(errors)} nodes: mean abs error {np.abs(errors).mean():.4f}, '
+                  f'bias {errors.mean():+.4f}, max under-prediction {max(0.0, -errors.min()):.4f}', flush=True)
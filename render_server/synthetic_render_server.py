@@ -0,0 +1,389 @@
+import argparse
+import base64
+import gzip
+import json
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Tuple, Optional, Dict
+
+import numpy as np
+
+# 1 part of the multipart render response holds up to 6x6 tiles, same as the Unity TileCameraRenderer
+TILE_ROW_COL = 6
+SERVER_VERSION = (1, 2, 0, 0)
+
+
+class SyntheticScene:
+    """
+    Unityのワールドの代わりに使用する、箱型の部屋と箱型の障害物からなる単純なシーン
+    A simple scene made of a box room and box obstacles, used instead of a Unity world.
+    Rays are cast analytically against the axis-aligned boxes, so no renderer is needed.
+    """
+
+    def __init__(self,
+                 room_min: Tuple[float, float, float],
+                 room_max: Tuple[float, float, float],
+                 obstacles: List[Tuple[Tuple[float, float, float], Tuple[float, float, float]]]):
+        self.room_min = np.asarray(room_min, dtype=np.float64)
+        self.room_max = np.asarray(room_max, dtype=np.float64)
+        self.obstacle_min = np.asarray([o[0] for o in obstacles], dtype=np.float64).reshape(-1, 3)
+        self.obstacle_max = np.asarray([o[1] for o in obstacles], dtype=np.float64).reshape(-1, 3)
+
+    @classmethod
+    def default(cls) -> 'SyntheticScene':
+        return SyntheticScene(room_min=(-10.0, 0.0, -10.0),
+                              room_max=(10.0, 5.0, 10.0),
+                              obstacles=[((-6.0, 0.0, -6.0), (-4.0, 5.0, -4.0)),
+                                         ((4.0, 0.0, 4.0), (6.0, 5.0, 6.0)),
+                                         ((-2.0, 0.0, 3.0), (2.0, 1.0, 5.0)),
+                                         ((-10.0, 0.0, -1.0), (-3.0, 5.0, 1.0))])
+
+    def raycast(self, origins: np.ndarray, directions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Args:
+            origins: (n, 3)
+            directions: (n, 3) normalized
+        Returns:
+            distances: (n,) distance to the first hit
+            hit_ids: (n,) index of the hit obstacle, -1 for the room walls
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # per axis (3, n) arrays, the reductions over the short last axis of (n, 3) arrays are slow
+            o = np.ascontiguousarray(origins.T)
+            inv_dir = 1.0 / np.where(directions == 0.0, 1e-12, directions).T
+            # the camera is inside the room, so the exit distance of the room box is the wall distance
+            distances = np.full(len(origins), np.inf)
+            for axis in range(3):
+                t1 = (self.room_min[axis] - o[axis]) * inv_dir[axis]
+                t2 = (self.room_max[axis] - o[axis]) * inv_dir[axis]
+                np.minimum(distances, np.maximum(t1, t2), out=distances)
+            np.maximum(distances, 0.0, out=distances)
+            hit_ids = np.full(len(origins), -1, dtype=np.int64)
+            for i, (o_min, o_max) in enumerate(zip(self.obstacle_min, self.obstacle_max)):
+                t_near = np.full(len(origins), -np.inf)
+                t_far = np.full(len(origins), np.inf)
+                for axis in range(3):
+                    t1 = (o_min[axis] - o[axis]) * inv_dir[axis]
+                    t2 = (o_max[axis] - o[axis]) * inv_dir[axis]
+                    np.maximum(t_near, np.minimum(t1, t2), out=t_near)
+                    np.minimum(t_far, np.maximum(t1, t2), out=t_far)
+                t_hit = np.maximum(t_near, 0.0)
+                closer = (t_near <= t_far) & (t_far > 0.0) & (t_hit < distances)
+                distances[closer] = t_hit[closer]
+                hit_ids[closer] = i
+        return distances, hit_ids
+
+    def camera_rays(self, camera_parameters: List[dict], texture_size: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            origins: (n * texture_size * texture_size, 3)
+            directions: (n * texture_size * texture_size, 3) in the row major order from top to bottom
+        """
+        positions = np.array([_vec(cp["position"]) for cp in camera_parameters], dtype=np.float64).reshape(-1, 3)
+        forwards = np.array([_forward(cp) for cp in camera_parameters], dtype=np.float64).reshape(-1, 3)
+        up = np.array([0.0, 1.0, 0.0])
+        rights = np.cross(up, forwards)
+        degenerate = np.linalg.norm(rights, axis=1) < 1e-6
+        rights[degenerate] = np.array([1.0, 0.0, 0.0])
+        rights /= np.linalg.norm(rights, axis=1, keepdims=True)
+        ups = np.cross(forwards, rights)
+
+        tan_half_fov = np.array([np.tan(np.deg2rad(cp.get("fieldOfView", 60.0) or 60.0) / 2) for cp in camera_parameters]).reshape(-1, 1, 1)
+        aspect = np.array([cp.get("aspect", 0.0) or 1.0 for cp in camera_parameters]).reshape(-1, 1, 1)
+        pixel = (np.arange(texture_size) + 0.5) / texture_size * 2.0 - 1.0
+        u = pixel[None, None, :] * tan_half_fov * aspect
+        v = -pixel[None, :, None] * tan_half_fov
+        directions = (forwards[:, None, None, :]
+                      + u[..., None] * rights[:, None, None, :]
+                      + v[..., None] * ups[:, None, None, :])
+        directions /= np.linalg.norm(directions, axis=-1, keepdims=True)
+        origins = np.broadcast_to(positions[:, None, None, :], directions.shape)
+        return origins.reshape(-1, 3), directions.reshape(-1, 3)
+
+    def render_depth(self, camera_parameters: List[dict], texture_size: int) -> np.ndarray:
+        """
+        Returns:
+            (n, texture_size, texture_size) float32 distances
+        """
+        origins, directions = self.camera_rays(camera_parameters, texture_size)
+        distances, _ = self.raycast(origins, directions)
+        return distances.astype(np.float32).reshape(len(camera_parameters), texture_size, texture_size)
+
+    def render_color(self, camera_parameters: List[dict], texture_size: int) -> np.ndarray:
+        """
+        Returns:
+            (n, texture_size, texture_size, 3) uint8 procedural images
+        """
+        origins, directions = self.camera_rays(camera_parameters, texture_size)
+        distances, hit_ids = self.raycast(origins, directions)
+        hit_points = origins + directions * distances[:, None]
+        checker = (np.floor(hit_points).astype(np.int64).sum(axis=1) % 2).astype(np.float64)
+        palette = np.array([[200, 190, 170], [200, 60, 60], [60, 160, 80], [70, 90, 200], [220, 180, 40], [150, 80, 180]], dtype=np.float64)
+        base = palette[(hit_ids + 1) % len(palette)]
+        shade = (0.75 + 0.25 * checker) / (1.0 + 0.05 * distances)
+        colors = np.clip(base * shade[:, None], 0, 255).astype(np.uint8)
+        return colors.reshape(len(camera_parameters), texture_size, texture_size, 3)
+
+
+    def occupancy(self, voxel_size: float) -> np.ndarray:
+        """
+        Returns:
+            (nx, ny, nz) uint8, 1 for the voxels which do not overlap any obstacle
+        """
+        dims = np.maximum(np.ceil((self.room_max - self.room_min) / voxel_size).astype(np.int64), 1)
+        axes = [self.room_min[i] + (np.arange(dims[i]) + 0.5) * voxel_size for i in range(3)]
+        centers = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)
+        half = voxel_size / 2
+        free = np.ones(len(centers), dtype=bool)
+        for o_min, o_max in zip(self.obstacle_min, self.obstacle_max):
+            overlaps = np.all((centers + half > o_min) & (centers - half < o_max), axis=1)
+            free &= ~overlaps
+        return free.astype(np.uint8).reshape(tuple(dims))
+
+
+def _vec(d: Optional[dict]) -> List[float]:
+    if d is None:
+        return [0.0, 0.0, 0.0]
+    return [float(d["x"]), float(d["y"]), float(d["z"])]
+
+
+def _forward(cp: dict) -> np.ndarray:
+    if cp.get("direction") is not None:
+        forward = np.asarray(_vec(cp["direction"]))
+    elif cp.get("quaternion") is not None:
+        q = cp["quaternion"]
+        x, y, z, w = float(q["x"]), float(q["y"]), float(q["z"]), float(q["w"])
+        # rotate (0, 0, 1) by the quaternion
+        forward = np.array([2 * (x * z + w * y), 2 * (y * z - w * x), 1 - 2 * (x * x + y * y)])
+    else:
+        forward = np.array([0.0, 0.0, 1.0])
+    return forward / (np.linalg.norm(forward) + 1e-12)
+
+
+def encode_tile_atlas(images: np.ndarray, texture_size: int) -> List[bytes]:
+    """
+    Unity TileCameraRenderer と同じ形式で、画像を6x6のタイルにまとめたRGB24のバイト列に変換する
+    Pack images into 6x6 RGB24 tile atlases in the same layout as the Unity TileCameraRenderer.
+    The atlas is stored bottom-up, so that RenderAPIClient flips it back.
+    """
+    num_tiles = TILE_ROW_COL * TILE_ROW_COL
+    atlases = []
+    for start in range(0, len(images), num_tiles):
+        atlas = np.zeros((texture_size * TILE_ROW_COL, texture_size * TILE_ROW_COL, 3), dtype=np.uint8)
+        for i, image in enumerate(images[start:start + num_tiles]):
+            y, x = divmod(i, TILE_ROW_COL)
+            atlas[y * texture_size:(y + 1) * texture_size, x * texture_size:(x + 1) * texture_size] = image
+        atlases.append(np.flip(atlas, axis=0).tobytes())
+    return atlases
+
+
+def encode_multipart(parts: List[bytes]) -> Tuple[bytes, str]:
+    boundary = str(uuid.uuid4())
+    chunks = []
+    for i, part in enumerate(parts):
+        chunks.append(f"--{boundary}\r\n"
+                      f"Content-Type: image/png\r\n"
+                      f"Content-Disposition: form-data; name=renderTexture{i}; filename=renderTexture{i}.png\r\n\r\n".encode())
+        chunks.append(part)
+        chunks.append(b"\r\n")
+    chunks.append(f"--{boundary}--\r\n".encode())
+    return b"".join(chunks), f'multipart/form-data;boundary="{boundary}"'
+
+
+class SyntheticRenderServer:
+    """
+    Unity Render Serverの代わりに使用する、pure pythonのスタンドインサーバー
+    RenderAPIClientが使用するエンドポイントを SyntheticScene を使って実装する
+    A pure python stand-in for the Unity Render Server.
+    It implements the endpoints used by RenderAPIClient on top of a SyntheticScene,
+    so that the explorer can be exercised without a Unity Editor in Play mode.
+    """
+
+    def __init__(self, scene: Optional[SyntheticScene] = None, host: str = "localhost", port: int = 0,
+                 latency: float = 0.0, bandwidth: float = 0.0):
+        """
+        Args:
+            latency: 各リクエストに加える遅延 [s] delay added to every request in seconds
+            bandwidth: リクエストとレスポンスの転送速度 [bytes/s] (0: 無制限) bytes per second of the request and the response bodies (0: unlimited)
+        """
+        self.scene = scene if scene is not None else SyntheticScene.default()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.texture_size = 224
+        self.nodes: Dict[str, dict] = {}
+        self.request_counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._create_handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def endpoint_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self) -> 'SyntheticRenderServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.stop()
+
+    def _count(self, path: str):
+        with self._lock:
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+
+    def _delay(self, num_bytes: int):
+        """
+        ネットワークとUnityのレンダリングの遅さを模擬する Simulate the network and the rendering time of Unity.
+        """
+        delay = self.latency
+        if self.bandwidth > 0:
+            delay += num_bytes / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+    def _handle_render(self, body: dict):
+        texture_size = int(body.get("textureSize") or self.texture_size)
+        images = self.scene.render_color(body["cameraParameters"], texture_size)
+        return encode_multipart(encode_tile_atlas(images, texture_size))
+
+    def _handle_render_depth(self, body: dict):
+        depths = self.scene.render_depth(body["cameraParameters"], int(body.get("textureSize", 8)))
+        return depths.astype("<f4").tobytes(), "application/octet-stream"
+
+    def _handle_bbox(self):
+        # Unity server sends the bounding box values as strings for compatibility
+        def to_vec(v):
+            return {"x": str(float(v[0])), "y": str(float(v[1])), "z": str(float(v[2]))}
+
+        response = {"bbox": {"min": to_vec(self.scene.room_min), "max": to_vec(self.scene.room_max)}}
+        return json.dumps(response).encode(), "application/json"
+
+    def _handle_occupancy(self, body: dict):
+        voxel_size = float(body["voxelSize"])
+        free = self.scene.occupancy(voxel_size)
+
+        def to_vec(v):
+            return {"x": float(v[0]), "y": float(v[1]), "z": float(v[2])}
+
+        response = {"bbox": {"min": to_vec(self.scene.room_min), "max": to_vec(self.scene.room_max)},
+                    "dims": {"x": free.shape[0], "y": free.shape[1], "z": free.shape[2]},
+                    "voxelSize": voxel_size,
+                    "free": base64.b64encode(free.tobytes()).decode()}
+        return json.dumps(response).encode(), "application/json"
+
+    def _handle_update_nodes(self, body: dict):
+        with self._lock:
+            for node in body["nodes"]:
+                self.nodes[node["id"]] = node
+        return b"", "text/plain"
+
+    def _handle_reset_nodes(self):
+        with self._lock:
+            self.nodes.clear()
+        return b"", "text/plain"
+
+    def _handle_config(self, body: dict):
+        self.texture_size = int(body["rendererConfig"]["textureSize"])
+        return b"", "text/plain"
+
+    def _handle_info(self):
+        major, minor, build, revision = SERVER_VERSION
+        response = {"version": f"{major}.{minor}.{build}.{revision}",
+                    "versionInfo": {"majorVersion": major, "minorVersion": minor, "buildNumber": build, "revisionNumber": revision},
+                    "platform": "SyntheticRenderServer"}
+        return json.dumps(response).encode(), "application/json"
+
+    def _create_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _read_json(self) -> dict:
+                length = int(self.headers.get("Content-Length", 0))
+                if length == 0:
+                    return {}
+                body = self.rfile.read(length)
+                self.request_bytes = length
+                if self.headers.get("Content-Encoding", "") == "gzip":
+                    body = gzip.decompress(body)
+                return json.loads(body.decode("utf_8_sig"))
+
+            def _respond(self, body: bytes, content_type: str, status: int = 200):
+                server._delay(getattr(self, "request_bytes", 0) + len(body))
+                self.request_bytes = 0
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _dispatch(self, routes):
+                path = self.path.split("?")[0]
+                server._count(path)
+                handler = routes.get(path)
+                if handler is None:
+                    self._respond(f"not found: {path}".encode(), "text/plain", 404)
+                    return
+                try:
+                    body, content_type = handler()
+                except Exception as e:
+                    self._respond(repr(e).encode(), "text/plain", 500)
+                    return
+                self._respond(body, content_type)
+
+            def do_GET(self):
+                self._dispatch({
+                    "/world/bbox": server._handle_bbox,
+                    "/info": server._handle_info,
+                })
+
+            def do_POST(self):
+                # read the body first so that the keep-alive connection stays in sync
+                body = self._read_json()
+                self._dispatch({
+                    "/world/render": lambda: server._handle_render(body),
+                    "/world/render/depth": lambda: server._handle_render_depth(body),
+                    "/world/occupancy": lambda: server._handle_occupancy(body),
+                    "/world/node": lambda: server._handle_update_nodes(body),
+                    "/world/node/reset": lambda: server._handle_reset_nodes(),
+                    "/config": lambda: server._handle_config(body),
+                })
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic stand-in for the Unity Render Server")
+    parser.add_argument('--host', type=str, default="localhost")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help="delay added to every request in seconds")
+    parser.add_argument('--bandwidth', type=float, default=0.0, help="bytes per second of the request and the response bodies (0: unlimited)")
+    args = parser.parse_args()
+
+    server = SyntheticRenderServer(host=args.host, port=args.port, latency=args.latency, bandwidth=args.bandwidth)
+    print(f"Synthetic render server listening on {server.endpoint_url}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
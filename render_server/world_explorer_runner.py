@@ -1,13 +1,20 @@
+import time
 import traceback
-from typing import Optional
+from functools import partial
+from typing import Optional, List, Tuple
 
+import numpy as np
 import torch
 
 from exploration.algorithm import HOOExplorer
+from render_server.depth_pre_pass import DepthPrePass
 from render_server.logger import Logger, NodeLogger
+from render_server.multi_fidelity import ResolutionSchedule, MultiFidelityReport
+from render_server.occupancy_grid_cache import OccupancyGridCache
 from render_server.render_api_client import RenderAPIClient
 from render_server.render_api_data import CameraParameter, Vector3f, RenderSceneRequest, BoundingBox, NodeViewModel, UpdateNodesRequest, PhotoScoring
 from render_server.scoring_net import ScoringNet
+from render_server.surrogate_gate import SurrogateGate, ImputationDecision
 from util.time_measure import TimeMeasure
 
 
@@ -17,13 +24,29 @@ class WorldExplorerRunner:
                  explorer: HOOExplorer,
                  api_client: RenderAPIClient,
                  logger: Logger,
-                 node_logger: Optional[NodeLogger]):
+                 node_logger: Optional[NodeLogger],
+                 depth_pre_pass: Optional[DepthPrePass] = None,
+                 occupancy_grid_cache: Optional[OccupancyGridCache] = None,
+                 resolution_schedule: Optional[ResolutionSchedule] = None,
+                 multi_fidelity_top_k: int = 10,
+                 surrogate_gate: Optional[SurrogateGate] = None):
 
         self.scoring_net = scoring_net
         self.explorer = explorer
         self.api_client = api_client
         self.logger = logger
         self._node_logger = node_logger
+        self._depth_pre_pass = depth_pre_pass
+        self._occupancy_grid_cache = occupancy_grid_cache
+        self._resolution_schedule = resolution_schedule
+        self._surrogate_gate = surrogate_gate
+        self.num_evaluated_nodes = 0
+        self.num_rendered_images = 0
+        self.num_logged_nodes = 0
+        self.best_value = -np.inf
+        self.multi_fidelity_report: Optional[MultiFidelityReport] = None
+        if resolution_schedule is not None:
+            self.multi_fidelity_report = MultiFidelityReport(resolution_schedule.full_texture_size, multi_fidelity_top_k)
         self._world_id = "world1"
 
     def calculate_bounding_box(self) -> BoundingBox:
@@ -33,52 +56,179 @@ class WorldExplorerRunner:
     def reset_nodes(self):
         self.api_client.request_reset_node()
 
+    def _render_and_score(self, camera_parameters: List[CameraParameter], texture_size: int = 0) -> Tuple[List[np.ndarray], np.ndarray]:
+        tm = TimeMeasure.default()
+        with tm.measure("http request (rendering)") as scope:
+            scope.count("images", len(camera_parameters)).annotate(texture_size=texture_size)
+            start = time.perf_counter()
+            images = self.api_client.request_render(RenderSceneRequest(cameraParameters=camera_parameters, textureSize=texture_size))
+            render_seconds = time.perf_counter() - start
+        self.num_rendered_images += len(camera_parameters)
+        with torch.no_grad():
+            with tm.measure("inference scoring net") as scope:
+                scope.count("images", len(images))
+                scores = self.scoring_net.forward(images, camera_parameters).cpu().numpy()
+        if self.multi_fidelity_report is not None:
+            self.multi_fidelity_report.record(texture_size or self.multi_fidelity_report.full_texture_size, camera_parameters, scores, render_seconds)
+        return images, scores
+
+    def report_multi_fidelity(self):
+        """
+        低解像度で見つかった上位の撮影スポットをフル解像度で再評価し、解像度ごとの集計とともに表示する
+        Re-score the best photospots found at a lower resolution at the full resolution, and print the report.
+        """
+        if self.multi_fidelity_report is None:
+            return
+
+        def score_full_res(camera_parameters: List[CameraParameter]) -> np.ndarray:
+            full_texture_size = self.multi_fidelity_report.full_texture_size
+            images = self.api_client.request_render(RenderSceneRequest(cameraParameters=camera_parameters, textureSize=full_texture_size))
+            with torch.no_grad():
+                return self.scoring_net.forward(images).cpu().numpy()
+
+        self.multi_fidelity_report.verify(score_full_res)
+        self.multi_fidelity_report.print_report()
+
+    def print_sample_efficiency(self):
+        print(f'[EXPLORER] rendered {self.num_rendered_images} images for {self.num_evaluated_nodes} rendered nodes, '
+              f'best node value {self.best_value:.4f}', flush=True)
+
+    def _log_node(self, node: NodeViewModel):
+        self.num_logged_nodes += 1
+        if self._node_logger is None:
+            return
+        self._node_logger.log_node(self._world_id, node)
+
+    def _impute_node(self, decision: ImputationDecision):
+        """
+        サロゲートの予測値でノードを評価し、レンダリングを行わない
+        Score the current node with the value predicted by the surrogate, without rendering.
+        """
+        tm = TimeMeasure.default()
+        with tm.measure("hoo step") as scope:
+            imputed_node = self.explorer.model.root.shortcut
+            scope.annotate(node=imputed_node.id, imputed=True)
+            self.explorer.batch_step(decision.scores)
+        self._surrogate_gate.record(imputed_node.id, imputed_node.depth, decision)
+        with tm.measure("logging"):
+            self.logger.logging(decision.value, self.explorer.depth)
+            # imputed nodes have no photospots, the audit log of the gate tells them apart
+            self._log_node(NodeViewModel.from_node(imputed_node, []))
+
+    def _skip_node(self, reused_scores: np.ndarray, decision: Optional[ImputationDecision] = None):
+        """
+        セル内に既に存在するサンプルのスコアでノードを評価し、レンダリングを行わない
+        Value the current node from the samples already inside it, without rendering.
+        Args:
+            decision: 検証のためにレンダリングするはずだったサロゲートの判断 再利用したスコアを実際の値として記録する
+                the decision of the surrogate gate to verify the node, recorded with the reused scores as the actual value
+        """
+        tm = TimeMeasure.default()
+        with tm.measure("hoo step") as scope:
+            skipped_node = self.explorer.model.root.shortcut
+            scope.annotate(node=skipped_node.id, reused=True)
+            self.explorer.batch_step(reused_scores)
+        if decision is not None:
+            self._surrogate_gate.record(skipped_node.id, skipped_node.depth, decision, float(self.explorer.get_value(reused_scores)))
+        with tm.measure("logging"):
+            self.logger.logging(self.explorer.get_value(reused_scores), self.explorer.depth)
+            self._log_node(NodeViewModel.from_node(skipped_node, []))
+
     def evaluate_leaf(self, bbox: BoundingBox):
         try:
             tm = TimeMeasure.default()
 
             if self.explorer.model is None:
-                self.explorer.setup_model(bbox)
-
-            with tm.measure("http request (rendering)"):
-                raw_camera_parameters = list(self.explorer.get_camera_parameters())
-
-                def map_camera_parameter(cp):
-                    next_pos, next_dir = cp
-                    return CameraParameter(position=Vector3f.from_array(next_pos), direction=Vector3f.from_array(next_dir))
-
-                camera_parameters = list(map(map_camera_parameter, raw_camera_parameters))
-                request_body = RenderSceneRequest(cameraParameters=camera_parameters)
-
-                images = self.api_client.request_render(request_body)
-            with torch.no_grad():
-                with tm.measure("inference scoring net"):
-                    scores = self.scoring_net.forward(images).cpu().numpy()
-                    last_evaluated_node = self.explorer.model.root.shortcut
-                    self.explorer.batch_step(scores)
-
-                    # import numpy as np
-                    # for g in range(len(images)):
-                    #     images[g] = np.array(images[g])
-                    #     img = images[g]
-                    #     score = scores[g]
-                    #     cv2.cvtColor(img, cv2.COLOR_RGB2BGR, img)
-                    #     cv2.putText(img, f"{score}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2, cv2.LINE_AA)
-                    # tile_img = tile_images(images, 5)
-                    # cv2.imshow(last_evaluated_node.id, tile_img)
-                    # cv2.waitKey(0)
-
-                with tm.measure("visualize"):
-                    photo_scoring = [PhotoScoring(cameraParameter=cp, score=float(score)) for score, cp in zip(scores, camera_parameters)]
-                    node = NodeViewModel.from_node(last_evaluated_node, photo_scoring)
-                    self.api_client.request_update_nodes(UpdateNodesRequest(nodes=[node]))
-
-                with tm.measure("logging"):
-                    self.logger.logging(self.explorer.get_value(scores), self.explorer.depth)
-
-                    if self._node_logger is None:
-                        return
-                    self._node_logger.log_node(self._world_id, node)
+                occupancy_grid = self._occupancy_grid_cache.get(bbox) if self._occupancy_grid_cache is not None else None
+                self.explorer.setup_model(bbox, occupancy_grid)
+
+            # cells rejected by the occupancy grid while sampling this node are logged before it,
+            # so that the parents always precede their children in the log
+            with tm.measure("logging"):
+                for rejected_node in self.explorer.pop_rejected_nodes():
+                    self._log_node(NodeViewModel.from_node(rejected_node, []))
+
+            def map_camera_parameter(cp):
+                next_pos, next_dir = cp
+                return CameraParameter(position=Vector3f.from_array(next_pos), direction=Vector3f.from_array(next_dir))
+
+            decision = None
+            if self._surrogate_gate is not None:
+                with tm.measure("surrogate"):
+                    proposal = list(map(map_camera_parameter, self.explorer.get_camera_parameters()))
+                    decision = self._surrogate_gate.decide(proposal, self.explorer.get_value)
+                if decision is not None and not decision.verify:
+                    self._impute_node(decision)
+                    return
+
+            texture_size = self._resolution_schedule.texture_size(self.explorer.depth) if self._resolution_schedule is not None else 0
+            render_and_score = partial(self._render_and_score, texture_size=texture_size)
+
+            sample_reuse = self.explorer.sample_reuse
+            if sample_reuse is not None:
+                reused_scores = sample_reuse.skip_scores(self.explorer.model.root.shortcut, self.explorer.rollout.num)
+                if reused_scores is not None:
+                    self._skip_node(reused_scores, decision)
+                    return
+
+            # an adaptive rollout proposes the directions of the node over several rounds
+            camera_parameters: List[CameraParameter] = []
+            scores_list: List[np.ndarray] = []
+            rendered = []
+            while True:
+                proposal = list(self.explorer.get_camera_parameters())
+                round_camera_parameters = list(map(map_camera_parameter, proposal))
+                round_scores = np.zeros(len(proposal))
+                render_mask = np.ones(len(proposal), dtype=bool)
+                if sample_reuse is not None:
+                    # the camera parameters of the reused samples replace the proposed ones
+                    matched = sample_reuse.match(self.explorer.model.root.shortcut, proposal)
+                    render_mask = matched < 0
+                    for i in np.flatnonzero(~render_mask):
+                        round_camera_parameters[i] = map_camera_parameter((sample_reuse.store.positions[matched[i]], sample_reuse.store.directions[matched[i]]))
+                        round_scores[i] = sample_reuse.store.scores[matched[i]]
+                to_render = [cp for cp, render in zip(round_camera_parameters, render_mask) if render]
+                if len(to_render) > 0:
+                    if self._depth_pre_pass is not None:
+                        images, rendered_scores = self._depth_pre_pass.evaluate(to_render, render_and_score)
+                    else:
+                        images, rendered_scores = render_and_score(to_render)
+                    round_scores[render_mask] = rendered_scores
+                    # the directions dropped by the depth pre-pass have no image, their pruned score is not a sample to reuse
+                    rendered.extend((cp, score) for cp, image, score in zip(to_render, images, rendered_scores) if image is not None)
+                self.explorer.observe(round_scores)
+                camera_parameters.extend(round_camera_parameters)
+                scores_list.append(round_scores)
+                if self.explorer.rollout_finished:
+                    break
+            scores = np.concatenate(scores_list)
+            if sample_reuse is not None and len(rendered) > 0:
+                sample_reuse.add(np.array([cp.position.elements for cp, _ in rendered]),
+                                 np.array([cp.direction.elements for cp, _ in rendered]),
+                                 np.array([score for _, score in rendered]))
+
+            with tm.measure("hoo step") as scope:
+                last_evaluated_node = self.explorer.model.root.shortcut
+                scope.annotate(node=last_evaluated_node.id, samples=len(scores))
+                self.explorer.batch_step(scores)
+            self.num_evaluated_nodes += 1
+            self.best_value = max(self.best_value, float(self.explorer.get_value(scores)))
+
+            if self._surrogate_gate is not None:
+                with tm.measure("surrogate"):
+                    value = self.explorer.get_value(scores)
+                    self._surrogate_gate.observe(camera_parameters, scores, value)
+                    if decision is not None:
+                        self._surrogate_gate.record(last_evaluated_node.id, last_evaluated_node.depth, decision, float(value))
+
+            with tm.measure("visualize"):
+                photo_scoring = [PhotoScoring(cameraParameter=cp, score=float(score)) for score, cp in zip(scores, camera_parameters)]
+                node = NodeViewModel.from_node(last_evaluated_node, photo_scoring)
+                self.api_client.request_update_nodes(UpdateNodesRequest(nodes=[node]))
+
+            with tm.measure("logging"):
+                self.logger.logging(self.explorer.get_value(scores), self.explorer.depth)
+                self._log_node(node)
 
 
         except Exception as e:
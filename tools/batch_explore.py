@@ -0,0 +1,231 @@
+"""
+TUIなしで、YAMLのマニフェストに並べた複数のワールド (レンダリングサーバー) を探索し、木を枝刈りし、必要ならグリッドサーチする
+ワールドごとに出力ディレクトリ <output>/<name> を作り、ログ、性能の要約、標準出力、結果の要約 (summary.json) を書き出す
+ワールドはそれぞれ別のプロセスで、最大 --max_parallel 個まで並列に実行する 失敗したワールドがあれば終了コードは1になる
+Explore the worlds (render servers) listed in a YAML manifest without the TUI, prune the trees and optionally grid search them.
+Every world gets its own output directory <output>/<name> with its logs, performance summaries, stdout and a structured
+summary (summary.json), and runs in its own process, at most --max_parallel at a time.
+The exit code is 1 when any world failed, and non-zero as well when the manifest is invalid.
+
+The manifest holds the options of panotree_explorer, shared ones under defaults and the ones of each world under worlds:
+    defaults:
+      num_updates: 300
+      checkpoint: ./model/mlphoto2023_v0_model_best.pth.tar
+      grid_search: true
+    worlds:
+      - name: office
+        api_host: 192.168.0.10
+      - name: station
+        api_host: 192.168.0.11
+        num_updates: 500
+log_root is set to the output directory of each world.
+
+usage: python -m tools.batch_explore --manifest worlds.yaml --output output/batch --max_parallel 2
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import List, Dict, Tuple
+
+import yaml
+
+from render_server.explore_session import ExploreSession, create_explore_parser
+from render_server.leaf_grid_searcher import run_grid_search
+from render_server.logger import open_node_log
+from render_server.render_api_data import NodeViewModel
+from render_server.sample_index_loader import build_sample_index, prune_node_leaves
+from util.hf_argparser import HfArgumentParser
+
+BATCH_SUMMARY_FORMAT = "panotree-batch-1"
+
+
+@dataclass
+class BatchWorldConfig:
+    _argument_group_name = "Batch World Parameters"
+    name: str = field(default="world", metadata={"help": "name of the world, its outputs are written to <output>/<name>"})
+    grid_search: bool = field(default=False, metadata={"help": "grid search the pruned nodes scored at least score_threshold"})
+
+
+def create_parser() -> HfArgumentParser:
+    return create_explore_parser(BatchWorldConfig)
+
+
+def to_arguments(parser: HfArgumentParser, options: dict) -> List[str]:
+    """
+    マニフェストのオプションをコマンドライン引数に変換する panotree_explorer と同じパーサーで検証するため
+    Convert the options of a manifest into command line arguments, so that they are checked by the parser of panotree_explorer.
+    """
+    arguments = []
+    for key, value in options.items():
+        option = f"--{key}"
+        if option not in parser._option_string_actions:
+            # the scoring net parameters are spelled with dashes
+            option = f"--{key.replace('_', '-')}"
+        action = parser._option_string_actions.get(option)
+        if value is None:
+            continue
+        if isinstance(value, bool) and action is not None and action.nargs == 0:
+            # store_true flags
+            if value:
+                arguments.append(option)
+        elif isinstance(value, dict):
+            arguments += [option] + [f"{k}={v}" for k, v in value.items()]
+        elif isinstance(value, (list, tuple)):
+            arguments += [option] + [str(v) for v in value]
+        else:
+            arguments += [option, str(value)]
+    return arguments
+
+
+def load_manifest(manifest_path: str, output: str) -> List[Tuple[str, List[str]]]:
+    """
+    Returns:
+        name and command line arguments of each world, log_root is its output directory
+    """
+    with open(manifest_path) as f:
+        manifest = yaml.safe_load(f) or {}
+    defaults = manifest.get("defaults") or {}
+    worlds = manifest.get("worlds") or []
+    assert len(worlds) > 0, f"{manifest_path} lists no worlds"
+    parser = create_parser()
+    ret = []
+    for i, world in enumerate(worlds):
+        options = {**defaults, **world}
+        name = str(options.setdefault("name", f"world{i}"))
+        assert name not in [n for n, _ in ret], f"duplicated world name: {name}"
+        assert os.path.basename(name) == name and name not in (".", ".."), f"world name must be a directory name: {name}"
+        options["log_root"] = os.path.join(output, name)
+        ret.append((name, to_arguments(parser, options)))
+    return ret
+
+
+def load_nodes(log_file_path: str) -> List[NodeViewModel]:
+    with open_node_log(log_file_path) as f:
+        return [NodeViewModel.model_validate_json(line) for line in f if line.strip()]
+
+
+def explore_world(name: str, arguments: List[str]) -> dict:
+    """
+    1つのワールドを探索、枝刈り、グリッドサーチし、summary.json を書き出す プロセスプールから呼ばれる
+    例外は要約に記録して返すため、他のワールドの実行は続く
+    Explore, prune and grid search a world, and write its summary.json. Called from the process pool.
+    An exception is recorded in the summary, so that the other worlds go on.
+    """
+    world_conf, *confs, args = create_parser().parse_args_into_dataclasses(args=arguments, return_remaining_strings=False)
+    hoo_conf = confs[0]
+    output_dir = hoo_conf.log_root
+    os.makedirs(output_dir, exist_ok=True)
+    summary = {"format": BATCH_SUMMARY_FORMAT, "world": name, "status": "running", "stage": None, "error": None,
+               "started_at": time.time(), "wall_seconds": 0.0, "arguments": arguments, "stages": {},
+               "outputs": {"stdout": os.path.join(output_dir, "stdout.log")}}
+    start = time.perf_counter()
+    with open(summary["outputs"]["stdout"], "w") as out, contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+        try:
+            summary["stage"] = "setup"
+            session = ExploreSession(*confs, args, world_id=name)
+            summary["session_id"] = session.session_id
+            summary["endpoint_url"] = session.api_client.endpoint_url
+
+            # the session is closed before the prune, which reads the finished log, its grid searcher stays usable
+            with session:
+                summary["stage"] = "explore"
+                perf = session.explore()
+            summary["stages"]["explore"] = {"wall_seconds": perf["wall_seconds"], **perf["counts"], "best_value": session.runner.best_value}
+            summary["outputs"].update({"log": session.node_log_path, "perf": session.perf_path})
+
+            summary["stage"] = "prune"
+            nodes = load_nodes(session.node_log_path)
+            index = build_sample_index(nodes)
+            kept, pruned = prune_node_leaves(nodes, index, session.grid_conf.lower_size_bound)
+            pruned_path = session.node_log_path.removesuffix(".gz").removesuffix(".jsonl") + "_pruned.jsonl"
+            with open(pruned_path, "w") as f:
+                f.writelines(node.model_dump_json() + "\n" for node in kept)
+            summary["stages"]["prune"] = {"nodes": len(nodes), "cut": int(pruned.cut.sum()), "kept": len(kept), "samples": len(index)}
+            summary["outputs"]["pruned"] = pruned_path
+
+            if world_conf.grid_search:
+                summary["stage"] = "grid_search"
+                out_file_path = session.node_log_path.removesuffix(".gz").removesuffix(".jsonl") + "_grid_search.jsonl"
+                result = run_grid_search(session.leaf_grid_searcher, kept, session.grid_conf.score_threshold, out_file_path,
+                                         session.run_config, sample_index=index)
+                summary["stages"]["grid_search"] = {k: result[k] for k in ("wall_seconds", "nodes", "grid_nodes", "images")}
+                summary["outputs"].update({"grid_search": result["path"], "grid_search_perf": result["perf_path"]})
+            summary["stage"] = None
+            summary["status"] = "ok"
+        except Exception as e:
+            traceback.print_exc()
+            summary["status"] = "failed"
+            summary["error"] = f"{type(e).__name__}: {e}"
+    summary["wall_seconds"] = time.perf_counter() - start
+    with open(os.path.join(output_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2, default=str)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--manifest", required=True, help="YAML manifest of the worlds")
+    parser.add_argument("--output", default="./output/batch", help="output directory, each world writes to <output>/<name>")
+    parser.add_argument("--max_parallel", type=int, default=1, help="maximum number of worlds explored at the same time")
+    parser.add_argument("--worlds", default="", help="comma separated names of the worlds to run, every world of the manifest if empty")
+    parser.add_argument("--dry_run", action="store_true", help="check the manifest and print the arguments of each world without running them")
+    batch_args = parser.parse_args()
+
+    worlds = load_manifest(batch_args.manifest, batch_args.output)
+    selected = [w.strip() for w in batch_args.worlds.split(",") if w.strip()]
+    unknown = set(selected) - {name for name, _ in worlds}
+    assert len(unknown) == 0, f"unknown worlds: {unknown}"
+    if selected:
+        worlds = [(name, arguments) for name, arguments in worlds if name in selected]
+    # the options of every world are checked before anything runs
+    explore_parser = create_parser()
+    for name, arguments in worlds:
+        try:
+            explore_parser.parse_args_into_dataclasses(args=arguments, return_remaining_strings=False)
+        except ValueError as e:
+            parser.error(f"world {name}: {e}")
+        if batch_args.dry_run:
+            print(f"{name}: {' '.join(arguments)}")
+    if batch_args.dry_run:
+        return
+
+    os.makedirs(batch_args.output, exist_ok=True)
+    print(f"exploring {len(worlds)} worlds, {batch_args.max_parallel} at a time, in {batch_args.output}", flush=True)
+    start = time.perf_counter()
+    summaries: Dict[str, dict] = {}
+    # every world runs in a process of its own, the timings and the traces of the sessions are process wide
+    with ProcessPoolExecutor(max_workers=max(batch_args.max_parallel, 1)) as executor:
+        futures = {executor.submit(explore_world, name, arguments): name for name, arguments in worlds}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                summary = future.result()
+            except BrokenProcessPool as e:
+                # the worker died without returning, e.g. killed for its memory
+                summary = {"world": name, "status": "failed", "error": f"{type(e).__name__}: {e}", "wall_seconds": time.perf_counter() - start}
+            summaries[name] = summary
+            print(f"{name}: {summary['status']} in {summary['wall_seconds']:.1f}s" +
+                  (f", {summary['error']} in {summary.get('stage')}" if summary["error"] else ""), flush=True)
+
+    failed = [name for name, _ in worlds if summaries[name]["status"] != "ok"]
+    batch_summary = {"format": BATCH_SUMMARY_FORMAT, "manifest": batch_args.manifest, "wall_seconds": time.perf_counter() - start,
+                     "num_worlds": len(worlds), "failed": failed,
+                     "worlds": {name: {k: summaries[name].get(k) for k in ("status", "stage", "error", "wall_seconds")} |
+                                      {"summary": os.path.join(batch_args.output, name, "summary.json")}
+                                for name, _ in worlds}}
+    with open(os.path.join(batch_args.output, "batch_summary.json"), "w") as f:
+        json.dump(batch_summary, f, indent=2)
+    print(f"{len(worlds) - len(failed)}/{len(worlds)} worlds done in {batch_summary['wall_seconds']:.1f}s, summary in "
+          f"{os.path.join(batch_args.output, 'batch_summary.json')}", flush=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+一様な方向探索 (Rollout) と逐次半減による方向探索 (SuccessiveHalvingRollout) を、
+解析的なスコア関数上でレンダリング1枚あたりの最良スコアで比較する
+Compare the uniform direction search (Rollout) and the successive halving direction search (SuccessiveHalvingRollout)
+by the best score found per render, on analytic direction score fields.
+
+usage: python -m tools.benchmark_direction_search --num_dir 21 --num_fields 200
+"""
+import argparse
+from typing import Callable, List, Union
+
+import numpy as np
+
+from exploration.algorithm import Rollout, SuccessiveHalvingRollout
+
+
+def random_score_field(rng: np.random.Generator, num_lobes: int, min_kappa: float, max_kappa: float) -> Callable[[np.ndarray], float]:
+    """
+    ランダムな方向を中心とする von Mises-Fisher 型のローブの最大値をスコアとする関数を返す
+    Returns a score field given by the maximum of von Mises-Fisher like lobes around random directions.
+    """
+    centers = rng.normal(size=(num_lobes, 3))
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    kappas = rng.uniform(min_kappa, max_kappa, size=num_lobes)
+    heights = rng.uniform(0.3, 1.0, size=num_lobes)
+
+    def score(direction: np.ndarray) -> float:
+        direction = direction / np.linalg.norm(direction)
+        return float(np.max(heights * np.exp(kappas * (centers @ direction - 1))))
+
+    return score
+
+
+def run_rollout(rollout: Union[Rollout, SuccessiveHalvingRollout], score: Callable[[np.ndarray], float]) -> List[float]:
+    """
+    Returns:
+        scores in the order of rendering
+    """
+    rollout.reset()
+    scores = []
+    while not rollout.finished:
+        proposal = rollout.propose(np.zeros(3), pos_diff_scale=1)
+        round_scores = [score(direction) for _, direction in proposal]
+        rollout.observe(round_scores)
+        scores.extend(round_scores)
+    return scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num_dir", type=int, default=21, help="number of renders per node")
+    parser.add_argument("--num_fields", type=int, default=200, help="number of random score fields")
+    parser.add_argument("--num_lobes", type=int, default=3, help="number of lobes of each score field")
+    parser.add_argument("--min_kappa", type=float, default=5.0, help="minimum sharpness of the lobes")
+    parser.add_argument("--max_kappa", type=float, default=60.0, help="maximum sharpness of the lobes")
+    parser.add_argument("--sh_num_rounds", type=int, default=3)
+    parser.add_argument("--sh_keep_ratio", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    rollouts = {
+        "uniform": Rollout(num_pos_diff=0, num_dir=args.num_dir),
+        "successive_halving": SuccessiveHalvingRollout(num_dir=args.num_dir, num_rounds=args.sh_num_rounds, keep_ratio=args.sh_keep_ratio),
+    }
+    best_so_far = {name: [] for name in rollouts}
+    for _ in range(args.num_fields):
+        score = random_score_field(rng, args.num_lobes, args.min_kappa, args.max_kappa)
+        for name, rollout in rollouts.items():
+            best_so_far[name].append(np.maximum.accumulate(run_rollout(rollout, score)))
+
+    print(f"best score per render, mean over {args.num_fields} fields ({args.num_dir} renders per node)")
+    print(f"{'renders':>8} " + " ".join(f"{name:>20}" for name in rollouts))
+    for i in range(args.num_dir):
+        print(f"{i + 1:8} " + " ".join(f"{np.mean([b[i] for b in best_so_far[name]]):20.4f}" for name in rollouts))
+    wins = np.mean([sh[-1] > u[-1] for sh, u in zip(best_so_far["successive_halving"], best_so_far["uniform"])])
+    print(f"successive halving finds a better direction in {wins:.1%} of the fields")
+
+
+if __name__ == "__main__":
+    main()
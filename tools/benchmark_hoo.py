@@ -0,0 +1,210 @@
+"""
+レンダリングなしで、解析的なスコア関数 (exploration.analytic_fields) 上で HOOExplorer を実行し、
+HOOのパラメータ (c, v1, rho, policy_name, value_strategy) ごとの単純リグレットの推移と1ステップあたりの時間を比較する
+シードごとの試行はプロセスプールで並列に実行する 結果は表 (CSV)、曲線 (JSON)、グラフ (matplotlib がある場合) に書き出す
+Run HOOExplorer on analytic score fields (exploration.analytic_fields) without any renderer, and compare
+the simple regret versus the number of evaluated nodes and the wall time per step of each set of HOO parameters
+(c, v1, rho, policy_name, value_strategy). The trials of the seeds run in parallel in a process pool.
+The results are written as a table (CSV), curves (JSON) and a plot when matplotlib is installed.
+The simple regret is the best score reachable with the directions of the rollout minus the best score found so far,
+so that it measures how well HOO finds the positions.
+With --volume, the parameters are swept on the score volume of a real world built by tools.build_score_volume instead,
+and ranked by the best score found within the budget.
+
+usage: python -m tools.benchmark_hoo --c 0.1,0.2,0.5 --policy_name size,xyz --fields gaussian,needle --num_seeds 16 --output hoo_benchmark
+       python -m tools.benchmark_hoo --volume output/score_volume --c 0.1,0.2,0.5 --rho 0.3,0.5,0.7 --budget 200 --output hoo_sweep
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, Optional
+
+import numpy as np
+
+from exploration.algorithm import HOOExplorer, generate_list_dir
+from exploration.analytic_fields import FIELDS, create_field
+from exploration.score_volume import ScoreVolume
+from render_server.render_api_data import BoundingBox, Vector3f
+
+CONFIG_KEYS = ("c", "v1", "rho", "policy_name", "value_strategy")
+
+
+def run_trial(config: dict, field_name: str, seed: int, num_evaluations: int, num_local_dir: int,
+              bbox_min: Tuple[float, float, float], bbox_max: Tuple[float, float, float],
+              volume: Optional[str] = None) -> Tuple[np.ndarray, float, float]:
+    """
+    1つのパラメータ、スコア関数、シードの試行 プロセスプールから呼ばれる
+    One trial of a set of parameters, a field and a seed, called from the process pool.
+    Args:
+        volume: スコアボリュームのディレクトリ 指定した場合はスコア関数の代わりに使う directory of a score volume used instead of the field
+    Returns:
+        best score found after each evaluated node (num_evaluations,), the reachable optimum,
+        mean wall time of the HOO part of a step in seconds
+    """
+    # the field depends on the seed only, so that every set of parameters is compared on the same fields,
+    # the volume is memory mapped, so the processes share its pages
+    field = ScoreVolume(volume) if volume is not None else create_field(field_name, seed, bbox_min, bbox_max)
+    random.seed(seed)
+    np.random.seed(seed)
+    explorer = HOOExplorer(c=config["c"], v1=config["v1"], rho=config["rho"], policyName=config["policy_name"],
+                           num_pos_diff=0, num_dir=num_local_dir, value_storategy=config["value_strategy"])
+    explorer.setup_model(BoundingBox(min=Vector3f.from_array(bbox_min), max=Vector3f.from_array(bbox_max)))
+    optimum = field.optimum_over(np.array(generate_list_dir(num_local_dir)))
+    best = -np.inf
+    best_scores = np.zeros(num_evaluations)
+    hoo_ns = 0
+    for i in range(num_evaluations):
+        scores = []
+        while True:
+            start = time.perf_counter_ns()
+            proposal = list(explorer.get_camera_parameters())
+            hoo_ns += time.perf_counter_ns() - start
+            round_scores = field(np.array([p for p, _ in proposal]), np.array([d for _, d in proposal]))
+            start = time.perf_counter_ns()
+            explorer.observe(round_scores)
+            finished = explorer.rollout_finished
+            hoo_ns += time.perf_counter_ns() - start
+            scores.extend(round_scores)
+            if finished:
+                break
+        start = time.perf_counter_ns()
+        explorer.batch_step(scores)
+        hoo_ns += time.perf_counter_ns() - start
+        best = max(best, float(np.max(scores)))
+        best_scores[i] = best
+    return best_scores, optimum, hoo_ns / num_evaluations / 1e9
+
+
+def config_label(config: dict) -> str:
+    return f'c={config["c"]} v1={config["v1"]} rho={config["rho"]} {config["policy_name"]} {config["value_strategy"]}'
+
+
+def parse_list(value: str, cast) -> list:
+    return [cast(v.strip()) for v in value.split(",") if v.strip()]
+
+
+def write_plot(path: str, fields: List[str], results: List[dict]) -> bool:
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        return False
+    fig, axes = plt.subplots(1, len(fields), figsize=(6 * len(fields), 4.5), squeeze=False)
+    for ax, field_name in zip(axes[0], fields):
+        for result in results:
+            if result["field"] != field_name:
+                continue
+            x = np.arange(1, len(result["median_regret"]) + 1)
+            ax.plot(x, result["median_regret"], label=result["label"])
+            ax.fill_between(x, result["q25_regret"], result["q75_regret"], alpha=0.15)
+        ax.set_title(field_name)
+        ax.set_xlabel("evaluated nodes")
+        ax.set_ylabel("simple regret (median, IQR)")
+        ax.set_yscale("symlog", linthresh=1e-3)
+        ax.legend(fontsize="small")
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--c", default="0.2", help="comma separated values of the HOO exploration term")
+    parser.add_argument("--v1", default="0.5", help="comma separated values of the HOO v1")
+    parser.add_argument("--rho", default="0.5", help="comma separated values of the HOO rho")
+    parser.add_argument("--policy_name", default="size", help="comma separated split policies (size, xyz)")
+    parser.add_argument("--value_strategy", default="max", help="comma separated value strategies (max, mean)")
+    parser.add_argument("--fields", default=",".join(FIELDS), help=f"comma separated score fields, some of {list(FIELDS)}")
+    parser.add_argument("--num_seeds", type=int, default=8, help="number of seeds (fields and HOO random states) per set of parameters")
+    parser.add_argument("--num_evaluations", type=int, default=300, help="number of evaluated nodes per trial")
+    parser.add_argument("--num_local_dir", type=int, default=21, help="number of camera directions of each node")
+    parser.add_argument("--bbox_min", type=float, nargs=3, default=(-10.0, 0.0, -10.0))
+    parser.add_argument("--bbox_max", type=float, nargs=3, default=(10.0, 5.0, 10.0))
+    parser.add_argument("--volume", default=None, help="score volume built by tools.build_score_volume, used instead of the fields")
+    parser.add_argument("--budget", type=int, default=0, help="number of evaluated nodes the parameters are ranked at (0: num_evaluations)")
+    parser.add_argument("--checkpoints", default="25,50,100,200", help="comma separated numbers of evaluated nodes shown in the table")
+    parser.add_argument("--solved_regret", type=float, default=0.05, help="a trial whose final regret is below this value counts as solved")
+    parser.add_argument("--num_workers", type=int, default=0, help="number of processes, the number of CPUs if 0")
+    parser.add_argument("--seed", type=int, default=0, help="first seed")
+    parser.add_argument("--output", default="hoo_benchmark", help="prefix of the output .csv, .json and .png files")
+    args = parser.parse_args()
+
+    fields = parse_list(args.fields, str)
+    unknown = set(fields) - set(FIELDS)
+    assert len(unknown) == 0, f"unknown fields: {unknown}, expected some of {list(FIELDS)}"
+    if args.volume is not None:
+        volume = ScoreVolume(args.volume)
+        assert volume.num_completed == volume.num_points, f"{args.volume} is incomplete ({volume.num_completed}/{volume.num_points} points), resume tools.build_score_volume"
+        fields = ["volume"]
+        args.bbox_min, args.bbox_max = volume.bbox_min.tolist(), volume.bbox_max.tolist()
+    budget = args.budget or args.num_evaluations
+    assert budget <= args.num_evaluations, "the budget must not exceed num_evaluations"
+    values = [parse_list(args.c, float), parse_list(args.v1, float), parse_list(args.rho, float),
+              parse_list(args.policy_name, str), parse_list(args.value_strategy, str)]
+    configs = [dict(zip(CONFIG_KEYS, v)) for v in itertools.product(*values)]
+    checkpoints = sorted(set(n for n in parse_list(args.checkpoints, int) if n <= args.num_evaluations) | {budget, args.num_evaluations})
+    seeds = list(range(args.seed, args.seed + args.num_seeds))
+
+    tasks = [(config, field_name, seed) for config in configs for field_name in fields for seed in seeds]
+    num_workers = args.num_workers or os.cpu_count() or 1
+    print(f"{len(configs)} parameter sets x {len(fields)} fields x {len(seeds)} seeds, {args.num_evaluations} nodes per trial, {num_workers} processes")
+    start = time.perf_counter()
+    n = len(tasks)
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        trials = list(executor.map(run_trial, [t[0] for t in tasks], [t[1] for t in tasks], [t[2] for t in tasks],
+                                   [args.num_evaluations] * n, [args.num_local_dir] * n,
+                                   [tuple(args.bbox_min)] * n, [tuple(args.bbox_max)] * n, [args.volume] * n,
+                                   chunksize=max(n // (num_workers * 4), 1)))
+    print(f"{n} trials in {time.perf_counter() - start:.1f}s")
+
+    results = []
+    for i, (config, field_name) in enumerate(itertools.product(configs, fields)):
+        group = trials[i * len(seeds):(i + 1) * len(seeds)]
+        best_scores = np.stack([b for b, _, _ in group])
+        regrets = np.array([o for _, o, _ in group])[:, None] - best_scores
+        step_seconds = np.array([s for _, _, s in group])
+        final = regrets[:, -1]
+        results.append({"label": config_label(config), "config": config, "field": field_name, "num_seeds": len(seeds),
+                        "mean_best": best_scores.mean(axis=0).tolist(),
+                        "best_at_budget": float(best_scores[:, budget - 1].mean()),
+                        "mean_regret": regrets.mean(axis=0).tolist(),
+                        "median_regret": np.median(regrets, axis=0).tolist(),
+                        "q25_regret": np.percentile(regrets, 25, axis=0).tolist(),
+                        "q75_regret": np.percentile(regrets, 75, axis=0).tolist(),
+                        "checkpoints": {str(c): float(regrets[:, c - 1].mean()) for c in checkpoints},
+                        "final_regret_std": float(final.std()),
+                        "solved_ratio": float(np.mean(final < args.solved_regret)),
+                        "ms_per_step": float(step_seconds.mean() * 1000)})
+
+    header = ["field", "parameters", f"best@{budget}"] + [f"regret@{c}" for c in checkpoints] + ["std", "solved", "ms/step"]
+    print(f"mean over {len(seeds)} seeds, ranked by the best score within {budget} nodes (solved: final regret < {args.solved_regret})")
+    print(f"{header[0]:>10} {header[1]:>36} " + " ".join(f"{h:>11}" for h in header[2:]))
+    rows = []
+    for result in sorted(results, key=lambda r: (r["field"], -r["best_at_budget"])):
+        row = [result["field"], result["label"], result["best_at_budget"]] + [result["checkpoints"][str(c)] for c in checkpoints] + \
+              [result["final_regret_std"], result["solved_ratio"], result["ms_per_step"]]
+        rows.append(row)
+        print(f"{row[0]:>10} {row[1]:>36} " + " ".join(f"{v:11.4f}" for v in row[2:]))
+
+    with open(f"{args.output}.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    with open(f"{args.output}.json", "w") as f:
+        json.dump({"args": vars(args), "results": results}, f)
+    print(f"table in {args.output}.csv, curves in {args.output}.json")
+    if write_plot(f"{args.output}.png", fields, results):
+        print(f"plot in {args.output}.png")
+    else:
+        print("matplotlib is not installed, the plot is skipped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Unityなしで、合成レンダリングサーバー (SyntheticRenderServer) を使って探索の各段階のスループットを計測する
+* hoo: 解析的なスコア関数上の HOO の1ノードあたりの処理 (レンダリングなし) steps/s
+* render: request_render のレンダリングとデコード images/s, MiB/s
+* scoring_net: CPU 上の ScoringNet の推論 images/s
+* explore: 探索全体 (レンダリング、推論、ノードの送信、ログ) nodes/s
+* grid_search: 探索したスコアの高いノードのグリッドサーチ leaves/min
+* tui_load: 探索のログを TUI に読み込んでサーバーへ送るまでの時間
+結果は性能の要約 (panotree-perf-1) の形式で書き出すため、tools.compare_perf で前回の結果と比較できる
+Measure the throughput of each stage of the exploration on the synthetic render server, without Unity.
+* hoo: HOO steps on an analytic score field, without rendering, in steps/s
+* render: rendering and decoding of request_render, in images/s and MiB/s
+* scoring_net: ScoringNet inference on the CPU, in images/s
+* explore: the whole exploration (rendering, inference, node upload and logging), in nodes/s
+* grid_search: grid search of the best explored nodes, in leaves/min
+* tui_load: loading the exploration log into the TUI and uploading it to the server
+The results are written as a performance summary (panotree-perf-1), so that tools.compare_perf can compare them
+with the previous results.
+
+usage: python -m tools.benchmark_suite --output bench_perf.json --latency 0.005 --bandwidth 100e6 --model resnet18 --random_weights
+with a recording of a real render server: python -m tools.benchmark_suite --endpoint_url http://localhost:8080/ --record_archive ARCHIVE_DIR
+and offline: python -m render_server.replay_render_server --archive ARCHIVE_DIR --latency_scale 1 & python -m tools.benchmark_suite --endpoint_url http://localhost:8080/
+"""
+import argparse
+import asyncio
+import os
+import platform
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+import torch
+from timm import create_model
+from torchvision import transforms
+
+from data.explorer_data import HOOConfig
+from exploration.analytic_fields import multimodal_gaussian_field
+from render_server import factory
+from render_server.leaf_grid_searcher import LeafGridSearcher
+from render_server.logger import FileNodeLogger, NullLogger
+from render_server.perf_summary import build_perf_summary, write_perf_summary, server_info
+from render_server.render_api_client import RenderAPIClient
+from render_server.render_archive import RenderArchiveWriter
+from render_server.render_api_data import BoundingBox, CameraParameter, NodeViewModel, RenderSceneRequest, RendererConfig, UpdateConfigRequest, Vector3f
+from render_server.scoring_net import ScoringNet
+from render_server.scoring_net_params import add_scoring_net_params
+from render_server.synthetic_render_server import SyntheticRenderServer
+from render_server.world_explorer_runner import WorldExplorerRunner
+from util.time_measure import TimeMeasure
+
+BENCHMARKS = ("hoo", "render", "scoring_net", "explore", "grid_search", "tui_load")
+
+
+def bbox_arrays(bbox: BoundingBox) -> Tuple[np.ndarray, np.ndarray]:
+    # the bounding box of the server is decoded without validation, its values may be strings
+    return (np.array([float(bbox.min.x), float(bbox.min.y), float(bbox.min.z)]),
+            np.array([float(bbox.max.x), float(bbox.max.y), float(bbox.max.z)]))
+
+
+def random_camera_parameters(bbox: BoundingBox, num: int, rng: np.random.Generator) -> List[CameraParameter]:
+    positions = rng.uniform(*bbox_arrays(bbox), size=(num, 3))
+    directions = rng.normal(size=(num, 3))
+    return [CameraParameter(position=Vector3f.from_array(p), direction=Vector3f.from_array(d)) for p, d in zip(positions, directions)]
+
+
+def benchmark_hoo(bbox: BoundingBox, num_steps: int, seed: int) -> dict:
+    explorer = factory.create_hoo_explorer(HOOConfig())
+    explorer.setup_model(bbox)
+    field = multimodal_gaussian_field(np.random.default_rng(seed), *bbox_arrays(bbox))
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        scores = []
+        while True:
+            proposal = list(explorer.get_camera_parameters())
+            round_scores = list(field(np.array([p for p, _ in proposal]), np.array([d for _, d in proposal])))
+            explorer.observe(round_scores)
+            scores.extend(round_scores)
+            if explorer.rollout_finished:
+                break
+        explorer.batch_step(scores)
+    seconds = time.perf_counter() - start
+    return {"steps": num_steps, "seconds": seconds, "rates": {"hoo_steps_per_second": num_steps / seconds}}
+
+
+def benchmark_render(api_client: RenderAPIClient, bbox: BoundingBox, batch_size: int, num_requests: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    requests = [RenderSceneRequest(cameraParameters=random_camera_parameters(bbox, batch_size, rng)) for _ in range(num_requests)]
+    num_images, num_bytes = 0, 0
+    start = time.perf_counter()
+    for request in requests:
+        for atlas in api_client.request_render(request):
+            num_bytes += atlas.nbytes
+        num_images += batch_size
+    seconds = time.perf_counter() - start
+    return {"images": num_images, "bytes": num_bytes, "seconds": seconds,
+            "rates": {"render_images_per_second": num_images / seconds, "render_bytes_per_second": num_bytes / seconds}}
+
+
+def benchmark_scoring_net(scoring_net: ScoringNet, server: SyntheticRenderServer, bbox: BoundingBox, batch_size: int, num_batches: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    cps = [cp.model_dump() for cp in random_camera_parameters(bbox, batch_size, rng)]
+    images = list(server.scene.render_color(cps, scoring_net.input_size))
+    # warm up, the first batch allocates the buffers of the model
+    scoring_net.forward(images)
+    start = time.perf_counter()
+    for _ in range(num_batches):
+        scoring_net.forward(images)
+    seconds = time.perf_counter() - start
+    num_images = batch_size * num_batches
+    return {"images": num_images, "seconds": seconds, "threads": torch.get_num_threads(),
+            "rates": {"scoring_net_images_per_second": num_images / seconds}}
+
+
+def benchmark_explore(scoring_net: ScoringNet, api_client: RenderAPIClient, log_root: str, num_updates: int) -> Tuple[dict, str]:
+    log_path = f"{log_root}/world1_benchmark_nodes.jsonl"
+    # the node logger appends to the log of a previous run
+    if os.path.exists(log_path):
+        os.remove(log_path)
+    node_logger = FileNodeLogger(log_root, "benchmark", "world1")
+    runner = WorldExplorerRunner(scoring_net, factory.create_hoo_explorer(HOOConfig()), api_client, NullLogger(), node_logger)
+    runner.reset_nodes()
+    bbox = runner.calculate_bounding_box()
+    start = time.perf_counter()
+    for _ in range(num_updates):
+        runner.evaluate_leaf(bbox)
+    seconds = time.perf_counter() - start
+    result = {"nodes": runner.num_evaluated_nodes, "images": runner.num_rendered_images, "seconds": seconds,
+              "rates": {"explore_nodes_per_second": runner.num_evaluated_nodes / seconds, "explore_images_per_second": runner.num_rendered_images / seconds}}
+    return result, log_path
+
+
+def benchmark_grid_search(scoring_net: ScoringNet, api_client: RenderAPIClient, log_path: str, num_leaves: int, divider: int, num_batch: int) -> dict:
+    with open(log_path) as f:
+        nodes = [NodeViewModel.model_validate_json(line) for line in f]
+    leaves = sorted(nodes, key=lambda n: n.score, reverse=True)[:num_leaves]
+    lgs = LeafGridSearcher(scoring_net, factory.create_rollout(HOOConfig(), num_pos_diff=0), api_client, divider)
+    num_grid_nodes = 0
+    start = time.perf_counter()
+    for grid_nodes, _ in lgs.search(leaves, lambda n: n.bounds, num_batch=num_batch):
+        num_grid_nodes += len(grid_nodes)
+    seconds = time.perf_counter() - start
+    return {"leaves": len(leaves), "grid_nodes": num_grid_nodes, "seconds": seconds,
+            "rates": {"grid_search_leaves_per_minute": len(leaves) / seconds * 60}}
+
+
+def benchmark_tui_load(api_client: RenderAPIClient, log_path: str) -> dict:
+    from tools.panotree_explorer_tui import PanoTreeExplorerApp
+
+    app = PanoTreeExplorerApp(base_path=os.path.dirname(log_path), api_client=api_client, leaf_grid_searcher=None,
+                              explore_action=None, score_threshold=0.5, lower_size_bound=0.5)
+
+    async def load() -> float:
+        async with app.run_test():
+            api_client.request_reset_node()
+            start = time.perf_counter()
+            await asyncio.get_running_loop().run_in_executor(None, app.load_tree_from_log, log_path)
+            return time.perf_counter() - start
+
+    seconds = asyncio.run(load())
+    with open(log_path) as f:
+        num_nodes = sum(1 for _ in f)
+    return {"nodes": num_nodes, "seconds": seconds, "rates": {"tui_load_nodes_per_second": num_nodes / seconds}}
+
+
+def create_benchmark_scoring_net(args) -> ScoringNet:
+    if not args.random_weights:
+        return factory.create_scoring_net(args)
+    # the throughput does not depend on the weights, so the checkpoint is not needed
+    model = create_model(args.model, pretrained=False, num_classes=args.num_classes)
+    input_size = model.pretrained_cfg.get("input_size", (3, 224, 224))[-1]
+    return ScoringNet(model, torch.device(args.device), transforms.Compose([transforms.ToTensor()]), input_size=input_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="benchmark_perf.json", help="output performance summary")
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS), help=f"comma separated benchmarks to run, some of {BENCHMARKS}")
+    parser.add_argument("--endpoint_url", default=None, help="benchmark a running render server instead of the synthetic one")
+    parser.add_argument("--record_archive", default=None, help="record the responses of the render server into this directory")
+    parser.add_argument("--latency", type=float, default=0.0, help="delay of the synthetic server added to every request in seconds")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="bytes per second of the synthetic server (0: unlimited)")
+    parser.add_argument("--texture_size", type=int, default=224, help="texture size of the rendered images")
+    parser.add_argument("--hoo_steps", type=int, default=2000, help="number of HOO steps")
+    parser.add_argument("--render_batch", type=int, default=36, help="number of images per render request")
+    parser.add_argument("--render_requests", type=int, default=20, help="number of render requests")
+    parser.add_argument("--scoring_batch", type=int, default=21, help="number of images per inference")
+    parser.add_argument("--scoring_batches", type=int, default=10, help="number of inferences")
+    parser.add_argument("--explore_updates", type=int, default=50, help="number of explored nodes")
+    parser.add_argument("--grid_leaves", type=int, default=3, help="number of grid searched leaves")
+    parser.add_argument("--grid_divider", type=int, default=4, help="the coarse lattice has divider-2 points per axis")
+    parser.add_argument("--grid_batch", type=int, default=36, help="number of images per render request of the grid search")
+    parser.add_argument("--log_root", default=None, help="directory of the exploration log (default: a temporary directory)")
+    parser.add_argument("--random_weights", action="store_true", help="benchmark the scoring net with random weights instead of the checkpoint")
+    parser.add_argument("--seed", type=int, default=0)
+    add_scoring_net_params(parser)
+    parser.set_defaults(device="cpu")
+    args = parser.parse_args()
+    benchmarks = [b.strip() for b in args.benchmarks.split(",") if b.strip()]
+    unknown = set(benchmarks) - set(BENCHMARKS)
+    assert len(unknown) == 0, f"unknown benchmarks: {unknown}, expected some of {BENCHMARKS}"
+    assert "explore" in benchmarks or not {"grid_search", "tui_load"} & set(benchmarks), "grid_search and tui_load need the log of explore"
+
+    server = SyntheticRenderServer(latency=args.latency, bandwidth=args.bandwidth)
+    if args.endpoint_url is None:
+        server.start()
+    recorder = RenderArchiveWriter(args.record_archive) if args.record_archive else None
+    api_client = RenderAPIClient(args.endpoint_url or server.endpoint_url, recorder=recorder)
+    log_root = args.log_root or tempfile.mkdtemp(prefix="panotree_benchmark_")
+    tm = TimeMeasure.default()
+    tm.reset_all_avg()
+    try:
+        api_client.update_config(UpdateConfigRequest(rendererConfig=RendererConfig(textureSize=args.texture_size)))
+        bbox = api_client.request_calculate_world_bounding_box().bbox
+        scoring_net = create_benchmark_scoring_net(args) if {"scoring_net", "explore"} & set(benchmarks) else None
+        results: Dict[str, dict] = {}
+        log_path = None
+        start = time.perf_counter()
+        for name in BENCHMARKS:
+            if name not in benchmarks:
+                continue
+            print(f"[BENCH] {name}...", flush=True)
+            if name == "hoo":
+                results[name] = benchmark_hoo(bbox, args.hoo_steps, args.seed)
+            elif name == "render":
+                results[name] = benchmark_render(api_client, bbox, args.render_batch, args.render_requests, args.seed)
+            elif name == "scoring_net":
+                results[name] = benchmark_scoring_net(scoring_net, server, bbox, args.scoring_batch, args.scoring_batches, args.seed)
+            elif name == "explore":
+                results[name], log_path = benchmark_explore(scoring_net, api_client, log_root, args.explore_updates)
+            elif name == "grid_search":
+                results[name] = benchmark_grid_search(scoring_net, api_client, log_path, args.grid_leaves, args.grid_divider, args.grid_batch)
+            elif name == "tui_load":
+                results[name] = benchmark_tui_load(api_client, log_path)
+            for rate, value in results[name]["rates"].items():
+                print(f"[BENCH] {name}: {rate} {value:.2f} ({results[name]['seconds']:.2f}s)", flush=True)
+        wall_seconds = time.perf_counter() - start
+
+        summary = build_perf_summary("benchmark", "benchmark", {"args": dict(vars(args))}, wall_seconds, counts={},
+                                     server=server_info(api_client), tm=tm)
+        # each benchmark has its own duration, so the rates are not derived from the wall time
+        summary["throughput"] = {rate: value for result in results.values() for rate, value in result["rates"].items()}
+        summary["benchmarks"] = results
+        summary["environment"] = {"python": platform.python_version(), "torch": torch.__version__,
+                                  "platform": platform.platform(), "cpu_count": os.cpu_count(), "torch_threads": torch.get_num_threads(),
+                                  "latency": args.latency, "bandwidth": args.bandwidth}
+        write_perf_summary(args.output, summary)
+    finally:
+        if args.endpoint_url is None:
+            server.stop()
+        if recorder is not None:
+            recorder.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+合成した木の上で、配列による枝刈り (prune_tree) と NodeViewModel を再帰的に辿る枝刈りの時間を比較する
+Compare the array based pruning (prune_tree) against the recursive pruning over NodeViewModels on synthetic trees,
+and check that both cut the same nodes and merge the same photo scorings.
+The recursive pruning only runs up to --max_recursive_nodes nodes.
+
+usage: python -m tools.benchmark_tree_pruning --num_nodes 1000000 --samples_per_node 4
+"""
+import argparse
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from exploration.tree_pruning import prune_tree, rows_of
+from render_server.render_api_data import NodeViewModel, Vector3f
+
+
+def synthetic_tree(num_nodes: int, rng: np.random.Generator, root_size=(100.0, 20.0, 100.0)) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    ランダムな葉を二分割し続けて木を作る 子は親の最も長い辺を半分にする
+    Grow a tree by splitting random leaves, each child halves the longest side of its parent.
+    Returns:
+        branch ids, depths and sizes of the nodes, parents before children
+    """
+    branch_ids = np.zeros(num_nodes, dtype=np.int64)
+    depths = np.zeros(num_nodes, dtype=np.int64)
+    sizes = np.zeros((num_nodes, 3))
+    branch_ids[0], sizes[0] = 1, root_size
+    leaves = [0]
+    count = 1
+    while count + 2 <= num_nodes:
+        i = int(rng.integers(len(leaves)))
+        parent = leaves[i]
+        leaves[i] = leaves[-1]
+        leaves.pop()
+        size = sizes[parent].copy()
+        size[np.argmax(size)] /= 2
+        for bit in range(2):
+            branch_ids[count] = branch_ids[parent] << 1 | bit
+            depths[count] = depths[parent] + 1
+            sizes[count] = size
+            leaves.append(count)
+            count += 1
+    return branch_ids[:count], depths[:count], sizes[:count]
+
+
+def recursive_prune(root: NodeViewModel, lower_size_bound: float) -> Dict[str, int]:
+    """
+    TUI の従来の再帰的な枝刈り 切ったノードの部分木を切るたびに辿り直す
+    The former recursive pruning of the TUI, which walks the subtree below every cut again.
+    Returns:
+        number of merged photo scorings of each cut node
+    """
+    merged = {}
+
+    def traverse_and_prune(node: NodeViewModel):
+        children = node.children
+        if not any(any(e < lower_size_bound for e in child.size.elements) for child in children):
+            for child in children:
+                traverse_and_prune(child)
+            return
+
+        def collect_photo_scorings(node_1: NodeViewModel) -> List:
+            ret = list(node_1.photoScorings)
+            for child_1 in node_1.children:
+                ret.extend(collect_photo_scorings(child_1))
+            return ret
+
+        node.photoScorings = collect_photo_scorings(node)
+        node.child_left = None
+        node.child_right = None
+        merged[node.id] = len(node.photoScorings)
+
+    traverse_and_prune(root)
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num_nodes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--samples_per_node", type=int, default=4)
+    parser.add_argument("--lower_size_bound", type=float, default=2.0)
+    parser.add_argument("--max_recursive_nodes", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    sys.setrecursionlimit(100000)
+
+    for num_nodes in args.num_nodes:
+        rng = np.random.default_rng(args.seed)
+        branch_ids, depths, sizes = synthetic_tree(num_nodes, rng)
+        sample_branch_ids = np.repeat(branch_ids, args.samples_per_node)
+        sample_scores = rng.random(len(sample_branch_ids))
+
+        start = time.perf_counter()
+        pruned = prune_tree(branch_ids, depths, sizes, args.lower_size_bound,
+                            sample_rows=rows_of(branch_ids, sample_branch_ids), sample_scores=sample_scores)
+        array_seconds = time.perf_counter() - start
+        line = (f"{len(branch_ids):8d} nodes, max depth {depths.max():3d}, {len(sample_scores):9d} samples, "
+                f"{np.count_nonzero(pruned.cut):7d} cuts: prune_tree {array_seconds:7.3f}s")
+
+        if len(branch_ids) <= args.max_recursive_nodes:
+            # photo scorings are stood in for by their sample indices, only their number is compared
+            nodes = [NodeViewModel.model_construct(id=f"{d:04}-{b:08}", branchId=int(b), parentId=f"{d - 1:04}-{b >> 1:08}" if d > 0 else None,
+                                                   depth=int(d), min=Vector3f(), max=Vector3f.from_array(s),
+                                                   score=0.0, b=None, photoScorings=list(range(i * args.samples_per_node, (i + 1) * args.samples_per_node)),
+                                                   leafGridNodes=None, child_left=None, child_right=None)
+                     for i, (b, d, s) in enumerate(zip(branch_ids.tolist(), depths.tolist(), sizes.tolist()))]
+            root = NodeViewModel.create_tree(iter(nodes))
+            start = time.perf_counter()
+            merged = recursive_prune(root, args.lower_size_bound)
+            recursive_seconds = time.perf_counter() - start
+            same = merged == {nodes[r].id: int(pruned.num_samples[r]) for r in np.flatnonzero(pruned.cut)}
+            line += f", recursive {recursive_seconds:7.3f}s ({recursive_seconds / array_seconds:5.1f}x), same result: {same}"
+        print(line, flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+ワールドを位置の格子とフィボナッチ方向の集合で1度だけレンダリングしてスコア付けし、スコアボリューム (exploration.score_volume) に保存する
+保存したボリュームに対して tools.benchmark_hoo --volume で HOO のパラメータをレンダラーなしで探索できる
+中断した場合は同じ出力先を指定すると続きから再開する
+Render and score a world once on a position lattice times a fibonacci direction set, and store the scores
+as a score volume (exploration.score_volume). HOO parameters can then be swept on the volume without a renderer
+with tools.benchmark_hoo --volume. An interrupted build is resumed when it is run again with the same output.
+
+usage: python -m tools.build_score_volume --volume_output output/score_volume --volume_dims 21 6 21 --num_local_dir 21
+"""
+import time
+from dataclasses import dataclass, field
+from typing import List
+
+import numpy as np
+import torch
+
+from data.explorer_data import HOOConfig, RenderAPIConfig
+from exploration.algorithm import generate_list_dir
+from exploration.score_volume import ScoreVolume
+from render_server import factory
+from render_server.render_api_data import CameraParameter, RenderSceneRequest, Vector3f
+from render_server.scoring_net_params import add_scoring_net_params
+from util.hf_argparser import HfArgumentParser
+
+
+@dataclass
+class ScoreVolumeConfig:
+    _argument_group_name = "Score Volume Parameters"
+    volume_output: str = field(default="./output/score_volume", metadata={"help": "directory of the score volume, an incomplete volume is resumed"})
+    volume_dims: List[int] = field(default_factory=lambda: [21, 6, 21], metadata={"help": "number of lattice points along x, y and z"})
+    volume_batch: int = field(default=144, metadata={"help": "number of images per render request"})
+
+
+def main():
+    parser = HfArgumentParser((ScoreVolumeConfig, HOOConfig, RenderAPIConfig))
+    add_scoring_net_params(parser)
+    volume_conf, hoo_conf, api_client_conf, args = parser.parse_args_into_dataclasses(return_remaining_strings=False)
+    assert len(volume_conf.volume_dims) == 3, "give the number of lattice points along x, y and z"
+
+    api_client = factory.create_render_api_client(api_client_conf)
+    directions = np.array(generate_list_dir(hoo_conf.num_local_dir))
+    try:
+        volume = ScoreVolume(volume_conf.volume_output, mode="r+")
+        assert list(volume.dims) == volume_conf.volume_dims and len(volume.directions) == len(directions), \
+            f"{volume_conf.volume_output} has other dims or directions, remove it or choose another output"
+        print(f"resuming {volume_conf.volume_output} from {volume.num_completed}/{volume.num_points} points", flush=True)
+    except FileNotFoundError:
+        bbox = api_client.request_calculate_world_bounding_box().bbox
+        volume = ScoreVolume.create(volume_conf.volume_output, (bbox.min.x, bbox.min.y, bbox.min.z), (bbox.max.x, bbox.max.y, bbox.max.z),
+                                    tuple(volume_conf.volume_dims), directions)
+    scoring_net = factory.create_scoring_net(args)
+
+    positions = volume.lattice_positions()
+    points_per_batch = max(volume_conf.volume_batch // len(directions), 1)
+    start = time.perf_counter()
+    first = volume.num_completed
+    for i in range(first, volume.num_points, points_per_batch):
+        batch_positions = positions[i:i + points_per_batch]
+        camera_parameters = [CameraParameter(position=Vector3f.from_array(p), direction=Vector3f.from_array(d))
+                             for p in batch_positions for d in directions]
+        images = api_client.request_render(RenderSceneRequest(cameraParameters=camera_parameters))
+        with torch.no_grad():
+            scores = scoring_net.forward(images).cpu().numpy()
+        volume.write(i, scores.reshape(len(batch_positions), len(directions)))
+        done = i + len(batch_positions)
+        elapsed = time.perf_counter() - start
+        eta = elapsed / (done - first) * (volume.num_points - done)
+        print(f"{done}/{volume.num_points} points, {elapsed:.0f}s elapsed, {eta:.0f}s left", flush=True)
+    print(f"score volume {volume.dims} x {len(directions)} directions in {volume_conf.volume_output}, best score {volume.optimum:.4f}")
+
+
+if __name__ == "__main__":
+    main()
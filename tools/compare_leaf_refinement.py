@@ -0,0 +1,103 @@
+"""
+探索ログのスコアの高いリーフに対して、LeafGridSearcher と LocalPoseOptimizer をそれぞれ実行し、
+レンダリング数に対する最良スコアを比較する
+Run LeafGridSearcher and LocalPoseOptimizer on the best leaves of an exploration log,
+and compare the best score found against the number of renders.
+
+usage: python -m tools.compare_leaf_refinement --log_file output/exploration_log/<session>/explore.jsonl --num_leaves 5
+"""
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+import numpy as np
+
+from data.explorer_data import HOOConfig, RenderAPIConfig, LeafGridSearchConfig, DirectionSearchConfig, PoseRefinementConfig
+from render_server import factory
+from render_server.leaf_grid_searcher import LeafGridSearcher
+from render_server.logger import open_node_log
+from render_server.render_api_data import NodeViewModel
+from render_server.scoring_net_params import add_scoring_net_params
+from util.hf_argparser import HfArgumentParser
+
+
+@dataclass
+class CompareConfig:
+    _argument_group_name = "Comparison Parameters"
+    log_file: str = field(default="", metadata={"help": "exploration log (jsonl) to take the leaves from"})
+    num_leaves: int = field(default=5, metadata={"help": "number of the best leaves to refine"})
+
+
+def load_leaves(log_file: str, num_leaves: int) -> List[NodeViewModel]:
+    with open_node_log(log_file) as f:
+        root = NodeViewModel.create_tree(NodeViewModel.model_validate_json(line) for line in f if line.strip())
+    leaves: List[NodeViewModel] = []
+
+    def collect(node: NodeViewModel):
+        if len(node.children) == 0 and len(node.photoScorings) > 0:
+            leaves.append(node)
+        return True
+
+    root.traverse(collect)
+    return sorted(leaves, key=lambda n: -n.score)[:num_leaves]
+
+
+def grid_search_history(lgs: LeafGridSearcher, node: NodeViewModel) -> List[Tuple[int, float]]:
+    """
+    Returns:
+        (number of renders, best score so far) in the order the grid points are evaluated
+    """
+    history = []
+    num_renders, best = 0, -np.inf
+    for grid_nodes, _ in lgs.search([node], lambda n: n.bounds):
+        for grid_node in grid_nodes:
+            num_renders += len(grid_node.photo_scorings)
+            best = max([best] + [ps.score for ps in grid_node.photo_scorings])
+            history.append((num_renders, best))
+    return history
+
+
+def best_at(history: List[Tuple[int, float]], num_renders: int) -> float:
+    scores = [score for n, score in history if n <= num_renders]
+    return scores[-1] if len(scores) > 0 else float("nan")
+
+
+def main():
+    parser = HfArgumentParser((CompareConfig, HOOConfig, RenderAPIConfig, LeafGridSearchConfig, DirectionSearchConfig, PoseRefinementConfig))
+    add_scoring_net_params(parser)
+    compare_conf, hoo_conf, api_client_conf, grid_conf, direction_conf, refine_conf, args = parser.parse_args_into_dataclasses(return_remaining_strings=False)
+
+    scoring_net = factory.create_scoring_net(args)
+    api_client = factory.create_render_api_client(api_client_conf)
+    lgs = LeafGridSearcher(scoring_net, factory.create_rollout(hoo_conf, direction_conf, num_pos_diff=0), api_client, grid_conf.grid_divider,
+                           max_depth=grid_conf.grid_max_depth,
+                           margin=grid_conf.grid_margin,
+                           render_budget=grid_conf.grid_render_budget)
+    optimizer = factory.create_pose_optimizer(refine_conf, scoring_net, api_client, seed=hoo_conf.seed)
+
+    grid_histories, refine_histories = [], []
+    for node in load_leaves(compare_conf.log_file, compare_conf.num_leaves):
+        stored_best = max(ps.score for ps in node.photoScorings)
+        grid_history = grid_search_history(lgs, node)
+        result = optimizer.refine(node)
+        grid_histories.append(grid_history)
+        refine_histories.append(result.history)
+        print(f"{node.id}: stored {stored_best:.4f}, "
+              f"grid search {grid_history[-1][1]:.4f} ({grid_history[-1][0]} renders), "
+              f"pose refinement {result.best.score:.4f} ({result.num_renders} renders)", flush=True)
+
+    if len(grid_histories) == 0:
+        print("no leaf with photospots found")
+        return
+
+    max_renders = max(h[-1][0] for h in grid_histories + refine_histories)
+    checkpoints = sorted({max(1, int(max_renders * r)) for r in (0.05, 0.1, 0.25, 0.5, 0.75, 1.0)})
+    print(f"mean best score over {len(grid_histories)} leaves")
+    print(f"{'renders':>8} {'grid search':>14} {'pose refinement':>16}")
+    for n in checkpoints:
+        grid = np.nanmean([best_at(h, n) for h in grid_histories])
+        refine = np.nanmean([best_at(h, n) for h in refine_histories])
+        print(f"{n:8} {grid:14.4f} {refine:16.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+探索やグリッドサーチの性能の要約 (*_perf.json) を比較し、閾値を超えて悪化した指標を示す
+最初の要約を基準とし、残りの要約をそれぞれ基準と比較する 悪化があった場合は終了コード1で終わる
+Compare the performance summaries (*_perf.json) of explorations or grid searches,
+and flag the metrics which got worse beyond a threshold.
+The first summary is the baseline, every other summary is compared against it.
+The exit code is 1 when a regression is found.
+
+usage: python -m tools.compare_perf BASE_perf.json NEW_perf.json [NEW2_perf.json ...] --threshold 0.1
+"""
+import argparse
+import sys
+
+from render_server.perf_summary import load_perf_summary, compare_perf_summaries, config_differences
+
+
+def format_value(key: str, value: float) -> str:
+    if key.endswith("bytes"):
+        return f"{value / 2 ** 20:.1f}MiB"
+    if key.endswith("bytes_per_second"):
+        return f"{value / 2 ** 20:.2f}MiB/s"
+    return f"{value:.4g}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("summaries", nargs="+", help="performance summaries, the first one is the baseline")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change in the worse direction flagged as a regression")
+    parser.add_argument("--min_count", type=int, default=5, help="stages measured fewer times are not compared")
+    parser.add_argument("--all", action="store_true", help="show every compared metric, not only the changes beyond the threshold")
+    args = parser.parse_args()
+    assert len(args.summaries) >= 2, "give at least two summaries"
+
+    base = load_perf_summary(args.summaries[0])
+    num_regressions = 0
+    for path in args.summaries[1:]:
+        other = load_perf_summary(path)
+        print(f"{args.summaries[0]} -> {path}")
+        for key, b, o in config_differences(base, other):
+            print(f"  config  {key}: {b} -> {o}")
+        for key, b, o, change, regression in compare_perf_summaries(base, other, args.threshold, args.min_count):
+            if not args.all and abs(change) <= args.threshold:
+                continue
+            mark = "REGRESSION" if regression else "ok"
+            print(f"  {mark:10} {key}: {format_value(key, b)} -> {format_value(key, o)} ({change:+.1%})")
+            num_regressions += int(regression)
+    print(f"{num_regressions} regressions beyond {args.threshold:.0%}")
+    sys.exit(1 if num_regressions > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
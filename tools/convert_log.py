@@ -0,0 +1,35 @@
+"""
+JSONLの探索ログを、メモリマップで読み込める列指向のログ (.plog) に変換する
+Convert JSONL exploration logs into columnar logs (.plog), which the TUI and the tools load memory-mapped.
+
+usage: python -m tools.convert_log LOG.jsonl [LOG2.jsonl.gz ...] --num_dir 21
+"""
+import argparse
+import os
+import time
+
+from render_server.columnar_log import convert_to_columnar, ColumnarLog
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="exploration logs (.jsonl or .jsonl.gz)")
+    parser.add_argument("--num_dir", type=int, default=21, help="num_local_dir of the exploration, the size of the direction table")
+    parser.add_argument("--num_workers", type=int, default=0, help="number of processes (0: number of CPUs)")
+    parser.add_argument("--chunk_mb", type=int, default=64, help="size of the byte ranges encoded in parallel")
+    args = parser.parse_args()
+
+    for path in args.inputs:
+        output_path = path.removesuffix(".gz").removesuffix(".jsonl") + ".plog"
+        start = time.perf_counter()
+        convert_to_columnar(path, output_path, table_size=args.num_dir, num_workers=args.num_workers, chunk_size=args.chunk_mb << 20)
+        converted = time.perf_counter()
+        log = ColumnarLog(output_path)
+        loaded = time.perf_counter()
+        print(f"{path} -> {output_path}: {len(log)} nodes, {log.num_samples} samples, "
+              f"{os.path.getsize(path) / 2 ** 20:.1f}MB -> {os.path.getsize(output_path) / 2 ** 20:.1f}MB "
+              f"(convert {converted - start:.2f}s, load {(loaded - converted) * 1000:.1f}ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+探索ログやグリッドサーチの結果から、位置と方向の近い重複を除いた上位N個の撮影スポットを抽出する
+Extract the top-N distinct photospots from exploration logs and grid search outputs,
+with non-max suppression over the camera position and direction.
+With an embedding cache, photospots which look alike are also removed by the cosine similarity of their embeddings.
+
+usage: python -m tools.extract_photospots LOG.jsonl [LOG_grid_search.jsonl ...] --top_n 50 --min_distance 2 --min_angle 30 --output photospots.jsonl
+       python -m tools.extract_photospots rescored.npz --embedding_dir LOG_ROOT/explore_XXX_embeddings --max_similarity 0.95
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from exploration.photospots import non_max_suppression, remove_near_duplicates
+from render_server.embedding_store import EmbeddingStore
+from render_server.sample_index_loader import load_sample_index_arrays, concat_sample_indices
+
+
+def load_arrays(path: str):
+    if not path.endswith(".npz"):
+        return load_sample_index_arrays(path)
+    # the output of tools.rescore_embeddings, without the HOO nodes
+    data = np.load(path)
+    n = len(data["scores"])
+    return data["positions"], data["directions"], data["scores"], np.ones(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="exploration logs, _grid_search.jsonl files or npz files of tools.rescore_embeddings")
+    parser.add_argument("--top_n", type=int, default=50, help="number of photospots to extract")
+    parser.add_argument("--min_distance", type=float, default=2.0, help="photospots closer than this distance in meters ...")
+    parser.add_argument("--min_angle", type=float, default=30.0, help="... and facing within this angle in degrees are duplicates (180: position only)")
+    parser.add_argument("--embedding_dir", default=None, help="embedding cache to remove the photospots which look alike")
+    parser.add_argument("--max_similarity", type=float, default=0.95, help="photospots whose embeddings are at least this cosine similar are duplicates")
+    parser.add_argument("--dedup_pool", type=int, default=4, help="top_n times this many photospots are deduplicated by their embeddings")
+    parser.add_argument("--output", default="photospots.jsonl", help="output file, .jsonl or .npz")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = concat_sample_indices([load_arrays(path) for path in args.inputs])
+    loaded = time.perf_counter()
+    if args.embedding_dir is None:
+        spots = non_max_suppression(index, args.top_n, args.min_distance, args.min_angle)
+    else:
+        spots = non_max_suppression(index, args.top_n * args.dedup_pool, args.min_distance, args.min_angle)
+        store = EmbeddingStore(args.embedding_dir)
+        rows = store.lookup(index.positions[spots], index.directions[spots])
+        # the photospots without an embedding cannot be compared and are dropped
+        spots, rows = spots[rows >= 0], rows[rows >= 0]
+        kept = remove_near_duplicates(store.embeddings[rows], index.scores[spots], args.max_similarity)
+        spots = spots[kept][:args.top_n]
+    extracted = time.perf_counter()
+
+    if args.output.endswith(".npz"):
+        np.savez_compressed(args.output,
+                            positions=index.positions[spots], directions=index.directions[spots], scores=index.scores[spots],
+                            branch_ids=index.branch_ids[spots], depths=index.depths[spots])
+    else:
+        with open(args.output, "w") as f:
+            for rank, i in enumerate(spots):
+                f.write(json.dumps({"rank": rank, "score": round(float(index.scores[i]), 5),
+                                    "position": np.round(index.positions[i], 3).tolist(),
+                                    "direction": np.round(index.directions[i].astype(np.float64), 4).tolist(),
+                                    "branchId": int(index.branch_ids[i]), "depth": int(index.depths[i])}) + "\n")
+    print(f"{len(spots)} photospots out of {len(index)} samples written to {args.output} "
+          f"(load {loaded - start:.2f}s, suppression {extracted - loaded:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,21 @@
-import os
 import threading
 from typing import List, Optional, Callable
 
+import numpy as np
 from textual.app import App, ComposeResult
 from textual.containers import Container
 from textual.reactive import var
 from textual.widgets import DirectoryTree, Footer, Header, RichLog, Label, Static, ProgressBar
 
-from render_server.leaf_grid_searcher import LeafGridSearcher
+from exploration.spatial_index import SampleIndex
+from render_server.columnar_log import ColumnarLog
+from render_server.leaf_grid_searcher import LeafGridSearcher, run_grid_search
+from render_server.live_metrics import LiveMetrics, MetricsSnapshot
+from render_server.logger import open_node_log
+from render_server.node_uploader import NodeUploader
 from render_server.render_api_client import RenderAPIClient
-from render_server.render_api_data import NodeViewModel, UpdateNodesRequest, PhotoScoring, CustomJsonEncoder, LeafGridNode
+from render_server.render_api_data import NodeViewModel, PhotoScoring
+from render_server.sample_index_loader import build_sample_index, prune_node_leaves
 
 
 class PanoTreeExplorerApp(App):
@@ -33,16 +39,34 @@ class PanoTreeExplorerApp(App):
                  explore_action: Callable[[ProgressBar, Label], None],
                  score_threshold: float,
                  lower_size_bound: float,
+                 node_uploader: Optional[NodeUploader] = None,
+                 live_metrics: Optional[LiveMetrics] = None,
+                 metrics_interval: float = 1.0,
+                 run_config: Optional[dict] = None,
                  **kwargs):
         super().__init__(**kwargs)
         self._base_path = base_path
         self._api_client = api_client
+        self._node_uploader = node_uploader if node_uploader is not None else NodeUploader(api_client)
         self._leaf_grid_searcher = leaf_grid_searcher
         self._score_threshold = score_threshold
         self._explore_action = explore_action
         self._lower_size_bound = lower_size_bound  # in meters
         self._root_node: Optional[NodeViewModel] = None
+        # every node of the loaded log which is not below a pruned node, and the index over their samples
+        self._log_nodes: List[NodeViewModel] = []
+        self._sample_index: Optional[SampleIndex] = None
+        # the photo scorings of the nodes loaded from a columnar log are read from it when the nodes are uploaded
+        self._columnar_log: Optional[ColumnarLog] = None
         self._log_file_path: Optional[str] = None
+        # the metrics panel is refreshed on a timer from snapshots, the exploration thread never touches the widget
+        self._live_metrics = live_metrics
+        self._metrics_interval = metrics_interval
+        self._last_metrics: Optional[MetricsSnapshot] = None
+        # written to the performance summary of the grid search
+        self._run_config = run_config or {}
+        # joined on exit, the exploration may still be writing to the session when the app is closed
+        self._explore_thread: Optional[threading.Thread] = None
 
     def watch_show_tree(self, show_tree: bool) -> None:
         """Called when show_tree is modified."""
@@ -66,6 +90,9 @@ class PanoTreeExplorerApp(App):
                 yield DirectoryTree(path, id="tree-view")
                 yield ProgressBar(id="progress-bar", show_percentage=True)
             with Container(id="right-pane"):
+                if self._live_metrics is not None:
+                    yield Static("Metrics", classes="header")
+                    yield Static(id="metrics")
                 yield Static("Log", classes="header")
                 yield RichLog(id="log")
         yield Label(id="status-label", renderable="Press E to explore.")
@@ -73,6 +100,14 @@ class PanoTreeExplorerApp(App):
 
     def on_mount(self) -> None:
         self.query_one(DirectoryTree).focus()
+        if self._live_metrics is not None:
+            self._refresh_metrics()
+            self.set_interval(self._metrics_interval, self._refresh_metrics)
+
+    def _refresh_metrics(self):
+        snapshot = self._live_metrics.snapshot()
+        self.query_one("#metrics", Static).update(LiveMetrics.format(self._last_metrics, snapshot))
+        self._last_metrics = snapshot
 
     def on_directory_tree_file_selected(
             self, event: DirectoryTree.FileSelected
@@ -82,7 +117,7 @@ class PanoTreeExplorerApp(App):
         log_file_path = event.path
         self._log_file_path = log_file_path
 
-        if not log_file_path.is_file() or not str(log_file_path).endswith(".jsonl"):
+        if not log_file_path.is_file() or not str(log_file_path).endswith((".jsonl", ".jsonl.gz", ".plog")):
             return
         self._load_log(str(log_file_path))
 
@@ -100,7 +135,11 @@ class PanoTreeExplorerApp(App):
         progress = self.query_one(ProgressBar)
         status_label = self.query_one("#status-label", Label)
         self.show_progress = True
-        with open(log_file_path) as f:
+        if log_file_path.endswith(".plog"):
+            self._load_columnar_log(log_file_path)
+            return
+        self._columnar_log = None
+        with open_node_log(log_file_path) as f:
             def generator():
                 line_counter = 0
                 while True:
@@ -115,12 +154,17 @@ class PanoTreeExplorerApp(App):
 
             status_label.update(f"loading tree {log_file_path}...")
             rich_log.write(f"loading tree {log_file_path}...")
-            self._root_node = NodeViewModel.create_tree(generator())
+            nodes = list(generator())
+            self._root_node = NodeViewModel.create_tree(iter(nodes))
+            self._log_nodes = nodes
+            status_label.update(f"indexing {log_file_path}...")
+            self._sample_index = build_sample_index(nodes)
+            rich_log.write(f"indexed {len(self._sample_index)} photo scorings.")
 
             progress.progress = 0
             status_label.update(f"pruning tree {log_file_path}...")
             rich_log.write(f"pruning tree {log_file_path}...")
-            self._prune_node_leaf(self._root_node)
+            self._prune_node_leaf()
             status_label.update(f"uploading nodes...")
             self._upload_node(self._root_node, True)
 
@@ -129,46 +173,81 @@ class PanoTreeExplorerApp(App):
         self.gui_enabled = True
         self.show_progress = False
 
+    def _load_columnar_log(self, log_file_path: str):
+        rich_log = self.query_one(RichLog)
+        progress = self.query_one(ProgressBar)
+        status_label = self.query_one("#status-label", Label)
+
+        status_label.update(f"loading tree {log_file_path}...")
+        rich_log.write(f"loading tree {log_file_path}...")
+        log = ColumnarLog(log_file_path)
+        progress.total = len(log)
+        nodes = []
+        for node in log.node_view_models(with_photo_scorings=False):
+            nodes.append(node)
+            if len(nodes) % 10000 == 0:
+                status_label.update(f"loading tree... {len(nodes):08} nodes.")
+                progress.advance(10000)
+        self._columnar_log = log
+        self._root_node = NodeViewModel.create_tree(iter(nodes))
+        self._log_nodes = nodes
+        self._sample_index = SampleIndex(*log.sample_index_arrays())
+        rich_log.write(f"indexed {len(self._sample_index)} photo scorings.")
+
+        progress.progress = 0
+        status_label.update(f"pruning tree {log_file_path}...")
+        rich_log.write(f"pruning tree {log_file_path}...")
+        self._prune_node_leaf()
+        status_label.update(f"uploading nodes...")
+        self._upload_node(self._root_node, True)
+
+        status_label.update(f"Ready.")
+        rich_log.write(f"Done.")
+        self.gui_enabled = True
+        self.show_progress = False
+
     def _upload_node(self, root_node: NodeViewModel, recursive: bool):
-        def upload_to_server(node: NodeViewModel):
-            t_node = node.copy_without_children()
-            self._api_client.request_update_nodes(UpdateNodesRequest(nodes=[t_node]))
-            return True
+        nodes = []
 
-        if recursive:
-            root_node.traverse(upload_to_server)
-        else:
-            upload_to_server(root_node)
+        def collect(node: NodeViewModel):
+            nodes.append(node)
+            return recursive
 
-    def _prune_node_leaf(self, root: NodeViewModel):
-        rich_log = self.query_one(RichLog)
+        root_node.traverse(collect)
 
-        def traverse_and_prune(node: NodeViewModel):
-            children = node.children
-            reached_lower_bound = False
-            for child in children:
-                # if any of the children has a size that is smaller than the lower bound, we stop traversing
-                reached_lower_bound |= any([e < self._lower_size_bound for e in child.size.elements])
+        def photo_scorings(node: NodeViewModel) -> Optional[List[PhotoScoring]]:
+            if self._columnar_log is not None and len(node.photoScorings) == 0:
+                return self._columnar_log.photo_scorings(self._columnar_log.row(node.id))
+            return None
 
-            if not reached_lower_bound:
-                for child in children:
-                    traverse_and_prune(child)
-                return
+        if not recursive:
+            self._node_uploader.upload(nodes, photo_scorings)
+            return
 
-            def collect_photo_scorings(node_1: NodeViewModel) -> List[PhotoScoring]:
-                ret = []
-                if node_1.photoScorings is not None:
-                    ret.extend(node.photoScorings)
-                for child_1 in node_1.children:
-                    ret.extend(collect_photo_scorings(child_1))
-                return ret
+        rich_log = self.query_one(RichLog)
+        progress = self.query_one(ProgressBar)
+        status_label = self.query_one("#status-label", Label)
+        progress.update(total=len(nodes), progress=0)
+
+        def on_progress(num_sent: int, num_coarse: int, num_nodes: int):
+            progress.update(progress=num_sent)
+            status_label.update(f"uploading nodes... {num_sent:08}/{num_nodes:08}")
+            if num_sent == num_coarse:
+                rich_log.write(f"uploaded the coarse level: {num_coarse} nodes.")
 
-            node.photoScorings = collect_photo_scorings(node)
-            node.child_left = None
-            node.child_right = None
-            rich_log.write(f"lower bound reached: {node.id}, size: {child.size.elements}, photo count: {len(node.photoScorings)}")
+        self._node_uploader.upload(nodes, photo_scorings, on_progress)
+        rich_log.write(f"uploaded {len(nodes)} nodes.")
 
-        traverse_and_prune(root)
+    def _prune_node_leaf(self):
+        rich_log = self.query_one(RichLog)
+        nodes = self._log_nodes
+        # the nodes of a columnar log are in the order of its rows
+        columns = self._columnar_log.arrays if self._columnar_log is not None else None
+        self._log_nodes, pruned = prune_node_leaves(nodes, self._sample_index, self._lower_size_bound, columns)
+        for row in np.flatnonzero(pruned.cut):
+            node = nodes[row]
+            rich_log.write(f"lower bound reached: {node.id}, size: {node.size.elements}, photo count: {len(node.photoScorings)}, "
+                           f"best score: {pruned.best_score[row]:.4f}")
 
     def _explore(self):
         try:
@@ -184,8 +263,10 @@ class PanoTreeExplorerApp(App):
             rich_log.write("Done.")
             status_label.update(f"Ready.")
         finally:
-            self.gui_enabled = True
-            self.show_progress = False
+            # the widgets are gone when the app was quit while exploring
+            if self.is_running:
+                self.gui_enabled = True
+                self.show_progress = False
 
     def _warn_disabled_action(self):
         rich_log = self.query_one(RichLog)
@@ -196,8 +277,16 @@ class PanoTreeExplorerApp(App):
             self._warn_disabled_action()
             return
 
-        t1 = threading.Thread(target=self._explore)
-        t1.start()
+        self._explore_thread = threading.Thread(target=self._explore)
+        self._explore_thread.start()
+
+    def join_explore(self):
+        """
+        実行中の探索の終了を待つ アプリの終了後、セッションを閉じる前に呼ぶ
+        Wait for the running exploration to finish. Called after the app exits and before the session is closed.
+        """
+        if self._explore_thread is not None:
+            self._explore_thread.join()
 
     def action_grid_search(self):
         if not self.gui_enabled:
@@ -216,35 +305,21 @@ class PanoTreeExplorerApp(App):
 
             rich_log.write("Performing grid search...")
             status_label.update(f"Performing grid search...")
-            lgs = self._leaf_grid_searcher
-            node_list: List[NodeViewModel] = []
-
-            def collect_nodes(node: NodeViewModel):
-                if node.score >= self._score_threshold:
-                    node_list.append(node)
-                return True
 
-            self._root_node.traverse(collect_nodes)
+            num_nodes = sum(n.score >= self._score_threshold for n in self._log_nodes)
 
             def on_progress(i, node):
-                status_label.update(f"Grid search: {node.id} {i}/{len(node_list)}")
+                status_label.update(f"Grid search: {node.id} {i}/{num_nodes}")
 
-            out_file_path = str(self._log_file_path).replace(".jsonl", "_grid_search.jsonl")
-            if os.path.exists(out_file_path):
-                os.remove(out_file_path)
-            for grid_nodes, node in lgs.search(node_list, lambda n: n.bounds, on_progress, rich_log=rich_log):
+            def on_node(node: NodeViewModel):
                 status_label.update(f"Evaluating node {node.id}...")
-                rich_log.write(f"node: {node.id}, num grid nodes: {len(grid_nodes)}")
-
-                leaf_grids = []
-                for gn in grid_nodes:
-                    gid = f"{node.id} {gn.id}"
-                    leaf_grid = LeafGridNode(gridId=gid, nodeId=node.id, position=gn.position, photoScorings=gn.photo_scorings)
-                    leaf_grids.append(leaf_grid)
-                node.leafGridNodes = leaf_grids
+                rich_log.write(f"node: {node.id}, num grid nodes: {len(node.leafGridNodes)}")
                 self._upload_node(node, False)
-                with open(out_file_path, "a") as f:
-                    f.write(CustomJsonEncoder().encode(node) + "\n")
+
+            out_file_path = str(self._log_file_path).removesuffix(".gz").removesuffix(".plog").removesuffix(".jsonl") + "_grid_search.jsonl"
+            result = run_grid_search(self._leaf_grid_searcher, self._log_nodes, self._score_threshold, out_file_path, self._run_config,
+                                     sample_index=self._sample_index, on_progress=on_progress, on_node=on_node, rich_log=rich_log)
+            rich_log.write(f"performance summary: {result['perf_path']}")
             status_label.update(f"Grid search done.")
             self.gui_enabled = True
 
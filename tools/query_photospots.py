@@ -0,0 +1,56 @@
+"""
+探索ログから撮影スポットを空間インデックスで検索し、jsonlで出力する
+Query the photospots of an exploration log through the spatial sample index, and print them as jsonl.
+
+usage:
+    python -m tools.query_photospots LOG.jsonl top --k 20
+    python -m tools.query_photospots LOG.jsonl radius --center 0 1.5 0 --radius 3 --k 10
+    python -m tools.query_photospots LOG.jsonl bounds --min -5 0 -5 --max 5 3 5 --k 10
+    python -m tools.query_photospots LOG.jsonl regions --min -50 0 -50 --max 50 10 50 --cell_size 5 --k 30
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from render_server.sample_index_loader import load_sample_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log_file", help="exploration log (jsonl)")
+    parser.add_argument("query", choices=["top", "radius", "bounds", "regions"])
+    parser.add_argument("--k", type=int, default=10, help="maximum number of photospots to print")
+    parser.add_argument("--center", type=float, nargs=3)
+    parser.add_argument("--radius", type=float, default=1.0)
+    parser.add_argument("--min", type=float, nargs=3)
+    parser.add_argument("--max", type=float, nargs=3)
+    parser.add_argument("--cell_size", type=float, default=5.0, help="region size of the regions query in meters")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = load_sample_index(args.log_file)
+    loaded = time.perf_counter()
+
+    if args.query == "top":
+        indices = index.top_k(args.k)
+    elif args.query == "radius":
+        indices = index.top_k(args.k, index.within_radius(args.center, args.radius))
+    elif args.query == "bounds":
+        indices = index.top_k(args.k, index.within_bounds(args.min, args.max))
+    else:
+        _, indices = index.best_per_region(args.min, args.max, args.cell_size)
+        indices = indices[:args.k]
+    queried = time.perf_counter()
+
+    for i in indices:
+        print(json.dumps({"score": float(index.scores[i]),
+                          "position": np.round(index.positions[i], 4).tolist(),
+                          "direction": np.round(index.directions[i].astype(np.float64), 4).tolist(),
+                          "branchId": int(index.branch_ids[i]), "depth": int(index.depths[i])}))
+    print(f"# {len(index)} samples, load {loaded - start:.3f}s, query {(queried - loaded) * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
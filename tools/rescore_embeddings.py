@@ -0,0 +1,48 @@
+"""
+埋め込みキャッシュのスコアを、分類ヘッドのみを実行して新しいチェックポイントで再計算する
+Rescore the embedding cache of an exploration with a new checkpoint by running the classifier head only,
+without rendering the world or running the backbone again.
+The checkpoint must share the backbone of the one the embeddings were stored with.
+
+usage: python -m tools.rescore_embeddings --embedding_dir LOG_ROOT/explore_XXX_embeddings --output rescored.npz --checkpoint new.pth.tar
+The output can be passed to tools.extract_photospots.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from render_server import factory
+from render_server.embedding_store import EmbeddingStore
+from render_server.scoring_net_params import add_scoring_net_params
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embedding_dir", required=True, help="directory of the embedding cache")
+    parser.add_argument("--output", default="rescored.npz", help="output npz of the poses and the new scores")
+    parser.add_argument("--chunk_size", type=int, default=65536, help="number of embeddings scored at once")
+    add_scoring_net_params(parser)
+    args = parser.parse_args()
+
+    store = EmbeddingStore(args.embedding_dir)
+    scoring_net = factory.create_scoring_net(args)
+    assert scoring_net.supports_embeddings, f"{args.model} cannot score embeddings with the head only"
+
+    start = time.perf_counter()
+    embeddings = store.embeddings
+    scores = np.concatenate([scoring_net.score_embeddings(np.asarray(embeddings[i:i + args.chunk_size])).cpu().numpy()
+                             for i in range(0, len(store), args.chunk_size)] or [np.zeros(0)])
+    elapsed = time.perf_counter() - start
+
+    poses = np.asarray(store.poses)
+    previous_scores = np.asarray(store.scores)
+    np.savez_compressed(args.output, positions=poses[:, :3], directions=poses[:, 3:6], fovs=poses[:, 6],
+                        scores=scores, previous_scores=previous_scores)
+    changed = np.abs(scores - previous_scores)
+    print(f"rescored {len(scores)} embeddings in {elapsed:.2f}s, written to {args.output} "
+          f"(mean score {scores.mean() if len(scores) else 0:.4f}, mean change {changed.mean() if len(changed) else 0:.4f})")
+
+
+if __name__ == "__main__":
+    main()
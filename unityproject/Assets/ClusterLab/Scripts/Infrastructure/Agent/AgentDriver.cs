@@ -23,6 +23,22 @@ namespace ClusterLab.Infrastructure.Agent
         /// <returns></returns>
         IObservable<byte[]> RenderScene(RenderSceneParameters renderSceneParams);
 
+        /// <summary>
+        /// エージェントに指定されたパラメタに従って低解像度の深度マップの計算を要求し、結果を得る
+        /// 各カメラにつき textureSize * textureSize 個の距離[m]を、カメラ順・行優先で並べて返す
+        /// </summary>
+        /// <param name="renderSceneParams"></param>
+        /// <param name="textureSize"></param>
+        /// <returns></returns>
+        float[] RenderDepth(RenderSceneParameters renderSceneParams, int textureSize);
+
+        /// <summary>
+        /// ワールドのバウンディングボックスをボクセルに分割し、コライダーと重ならないボクセルを計算する
+        /// </summary>
+        /// <param name="voxelSize"></param>
+        /// <returns></returns>
+        OccupancyGrid CalculateOccupancyGrid(float voxelSize);
+
         void UpdateConfig(AgentConfig config);
 
         void UpdateNodes(NodeViewModel[] nodes);
@@ -30,6 +46,18 @@ namespace ClusterLab.Infrastructure.Agent
         void ResetNodes();
     }
 
+    [Serializable]
+    public struct OccupancyGrid
+    {
+        public Bounds Bounds;
+        public Vector3Int Dims;
+        public float VoxelSize;
+        /// <summary>
+        /// [x, y, z]の順の行優先で並んだボクセル。1: 空いている, 0: コライダーと重なっている
+        /// </summary>
+        public byte[] Free;
+    }
+
     [Serializable]
     public struct RendererConfig
     {
@@ -56,10 +84,15 @@ namespace ClusterLab.Infrastructure.Agent
     public struct RenderSceneParameters
     {
         public List<CameraParameter> CameraParameters;
+        /// <summary>
+        /// このリクエストのみに適用するテクスチャサイズ。0の場合は UpdateConfig で設定されたサイズを使う
+        /// </summary>
+        public int TextureSize;
 
-        public RenderSceneParameters(List<CameraParameter> cameraParameters)
+        public RenderSceneParameters(List<CameraParameter> cameraParameters, int textureSize = 0)
         {
             CameraParameters = cameraParameters;
+            TextureSize = textureSize;
         }
     }
 
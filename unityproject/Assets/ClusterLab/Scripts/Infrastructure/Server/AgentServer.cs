@@ -1,6 +1,7 @@
 ﻿using System;
 using System.Collections.Generic;
 using System.IO;
+using System.IO.Compression;
 using System.Linq;
 using System.Net;
 using System.Net.Http;
@@ -24,7 +25,7 @@ namespace ClusterLab.Infrastructure.Server
         public int SemaphoreTimeoutMillis { get; set;  } = 3000;
         readonly Semaphore semaphore = new(initialCount: 1, maximumCount: 1);
 
-        static readonly VersionInfo VERSION = new (1, 1, 0, 0);
+        static readonly VersionInfo VERSION = new (1, 2, 0, 0);
         HttpListener listener;
         Thread listenerThread;
 
@@ -141,9 +142,18 @@ namespace ClusterLab.Infrastructure.Server
 
 
 
+        /// <summary>
+        /// リクエストボディのJSONを読む Content-Encoding: gzip の場合は展開してから読む
+        /// </summary>
         private T ParseJson<T>(HttpListenerContext context)
         {
-            using (var reader = new StreamReader(context.Request.InputStream, Encoding.UTF8))
+            Stream body = context.Request.InputStream;
+            if (string.Equals(context.Request.Headers["Content-Encoding"], "gzip", StringComparison.OrdinalIgnoreCase))
+            {
+                body = new GZipStream(body, CompressionMode.Decompress);
+            }
+
+            using (var reader = new StreamReader(body, Encoding.UTF8))
             {
                 var json = reader.ReadToEnd();
                 return JsonUtility.FromJson<T>(json);
@@ -31,6 +31,8 @@ namespace ClusterLab.Infrastructure.Server
                 new(HttpMethod.Get, "/world/bbox$", GetWorldBoundingBoxHandler),
                 new(HttpMethod.Post, "/world/render$", PostRenderSceneRequestHandler),
                 new(HttpMethod.Post, "/world/renderpng$", PostRenderPngSceneRequestHandler),
+                new(HttpMethod.Post, "/world/render/depth$", PostRenderDepthRequestHandler),
+                new(HttpMethod.Post, "/world/occupancy$", PostOccupancyGridRequestHandler),
                 new(HttpMethod.Post, "/world/node$", PostUpdateNode),
                 new(HttpMethod.Post, "/world/node/reset$", PostResetNode),
                 new(HttpMethod.Post, "/config$", PostUpdateConfig),
@@ -99,7 +101,7 @@ namespace ClusterLab.Infrastructure.Server
             var transforms = request.cameraParameters
                 .Select(cp => (Agent.CameraParameter) cp)
                 .ToList();
-            var renderSceneParams = new RenderSceneParameters(transforms);
+            var renderSceneParams = new RenderSceneParameters(transforms, request.textureSize);
             var textureBinaries = agentDriver.RenderScene(renderSceneParams).ToList().Wait();
             var boundary = Guid.NewGuid().ToString();
             var multipartContent = new MultipartFormDataContent(boundary);
@@ -153,6 +155,49 @@ namespace ClusterLab.Infrastructure.Server
             context.Response.Close();
         }
 
+        void PostRenderDepthRequestHandler(HttpListenerContext context)
+        {
+            var request = ParseJson<RenderDepthRequest>(context);
+            var transforms = request.cameraParameters
+                .Select(cp => (Agent.CameraParameter) cp)
+                .ToList();
+            var depths = agentDriver.RenderDepth(new RenderSceneParameters(transforms), request.textureSize);
+
+            // float32(リトルエンディアン)の生配列として返す
+            var body = new byte[depths.Length * sizeof(float)];
+            Buffer.BlockCopy(depths, 0, body, 0, body.Length);
+            context.Response.StatusCode = 200;
+            context.Response.ContentType = "application/octet-stream";
+            context.Response.OutputStream.Write(body);
+            context.Response.Close();
+        }
+
+        void PostOccupancyGridRequestHandler(HttpListenerContext context)
+        {
+            var request = ParseJson<OccupancyGridRequest>(context);
+            var grid = agentDriver.CalculateOccupancyGrid(request.voxelSize);
+            var response = context.Response;
+            response.StatusCode = 200;
+            var responseBody = new OccupancyGridResponse
+            {
+                bbox = new BBox
+                {
+                    min = new Vector3F(grid.Bounds.min),
+                    max = new Vector3F(grid.Bounds.max)
+                },
+                dims = new Vector3I
+                {
+                    x = grid.Dims.x,
+                    y = grid.Dims.y,
+                    z = grid.Dims.z
+                },
+                voxelSize = grid.VoxelSize,
+                free = Convert.ToBase64String(grid.Free)
+            };
+            WriteResponseBody(response, responseBody);
+            response.Close();
+        }
+
         void PostUpdateNode(HttpListenerContext context)
         {
             HandlePostReturnEmpty<UpdateNodesRequest>(context, request =>
@@ -153,6 +153,37 @@ namespace ClusterLab.Infrastructure.Server.ViewModel
     struct RenderSceneRequest
     {
         public CameraParameter[] cameraParameters;
+        public int textureSize; // 0の場合は設定済みのテクスチャサイズを使う
+    }
+
+    [Serializable]
+    struct RenderDepthRequest
+    {
+        public CameraParameter[] cameraParameters;
+        public int textureSize;
+    }
+
+    [Serializable]
+    struct OccupancyGridRequest
+    {
+        public float voxelSize;
+    }
+
+    [Serializable]
+    struct Vector3I
+    {
+        public int x;
+        public int y;
+        public int z;
+    }
+
+    [Serializable]
+    struct OccupancyGridResponse
+    {
+        public BBox bbox;
+        public Vector3I dims;
+        public float voxelSize;
+        public string free; // base64
     }
 
     [Serializable]
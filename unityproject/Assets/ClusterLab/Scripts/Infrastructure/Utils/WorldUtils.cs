@@ -1,5 +1,6 @@
 using System.Collections.Generic;
 using System.Linq;
+using ClusterLab.Infrastructure.Agent;
 using UnityEngine;
 using UnityEngine.SceneManagement;
 
@@ -7,6 +8,11 @@ namespace ClusterLab.Infrastructure.Utils
 {
     public static class WorldUtils
     {
+        /// <summary>
+        /// 深度マップでレイが何にも当たらなかった場合の距離[m]
+        /// </summary>
+        public const float MaxDepthDistance = 1000f;
+
         public static IEnumerable<Collider> GetAllColliders()
         {
             return GetAllScenes()
@@ -24,6 +30,77 @@ namespace ClusterLab.Infrastructure.Utils
             return bounds;
         }
 
+        /// <summary>
+        /// カメラパラメタごとに、視錐台内の textureSize * textureSize 本のレイをコライダーに対して飛ばし、ヒットまでの距離を返す
+        /// 画像を描画せずに壁に向いたカメラを判定するための簡易的な深度マップ
+        /// メインスレッドから呼び出すこと
+        /// </summary>
+        /// <param name="cameraParameters"></param>
+        /// <param name="textureSize"></param>
+        /// <param name="maxDistance">ヒットしなかった場合の距離</param>
+        /// <returns>カメラ順・行優先(上から下)で並んだ距離の配列</returns>
+        public static float[] RaycastDepth(List<CameraParameter> cameraParameters, int textureSize, float maxDistance)
+        {
+            var depths = new float[cameraParameters.Count * textureSize * textureSize];
+            var i = 0;
+            foreach (var cp in cameraParameters)
+            {
+                var aspect = cp.Aspect > 0 ? cp.Aspect : 1f;
+                var tanHalfFov = Mathf.Tan(cp.FieldOfView * 0.5f * Mathf.Deg2Rad);
+                for (var y = 0; y < textureSize; y++)
+                {
+                    var v = (1f - (y + 0.5f) / textureSize * 2f) * tanHalfFov;
+                    for (var x = 0; x < textureSize; x++)
+                    {
+                        var u = ((x + 0.5f) / textureSize * 2f - 1f) * tanHalfFov * aspect;
+                        var direction = cp.Rotation * new Vector3(u, v, 1f).normalized;
+                        depths[i++] = Physics.Raycast(cp.Position, direction, out var hit, maxDistance, LayerUsages.OwnAvatarPhysicsMask)
+                            ? hit.distance
+                            : maxDistance;
+                    }
+                }
+            }
+            return depths;
+        }
+
+        /// <summary>
+        /// ワールドのバウンディングボックスを voxelSize のボクセルに分割し、各ボクセルがコライダーと重なっているかを判定する
+        /// 探索ロジック側で、レンダリングせずに壁や物体の中のカメラ位置を棄却するために使用する
+        /// メインスレッドから呼び出すこと
+        /// </summary>
+        /// <param name="voxelSize"></param>
+        /// <returns></returns>
+        public static OccupancyGrid CalculateOccupancyGrid(float voxelSize)
+        {
+            var bounds = GetWorldBoundingBox();
+            var dims = new Vector3Int(
+                Mathf.Max(1, Mathf.CeilToInt(bounds.size.x / voxelSize)),
+                Mathf.Max(1, Mathf.CeilToInt(bounds.size.y / voxelSize)),
+                Mathf.Max(1, Mathf.CeilToInt(bounds.size.z / voxelSize)));
+            var halfExtents = Vector3.one * (voxelSize * 0.5f);
+            var free = new byte[dims.x * dims.y * dims.z];
+            var i = 0;
+            for (var x = 0; x < dims.x; x++)
+            {
+                for (var y = 0; y < dims.y; y++)
+                {
+                    for (var z = 0; z < dims.z; z++)
+                    {
+                        var center = bounds.min + new Vector3(x + 0.5f, y + 0.5f, z + 0.5f) * voxelSize;
+                        var overlaps = Physics.CheckBox(center, halfExtents, Quaternion.identity, LayerUsages.OwnAvatarPhysicsMask);
+                        free[i++] = (byte) (overlaps ? 0 : 1);
+                    }
+                }
+            }
+            return new OccupancyGrid
+            {
+                Bounds = bounds,
+                Dims = dims,
+                VoxelSize = voxelSize,
+                Free = free
+            };
+        }
+
         static IEnumerable<Scene> GetAllScenes()
         {
             var numScenes = SceneManager.sceneCount;
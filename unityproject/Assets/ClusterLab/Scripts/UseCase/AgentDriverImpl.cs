@@ -20,6 +20,8 @@ namespace ClusterLab.UseCase
     {
         readonly ISceneRenderer sceneRenderer;
         readonly INodeRenderer nodeRenderer;
+        int configuredTextureSize = 224;
+        int activeTextureSize = 224;
 
         public AgentDriverImpl(ISceneRenderer sceneRenderer, INodeRenderer nodeRenderer)
         {
@@ -34,13 +36,40 @@ namespace ClusterLab.UseCase
 
         public IObservable<byte[]> RenderScene(RenderSceneParameters renderSceneParams)
         {
+            // リクエストごとのテクスチャサイズが指定されている場合、レンダラーの設定を一時的に切り替える
+            var textureSize = renderSceneParams.TextureSize > 0 ? renderSceneParams.TextureSize : configuredTextureSize;
+            ApplyTextureSize(textureSize);
             return sceneRenderer
                 .RenderScene(renderSceneParams.CameraParameters);
         }
 
+        void ApplyTextureSize(int textureSize)
+        {
+            if (textureSize == activeTextureSize)
+                return;
+            sceneRenderer.UpdateConfig(new RendererConfig
+            {
+                Width = textureSize,
+                Height = textureSize
+            });
+            activeTextureSize = textureSize;
+        }
+
+        public float[] RenderDepth(RenderSceneParameters renderSceneParams, int textureSize)
+        {
+            return Loan.RunOnMainthreadSynchronized(() =>
+                WorldUtils.RaycastDepth(renderSceneParams.CameraParameters, textureSize, WorldUtils.MaxDepthDistance));
+        }
+
+        public OccupancyGrid CalculateOccupancyGrid(float voxelSize)
+        {
+            return Loan.RunOnMainthreadSynchronized(() => WorldUtils.CalculateOccupancyGrid(voxelSize));
+        }
+
         public void UpdateConfig(AgentConfig config)
         {
-            sceneRenderer.UpdateConfig(config.RendererConfig);
+            configuredTextureSize = config.RendererConfig.Width;
+            ApplyTextureSize(configuredTextureSize);
         }
 
         public void UpdateNodes(NodeViewModel[] nodes)
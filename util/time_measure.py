@@ -1,13 +1,105 @@
+import math
+import threading
 import time
+from typing import Dict, List, Optional
+
+from util.trace import TraceRecorder
+
+_TIME_UNITS = {"s", "ms", "us", "ns"}
+_DEFAULT_LOCK = threading.Lock()
+
+
+class LatencyHistogram:
+    """
+    対数間隔のバケットによる固定メモリのヒストグラム 分位点はバケットの幅 (既定で約9%) の精度で求まる
+    A fixed memory histogram with logarithmically spaced buckets.
+    The percentiles are accurate to the width of a bucket, about 9% by default.
+    """
+
+    def __init__(self, min_value: float = 1e-9, max_value: float = 1e12, buckets_per_octave: int = 8):
+        """
+        Args:
+            min_value: これ以下の値 (0や負の値を含む) は最初のバケットに入る values up to this one, including 0 and negative values, go to the first bucket
+            max_value: これ以上の値は最後のバケットに入る values from this one go to the last bucket
+        """
+        self.min_value = min_value
+        self._scale = buckets_per_octave / math.log(2)
+        self._num_buckets = int(math.ceil(math.log(max_value / min_value) * self._scale)) + 2
+        self.counts: List[int] = [0] * self._num_buckets
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        if value <= self.min_value:
+            i = 0
+        else:
+            i = min(int(math.log(value / self.min_value) * self._scale) + 1, self._num_buckets - 1)
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def percentile(self, q: float) -> float:
+        """
+        Args:
+            q: 0から100の分位 percentile from 0 to 100
+        Returns:
+            the geometric center of the bucket of the percentile, clipped to the observed range
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q / 100.0 * self.count
+        cumulative = 0
+        for i, c in enumerate(self.counts):
+            cumulative += c
+            if c > 0 and cumulative >= rank:
+                break
+        if i == 0:
+            return self.min
+        value = self.min_value * math.exp((i - 0.5) / self._scale)
+        return min(max(value, self.min), self.max)
+
+    def copy(self) -> 'LatencyHistogram':
+        """
+        ロックを取らずにコピーする 記録中のスレッドと競合した場合、直近の1件がずれることがある
+        Copy without any lock, the copy may be off by the value being recorded by another thread.
+        """
+        h = LatencyHistogram.__new__(LatencyHistogram)
+        h.__dict__.update(self.__dict__)
+        h.counts = list(self.counts)
+        return h
+
+    def reset(self):
+        self.counts = [0] * self._num_buckets
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
 
 
 class TimeMeasureSession:
+    """
+    1つの識別子の計測値のヒストグラムと、画像数やバイト数などのカウンタ
+    複数のスレッドから同時に記録できる
+    The histogram of the values measured for an identifier, and counters of items such as images or bytes.
+    Values can be recorded from several threads at once.
+    """
+
     def __init__(self, identifier: str, mult: float = 1.0, unit: str = 'ms'):
         self._start_at = None
         self._stop_at = None
-        self._depth = 0
-        self._time_measurements = []
-        self._counter = 0
+        self._lock = threading.Lock()
+        self.histogram = LatencyHistogram()
+        self.counters: Dict[str, int] = {}
         self.identifier = identifier
         self._mult = mult
         self._unit = unit
@@ -15,84 +107,240 @@ class TimeMeasureSession:
 
     def start(self):
         self._stop_at = None
-        self._start_at = time.time()
+        self._start_at = time.perf_counter_ns()
 
     def stop(self):
-        self._stop_at = time.time()
-        self._time_measurements.append(self.elapsed)
-        self._time_measurements = self._time_measurements[-100:]
+        self._stop_at = time.perf_counter_ns()
+        self.add(self.elapsed)
+
+    def add(self, value: float):
+        with self._lock:
+            self.histogram.add(value)
+
+    def increment(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
 
     @property
     def elapsed(self):
-        if self._stop_at is None:
-            return time.time() - self._start_at
-        return self._stop_at - self._start_at
+        stop_at = self._stop_at if self._stop_at is not None else time.perf_counter_ns()
+        return (stop_at - self._start_at) * 1e-9
+
+    @property
+    def count(self) -> int:
+        return self.histogram.count
+
+    @property
+    def unit(self) -> str:
+        return self._unit
 
     @property
     def average(self):
-        if len(self._time_measurements) == 0:
-            return 0
-        return sum(self._time_measurements) / len(self._time_measurements)
+        return self.histogram.mean
+
+    def percentile(self, q: float) -> float:
+        with self._lock:
+            return self.histogram.percentile(q)
+
+    def snapshot(self) -> LatencyHistogram:
+        """
+        計測中のスレッドを止めないようにロックを取らずにコピーしたヒストグラム (表示用)
+        A copy of the histogram taken without the lock, so that the measuring threads are never blocked (for displays).
+        """
+        return self.histogram.copy()
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            count, mean, p50, p95, p99, max and total in the unit of the session, and the counters
+        """
+        with self._lock:
+            h = self.histogram
+            return {"unit": self._unit,
+                    "count": h.count,
+                    "mean": h.mean * self._mult,
+                    "p50": h.percentile(50) * self._mult,
+                    "p95": h.percentile(95) * self._mult,
+                    "p99": h.percentile(99) * self._mult,
+                    "max": (h.max if h.count > 0 else 0.0) * self._mult,
+                    "total": h.total * self._mult,
+                    "counters": dict(self.counters)}
 
     def print_avg(self):
         space = "".join([" >"] * self.depth)
-        print(f'[TIME]{space}[{self.average * self._mult:08.3f}{self._unit}]{self.identifier}', flush=True)
+        s = self.summary()
+        line = (f'[TIME]{space}[{s["mean"]:08.3f}{self._unit}]{self.identifier}'
+                f' n={s["count"]} p50={s["p50"]:.3f} p95={s["p95"]:.3f} p99={s["p99"]:.3f} max={s["max"]:.3f}')
+        for name, n in s["counters"].items():
+            line += f' {name}={n}'
+            if self._unit in _TIME_UNITS and s["total"] > 0:
+                # throughput per second of measured time
+                line += f' ({n / (s["total"] / self._mult):.1f}/s)'
+        print(line, flush=True)
 
     def reset(self):
-        self._time_measurements = []
+        with self._lock:
+            self.histogram.reset()
+            self.counters = {}
 
 
 class TimeMeasureScope:
-    def __init__(self, tm: 'TimeMeasure', identifier: str):
+    __slots__ = ("tm", "session", "_start_at", "_args")
+
+    def __init__(self, tm: 'TimeMeasure', session: TimeMeasureSession):
         self.tm = tm
-        self.identifier = identifier
+        self.session = session
+        self._start_at = 0
+        # arguments of the trace event, only kept while tracing
+        self._args: Optional[dict] = None
 
     def __enter__(self):
-        self.tm._start_session(self.identifier)
+        self.tm._push(self.session)
+        self._start_at = time.perf_counter_ns()
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
-        self.tm._stop_session(self.identifier)
+        end_at = time.perf_counter_ns()
+        self.tm._pop()
+        self.session.add((end_at - self._start_at) * 1e-9)
+        tracer = self.tm.tracer
+        if tracer is not None:
+            tracer.complete(self.session.identifier, self._start_at, end_at, self._args)
 
+    def count(self, name: str, n: int = 1) -> 'TimeMeasureScope':
+        """
+        このスコープで処理した画像数などを数える Count the items, such as images, processed in this scope.
+        """
+        self.session.increment(name, n)
+        if self.tm.tracer is not None:
+            self.annotate(**{name: n})
+        return self
+
+    def annotate(self, **args) -> 'TimeMeasureScope':
+        """
+        トレースのイベントに引数を付ける トレースしていない場合は何もしない
+        Attach arguments to the trace event of this scope, nothing is kept when not tracing.
+        """
+        if self.tm.tracer is not None:
+            self._args = {**(self._args or {}), **args}
+        return self
+
+
+class _NullScope:
+    """
+    計測が無効なときに measure が返す何もしないスコープ
+    The scope returned by measure when the measurement is disabled, it does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        pass
+
+    def count(self, name: str, n: int = 1) -> '_NullScope':
+        return self
+
+    def annotate(self, **args) -> '_NullScope':
+        return self
+
+
+_NULL_SCOPE = _NullScope()
 
 
 class TimeMeasure:
+    """
+    識別子ごとの処理時間を計測する 入れ子のスコープはスレッドごとに管理するため、複数のスレッドから同じ識別子を計測できる
+    Measures the time spent per identifier. The nesting of the scopes is tracked per thread,
+    so the same identifier can be measured from several threads at once.
+    When disabled, measure returns a shared no-op scope and record does nothing.
+    When a tracer is set, every scope and recorded value is also added to it as a trace event.
+    """
     __TM_GLOBAL = None
-    def __init__(self, identifier: str = '', mult=1000.0, unit='ms'):
+
+    def __init__(self, identifier: str = '', mult=1000.0, unit='ms', enabled: bool = True):
         self._identifier = identifier
         self._mult = mult
         self._unit = unit
-        self._session_stack = []
-        self.sessions = dict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.enabled = enabled
+        self.tracer: Optional[TraceRecorder] = None
+        self.sessions: Dict[str, TimeMeasureSession] = dict()
+
+    @property
+    def _session_stack(self) -> List[str]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _session(self, identifier: str, mult: Optional[float] = None, unit: Optional[str] = None) -> TimeMeasureSession:
+        session = self.sessions.get(identifier)
+        if session is None:
+            with self._lock:
+                session = self.sessions.get(identifier)
+                if session is None:
+                    session = TimeMeasureSession(identifier, self._mult if mult is None else mult, self._unit if unit is None else unit)
+                    self.sessions[identifier] = session
+        return session
 
     def measure(self, identifier: str):
+        if not self.enabled:
+            return _NULL_SCOPE
         if identifier in self._session_stack:
             raise RuntimeError("Identifier must be unique")
-        if identifier not in self.sessions:
-            self.sessions[identifier] = TimeMeasureSession(identifier, self._mult, self._unit)
-        return TimeMeasureScope(self, identifier)
+        return TimeMeasureScope(self, self._session(identifier))
+
+    def record(self, identifier: str, value: float, mult: float = None, unit: str = None):
+        """
+        計測済みの値を記録する 他のスレッドで計測した時間や、キューの長さなどの時間以外の値に使う
+        Record a value measured elsewhere, e.g. a duration measured on another thread,
+        or a value which is not a duration (with its own mult and unit) such as a queue length.
+        """
+        if not self.enabled:
+            return
+        session = self._session(identifier, mult, unit)
+        session.add(value)
+        if self.tracer is not None:
+            if session.unit in _TIME_UNITS:
+                # a duration in seconds which ends now
+                end_at = time.perf_counter_ns()
+                self.tracer.complete(identifier, end_at - int(value * 1e9), end_at)
+            else:
+                self.tracer.counter(identifier, value)
 
-    def _start_session(self, identifier: str):
-        session = self.sessions[identifier]
-        session.depth = len(self._session_stack)
-        session.start()
-        self._session_stack.append(identifier)
+    def count(self, identifier: str, name: str, n: int = 1):
+        """
+        スコープの外で識別子のカウンタを増やす Increment a counter of an identifier outside of its scope.
+        """
+        if not self.enabled:
+            return
+        self._session(identifier).increment(name, n)
 
-    def _stop_session(self, identifier: str):
+    def _push(self, session: TimeMeasureSession):
+        stack = self._session_stack
+        session.depth = len(stack)
+        stack.append(session.identifier)
+
+    def _pop(self):
         self._session_stack.pop()
-        self.sessions[identifier].stop()
+
+    def summary(self) -> Dict[str, dict]:
+        return {identifier: s.summary() for identifier, s in list(self.sessions.items())}
 
     def print_avg(self):
-        for s in self.sessions.values():
+        for s in list(self.sessions.values()):
             s.print_avg()
 
     def reset_all_avg(self):
-        for s in self.sessions.values():
+        for s in list(self.sessions.values()):
             s.reset()
 
     @classmethod
     def default(cls):
         if cls.__TM_GLOBAL is None:
-            cls.__TM_GLOBAL = TimeMeasure()
+            with _DEFAULT_LOCK:
+                if cls.__TM_GLOBAL is None:
+                    cls.__TM_GLOBAL = TimeMeasure()
         return cls.__TM_GLOBAL
-
@@ -0,0 +1,86 @@
+import gzip
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+
+class TraceRecorder:
+    """
+    TimeMeasure のスコープなどのイベントを Chrome trace-event 形式で記録する 書き出したファイルは Perfetto (ui.perfetto.dev) や chrome://tracing で開ける
+    イベントは固定長のリングバッファに保存するため、長い探索でもメモリ使用量は一定で、古いイベントから捨てられる
+    Records events, such as the TimeMeasure scopes, in the Chrome trace-event format.
+    The written file can be opened in Perfetto (ui.perfetto.dev) or chrome://tracing.
+    The events are kept in a fixed size ring buffer, so the memory stays constant on long runs
+    and the oldest events are dropped first.
+    """
+
+    def __init__(self, max_events: int = 1000000):
+        self.max_events = max_events
+        # (phase, name, timestamp [ns], duration [ns], thread id, args)
+        self._events = deque(maxlen=max_events)
+        self._counter = itertools.count(1)
+        self._num_recorded = 0
+        self._thread_names = {}
+        self._origin_ns = time.perf_counter_ns()
+        self._pid = os.getpid()
+
+    def _thread_id(self) -> int:
+        tid = threading.get_native_id()
+        if tid not in self._thread_names:
+            self._thread_names[tid] = threading.current_thread().name
+        return tid
+
+    def _append(self, event: tuple):
+        self._events.append(event)
+        self._num_recorded = next(self._counter)
+
+    def complete(self, name: str, start_ns: int, end_ns: int, args: Optional[dict] = None):
+        """
+        開始と終了の時刻 (time.perf_counter_ns) を持つイベント An event with its begin and end times from time.perf_counter_ns.
+        """
+        self._append(("X", name, start_ns, end_ns - start_ns, self._thread_id(), args))
+
+    def instant(self, name: str, args: Optional[dict] = None):
+        self._append(("i", name, time.perf_counter_ns(), 0, self._thread_id(), args))
+
+    def counter(self, name: str, value: float):
+        """
+        キューの長さなどの値の推移 A value over time, such as the length of a queue.
+        """
+        self._append(("C", name, time.perf_counter_ns(), 0, self._thread_id(), {name: value}))
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    @property
+    def num_dropped(self) -> int:
+        return max(self._num_recorded - len(self._events), 0)
+
+    def trace_events(self) -> list:
+        events = [{"ph": "M", "name": "process_name", "pid": self._pid, "tid": 0, "args": {"name": "panotree explorer"}}]
+        for tid, name in list(self._thread_names.items()):
+            events.append({"ph": "M", "name": "thread_name", "pid": self._pid, "tid": tid, "args": {"name": name}})
+        for phase, name, ts, dur, tid, args in list(self._events):
+            event = {"ph": phase, "name": name, "pid": self._pid, "tid": tid, "ts": (ts - self._origin_ns) / 1000.0}
+            if phase == "X":
+                event["dur"] = dur / 1000.0
+            elif phase == "i":
+                event["s"] = "t"
+            if args:
+                event["args"] = args
+            events.append(event)
+        return events
+
+    def write(self, path: str):
+        """
+        Chrome trace-event のJSONを書き出す 拡張子が .gz の場合はgzipで圧縮する
+        Write the Chrome trace-event JSON, compressed with gzip when the path ends with .gz.
+        """
+        trace = {"traceEvents": self.trace_events(), "displayTimeUnit": "ms",
+                 "otherData": {"droppedEvents": self.num_dropped}}
+        with (gzip.open(path, "wt") if path.endswith(".gz") else open(path, "w")) as f:
+            json.dump(trace, f)